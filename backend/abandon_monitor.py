@@ -0,0 +1,114 @@
+"""
+Abandon Monitor - 送信元のクライアントが切断したまま戻らないプロンプトを猶予時間の後に取り消す
+"""
+
+import asyncio
+from typing import Dict, Any, Optional, Set, Callable, Awaitable
+
+class AbandonMonitor:
+    def __init__(
+        self,
+        cancel: Callable[[str], Awaitable[str]],
+        grace: float = 30.0
+    ):
+        self._cancel = cancel
+        # 切断から取り消しまでの猶予（再読み込み・再接続を待つ）
+        self.grace = grace
+        # prompt_id → クライアントキー（WebSocketのクライアントID、なければprompt_id自身）
+        self._owners: Dict[str, str] = {}
+        self._prompts: Dict[str, Set[str]] = {}
+        # クライアントキー → 接続数（WebSocketとSSEの合計）
+        self._connections: Dict[str, int] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks = set()
+        self.stats = {"watched": 0, "abandoned": 0}
+
+    def watch(self, prompt_id: str, client_key: str):
+        """クライアントの切断で取り消すプロンプトとして登録"""
+        self.release(prompt_id)
+        self._owners[prompt_id] = client_key
+        self._prompts.setdefault(client_key, set()).add(prompt_id)
+        self.stats["watched"] += 1
+        # 一度も接続してこないクライアントのプロンプトも猶予の後に取り消す
+        if not self._connections.get(client_key):
+            self._schedule(client_key)
+
+    def release(self, prompt_id: str):
+        """取り消しの対象から外す（終了時や、他のリクエストが相乗りした場合）"""
+        client_key = self._owners.pop(prompt_id, None)
+        if client_key is None:
+            return
+        prompts = self._prompts.get(client_key)
+        if prompts is not None:
+            prompts.discard(prompt_id)
+            if not prompts:
+                del self._prompts[client_key]
+                self._unschedule(client_key)
+
+    def owner(self, prompt_id: str) -> Optional[str]:
+        return self._owners.get(prompt_id)
+
+    def connected(self, client_key: str):
+        """クライアントの接続（再接続なら取り消しの予定を解除）"""
+        self._connections[client_key] = self._connections.get(client_key, 0) + 1
+        self._unschedule(client_key)
+
+    def disconnected(self, client_key: str):
+        """クライアントの切断（すべての接続が切れたら猶予の後に取り消す）"""
+        count = self._connections.get(client_key, 0) - 1
+        if count > 0:
+            self._connections[client_key] = count
+            return
+        self._connections.pop(client_key, None)
+        if client_key in self._prompts:
+            self._schedule(client_key)
+
+    def _schedule(self, client_key: str):
+        if client_key not in self._timers:
+            self._timers[client_key] = asyncio.get_running_loop().call_later(self.grace, self._abandon, client_key)
+
+    def _unschedule(self, client_key: str):
+        timer = self._timers.pop(client_key, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _abandon(self, client_key: str):
+        self._timers.pop(client_key, None)
+        for prompt_id in self._prompts.pop(client_key, set()):
+            self._owners.pop(prompt_id, None)
+            task = asyncio.create_task(self._cancel_prompt(prompt_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _cancel_prompt(self, prompt_id: str):
+        try:
+            status = await self._cancel(prompt_id)
+        except Exception as e:
+            print(f"[WARNING] Failed to cancel abandoned prompt {prompt_id}: {e}")
+            return
+        if status != "not_found":
+            self.stats["abandoned"] += 1
+            print(f"[INFO] Cancelled abandoned prompt {prompt_id} ({status})")
+
+    def handle_event(self, instance: Optional[str], message: Dict[str, Any]):
+        """終了したプロンプトを取り消しの対象から外す"""
+        event_type = message.get("type")
+        data = message.get("data") or {}
+        finished = event_type in ("execution_success", "execution_error", "execution_interrupted") or (
+            event_type == "executing" and data.get("node") is None
+        )
+        if finished:
+            self.release(data.get("prompt_id"))
+
+    def close(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "grace_seconds": self.grace,
+            "watching": len(self._owners),
+            "pending_abandon": len(self._timers)
+        }
@@ -0,0 +1,181 @@
+"""
+Admission Control - 未処理の仕事量（推定GPU秒）に応じて新しい生成を受け付けるか判断する
+"""
+
+import math
+import time
+import uuid
+from typing import Dict, Any, List, Optional, Callable
+
+# 受け付けの区分（区分ごとに予算を持つ）
+TRAFFIC_CLASSES = ("interactive", "batch")
+
+class AdmissionRejected(Exception):
+    """予算を超えたため受け付けなかった（retry_after秒後に再試行できる見込み）"""
+
+    def __init__(self, traffic: str, backlog: float, budget: float, retry_after: int):
+        super().__init__(
+            f"Too much outstanding {traffic} work ({backlog:.0f}s on the least loaded instance, budget {budget:.0f}s)"
+        )
+        self.traffic = traffic
+        self.backlog = backlog
+        self.budget = budget
+        self.retry_after = retry_after
+
+class _Work:
+    __slots__ = ("traffic", "cost", "instance", "progress", "started_at", "admitted_at")
+
+    def __init__(self, traffic: str, cost: float):
+        self.traffic = traffic
+        self.cost = cost
+        self.instance: Optional[str] = None
+        self.progress = 0.0
+        self.started_at: Optional[float] = None
+        self.admitted_at = time.time()
+
+class AdmissionController:
+    """区分ごとの未処理の仕事量をComfyUIインスタンスごとの推定GPU秒で管理する
+
+    仕事量はestimate_costの相対コストに、インスタンスごとに実行時間から学習した
+    「コスト1あたりの秒数」を掛けて求める。実行中のものは進捗の分だけ差し引く。
+    送り出し先が決まった仕事はそのインスタンスに、まだバックエンドの待ち行列にある仕事は
+    正常なインスタンスに均等に割り振り、新しい仕事は最も空いているインスタンスで判定する。
+    ComfyUIへ送り出し済みの仕事は区分に関係なく新しい仕事より先に実行されるため、
+    他の区分のものも数える（待ち行列にある他の区分の仕事は優先度で追い越せるため数えない）
+    """
+
+    def __init__(
+        self,
+        instances: Callable[[], List[str]],
+        budgets: Dict[str, float],
+        seconds_per_unit: float = 1.5,
+        smoothing: float = 0.2,
+        max_age: float = 1800.0,
+        instance_of: Optional[Callable[[str], Optional[str]]] = None
+    ):
+        # 正常なインスタンスの一覧
+        self._instances = instances
+        # prompt_id → 送り出し先のインスタンス（送り出し前はNone）
+        self._instance_of = instance_of
+        # 区分ごとのインスタンスあたりの上限（秒、0以下で無制限）
+        self.budgets = budgets
+        self.seconds_per_unit = seconds_per_unit
+        self.smoothing = smoothing
+        # 終了イベントを取りこぼした仕事を数えなくするまでの時間
+        self.max_age = max_age
+        # 送信前の受付キーまたは実際のprompt_id → 仕事
+        self._work: Dict[str, _Work] = {}
+        self._rates: Dict[str, float] = {}
+        self.stats = {
+            "admitted": {traffic: 0 for traffic in TRAFFIC_CLASSES},
+            "rejected": {traffic: 0 for traffic in TRAFFIC_CLASSES}
+        }
+
+    def _rate(self, instance: Optional[str]) -> float:
+        if instance is not None and instance in self._rates:
+            return self._rates[instance]
+        if self._rates:
+            return sum(self._rates.values()) / len(self._rates)
+        return self.seconds_per_unit
+
+    def _remaining(self, work: _Work, instance: Optional[str]) -> float:
+        return work.cost * (1.0 - work.progress) * self._rate(instance)
+
+    def backlogs(self, traffic: str) -> Dict[Optional[str], float]:
+        """区分の新しい仕事より先に実行される仕事量（正常なインスタンスごとの推定秒、インスタンスがなければNoneに合計）"""
+        instances = list(self._instances()) or [None]
+        backlogs: Dict[Optional[str], float] = {instance: 0.0 for instance in instances}
+        now = time.time()
+        for key, work in list(self._work.items()):
+            if now - work.admitted_at > self.max_age:
+                del self._work[key]
+                continue
+            if work.instance is None and self._instance_of is not None:
+                work.instance = self._instance_of(key)
+            if work.traffic != traffic and work.instance is None:
+                continue
+            if work.instance in backlogs:
+                backlogs[work.instance] += self._remaining(work, work.instance)
+            elif work.instance is None:
+                # 送り出し前の仕事は、どこで実行されても良いよう均等に割り振る
+                for instance in instances:
+                    backlogs[instance] += self._remaining(work, instance) / len(instances)
+            # 正常でなくなったインスタンスの仕事は他のインスタンスを待たせないため数えない
+        return backlogs
+
+    def backlog(self, traffic: str) -> float:
+        """区分の新しい仕事より先に実行される仕事量（最も空いているインスタンスの推定秒）"""
+        return min(self.backlogs(traffic).values())
+
+    def check(self, traffic: str, cost: float):
+        """最も空いているインスタンスでも予算を超える場合はAdmissionRejected
+
+        区分に未処理の仕事がないインスタンスがあれば大きな仕事も受け付ける
+        """
+        budget = self.budgets.get(traffic, 0)
+        if budget <= 0:
+            return
+        instance, backlog = min(self.backlogs(traffic).items(), key=lambda item: item[1])
+        needed = cost * self._rate(instance)
+        if backlog > 0 and backlog + needed > budget:
+            self.stats["rejected"][traffic] += 1
+            # 未処理の仕事は1秒に1秒分ずつ減る（空になれば必ず受け付ける）
+            retry_after = max(1, math.ceil(min(backlog, backlog + needed - budget)))
+            raise AdmissionRejected(traffic, backlog, budget, retry_after)
+
+    def admit(self, traffic: str, cost: float) -> str:
+        """受け付けた仕事を登録して受付キーを返す（送信後にassignでprompt_idと結び付ける）"""
+        key = str(uuid.uuid4())
+        self._work[key] = _Work(traffic, cost)
+        self.stats["admitted"][traffic] += 1
+        return key
+
+    def assign(self, key: str, prompt_id: str):
+        """受付キーを実際のprompt_idに置き換える（まとめ実行のメンバーは1つの仕事に合算、まとめるのは同じ区分どうし）"""
+        work = self._work.pop(key, None)
+        if work is None:
+            return
+        existing = self._work.get(prompt_id)
+        if existing is not None:
+            existing.cost += work.cost
+        else:
+            self._work[prompt_id] = work
+
+    def discard(self, key: str):
+        """送信に失敗した仕事を取り除く"""
+        self._work.pop(key, None)
+
+    def handle_event(self, instance: Optional[str], message: Dict[str, Any]):
+        """実行状況を反映し、完了時に実行時間からコスト1あたりの秒数を学習"""
+        event_type = message.get("type")
+        data = message.get("data") or {}
+        work = self._work.get(data.get("prompt_id"))
+        if work is None:
+            return
+        if event_type == "execution_start":
+            work.instance = instance
+            work.started_at = time.time()
+        elif event_type == "progress" and data.get("max"):
+            work.progress = min(1.0, data.get("value", 0) / data["max"])
+        elif event_type == "execution_success" or (event_type == "executing" and data.get("node") is None):
+            del self._work[data["prompt_id"]]
+            if work.started_at is not None and instance is not None and work.cost > 0:
+                observed = (time.time() - work.started_at) / work.cost
+                current = self._rates.get(instance, self.seconds_per_unit)
+                self._rates[instance] = current + self.smoothing * (observed - current)
+        elif event_type in ("execution_error", "execution_interrupted"):
+            del self._work[data["prompt_id"]]
+
+    def get_stats(self) -> Dict[str, Any]:
+        backlogs = {traffic: self.backlogs(traffic) for traffic in TRAFFIC_CLASSES}
+        return {
+            **self.stats,
+            "budgets": self.budgets,
+            "backlog_seconds": {traffic: round(min(backlogs[traffic].values()), 2) for traffic in TRAFFIC_CLASSES},
+            "backlog_seconds_by_instance": {
+                traffic: {instance or "unassigned": round(seconds, 2) for instance, seconds in backlogs[traffic].items()}
+                for traffic in TRAFFIC_CLASSES
+            },
+            "seconds_per_unit": {instance: round(rate, 3) for instance, rate in self._rates.items()},
+            "tracked": len(self._work)
+        }
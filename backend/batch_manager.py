@@ -0,0 +1,350 @@
+"""
+Batch Manager - 複数の生成リクエスト（X/Yグリッド）をまとめて投入・監視
+"""
+
+import asyncio
+import io
+import itertools
+import math
+import random
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple, Set, Callable, Awaitable, AsyncIterator
+
+from PIL import Image, ImageDraw
+
+# グリッドで変化させられるパラメータ
+GRID_AXES = (
+    "seed",
+    "cfg_scale",
+    "steps",
+    "sampler_name",
+    "scheduler",
+    "denoising_strength",
+    "width",
+    "height",
+    "model",
+    "vae",
+    "prompt",
+    "negative_prompt"
+)
+
+TERMINAL_STATUSES = ("completed", "error")
+
+LABEL_HEIGHT = 20
+
+def expand_grid(
+    base: Dict[str, Any],
+    grid: Dict[str, List[Any]],
+    max_items: int
+) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """グリッド指定を(変化させたパラメータ, リクエスト内容)の組に展開"""
+    for axis, values in grid.items():
+        if axis not in GRID_AXES:
+            raise ValueError(f"Unsupported grid axis: {axis}")
+        if not values:
+            raise ValueError(f"Grid axis has no values: {axis}")
+    total = math.prod(len(values) for values in grid.values())
+    if total > max_items:
+        raise ValueError(f"Grid expands to {total} items (max {max_items})")
+
+    base = dict(base)
+    # シードを変化させない場合は全セルで同じシードを使う（セル同士を比較できるように）
+    if "seed" not in grid and base.get("seed", -1) == -1:
+        base["seed"] = random.randint(0, 0xffffffffffffffff)
+    variants = []
+    for combination in itertools.product(*grid.values()):
+        params = dict(zip(grid.keys(), combination))
+        variants.append((params, {**base, **params}))
+    return variants
+
+def format_label(index: int, params: Dict[str, Any]) -> str:
+    """コンタクトシートのセルに表示するラベル"""
+    if not params:
+        return f"#{index + 1}"
+    return ", ".join(f"{name}={value}" for name, value in params.items())
+
+def render_contact_sheet(
+    images: List[Optional[bytes]],
+    labels: List[str],
+    columns: int,
+    cell_size: int
+) -> bytes:
+    """各セルの画像を縮小して1枚のJPEGに並べる"""
+    columns = max(1, min(columns, len(images)))
+    rows = math.ceil(len(images) / columns)
+    sheet = Image.new("RGB", (columns * cell_size, rows * (cell_size + LABEL_HEIGHT)), (32, 32, 32))
+    draw = ImageDraw.Draw(sheet)
+    max_chars = max(4, cell_size // 6)
+    for index, (data, label) in enumerate(zip(images, labels)):
+        x = (index % columns) * cell_size
+        y = (index // columns) * (cell_size + LABEL_HEIGHT)
+        if data is not None:
+            try:
+                with Image.open(io.BytesIO(data)) as image:
+                    image.draft("RGB", (cell_size, cell_size))
+                    thumbnail = image.convert("RGB")
+                thumbnail.thumbnail((cell_size, cell_size))
+                sheet.paste(thumbnail, (x + (cell_size - thumbnail.width) // 2, y + (cell_size - thumbnail.height) // 2))
+            except Exception as e:
+                print(f"[WARNING] Failed to render contact sheet cell {index}: {e}")
+                data = None
+        if data is None:
+            draw.text((x + 4, y + cell_size // 2), "no image", fill=(160, 160, 160))
+        if len(label) > max_chars:
+            label = label[:max_chars - 1] + "…"
+        draw.text((x + 4, y + cell_size + 4), label, fill=(230, 230, 230))
+    output = io.BytesIO()
+    sheet.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+class BatchManager:
+    def __init__(
+        self,
+        submit: Callable[[Any], Awaitable[Dict[str, Any]]],
+        get_status: Callable[[str], Awaitable[Dict[str, Any]]],
+        fetch_image: Callable[[str, Dict[str, Any]], Awaitable[bytes]],
+        max_concurrency: int = 4,
+        max_batches: int = 200,
+        poll_interval: float = 2.0
+    ):
+        self._submit = submit
+        self._get_status = get_status
+        self._fetch_image = fetch_image
+        self.max_concurrency = max_concurrency
+        self.max_batches = max_batches
+        # イベントが届かない場合もこの間隔で状態を確認する
+        self.poll_interval = poll_interval
+        # 全バッチで共有する同時投入数の上限
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._batches: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # prompt_id → batch_id
+        self._prompt_batches: Dict[str, str] = {}
+        self._waiters: Dict[str, Set[asyncio.Event]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def create(
+        self,
+        requests: List[Any],
+        params: List[Dict[str, Any]],
+        axes: Optional[Dict[str, List[Any]]] = None
+    ) -> Dict[str, Any]:
+        """バッチを登録し、バックグラウンドで投入を開始"""
+        batch_id = str(uuid.uuid4())
+        if axes and len(axes) >= 2:
+            # 最後の軸を横方向に並べる
+            columns = len(list(axes.values())[-1])
+        else:
+            columns = math.ceil(math.sqrt(len(requests)))
+        batch = {
+            "batch_id": batch_id,
+            "status": "submitting",
+            "created_at": time.time(),
+            "completed_at": None,
+            "axes": axes,
+            "columns": columns,
+            "items": [
+                {
+                    "index": index,
+                    "params": item_params,
+                    "prompt_id": None,
+                    "instance": None,
+                    "status": "queued",
+                    "queue_position": None,
+                    "progress": None,
+                    "outputs": [],
+                    "error": None
+                }
+                for index, item_params in enumerate(params)
+            ],
+            "contact_sheets": {}
+        }
+        self._batches[batch_id] = batch
+        while len(self._batches) > self.max_batches:
+            self._forget(next(iter(self._batches)))
+        self._tasks[batch_id] = asyncio.create_task(self._submit_all(batch, requests))
+        return batch
+
+    def _forget(self, batch_id: str):
+        """古いバッチを破棄"""
+        batch = self._batches.pop(batch_id, None)
+        if batch is None:
+            return
+        for item in batch["items"]:
+            if item["prompt_id"]:
+                self._prompt_batches.pop(item["prompt_id"], None)
+        task = self._tasks.pop(batch_id, None)
+        if task is not None:
+            task.cancel()
+        for waiter in self._waiters.pop(batch_id, ()):
+            waiter.set()
+
+    async def _submit_all(self, batch: Dict[str, Any], requests: List[Any]):
+        """上限付きの並列数でComfyUIへ投入"""
+        async def submit_one(item: Dict[str, Any], request: Any):
+            async with self._semaphore:
+                try:
+                    result = await self._submit(request)
+                except Exception as e:
+                    item["status"] = "error"
+                    item["error"] = getattr(e, "detail", None) or str(e)
+                else:
+                    item["prompt_id"] = result["prompt_id"]
+                    item["instance"] = result.get("instance")
+                    item["status"] = "pending"
+                    self._prompt_batches[result["prompt_id"]] = batch["batch_id"]
+            self._notify(batch["batch_id"])
+
+        try:
+            await asyncio.gather(*(submit_one(item, request) for item, request in zip(batch["items"], requests)))
+        finally:
+            self._tasks.pop(batch["batch_id"], None)
+        batch["status"] = "running"
+        self._update_batch_status(batch)
+        self._notify(batch["batch_id"])
+
+    def handle_event(self, instance: str, message: Dict[str, Any]):
+        """ComfyUIのイベントを受けて該当バッチの監視者を起こす"""
+        prompt_id = (message.get("data") or {}).get("prompt_id")
+        batch_id = self._prompt_batches.get(prompt_id) if prompt_id else None
+        if batch_id is not None:
+            self._notify(batch_id)
+
+    def _notify(self, batch_id: str):
+        for waiter in self._waiters.get(batch_id, ()):
+            waiter.set()
+
+    def get(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """バッチを取得"""
+        return self._batches.get(batch_id)
+
+    async def refresh(self, batch: Dict[str, Any]):
+        """未完了の項目の状態を更新"""
+        items = [
+            item for item in batch["items"]
+            if item["prompt_id"] and item["status"] not in TERMINAL_STATUSES
+        ]
+        statuses = await asyncio.gather(
+            *(self._get_status(item["prompt_id"]) for item in items),
+            return_exceptions=True
+        )
+        for item, status in zip(items, statuses):
+            if isinstance(status, Exception):
+                print(f"[WARNING] Failed to get status for {item['prompt_id']}: {status}")
+                continue
+            if status.get("status") == "not_found":
+                # ComfyUIの再起動などで見失ったプロンプトは失敗として終わらせる（バッチが完了しなくなるため）
+                item["status"] = "error"
+                item["queue_position"] = None
+                item["progress"] = None
+                item["error"] = item["error"] or "Prompt not found"
+                continue
+            item["status"] = status.get("status", item["status"])
+            # 投入時には送り出し先が未定のことがある
+            item["instance"] = status.get("instance") or item["instance"]
+            item["queue_position"] = status.get("queue_position")
+            item["progress"] = status.get("progress")
+            if status.get("outputs"):
+                item["outputs"] = status["outputs"]
+            if status.get("error"):
+                item["error"] = status["error"]
+        self._update_batch_status(batch)
+
+    def _update_batch_status(self, batch: Dict[str, Any]):
+        """全項目が終わったらバッチを完了にする"""
+        if batch["status"] == "running" and all(item["status"] in TERMINAL_STATUSES for item in batch["items"]):
+            batch["status"] = "completed"
+            batch["completed_at"] = time.time()
+
+    async def watch(self, batch_id: str) -> AsyncIterator[Tuple[Optional[str], Optional[Dict[str, Any]]]]:
+        """バッチの変化を(イベント名, データ)で順に返す（変化がない間は(None, None)）"""
+        batch = self._batches.get(batch_id)
+        if batch is None:
+            return
+        waiter = asyncio.Event()
+        self._waiters.setdefault(batch_id, set()).add(waiter)
+        sent: Dict[int, Tuple[Any, ...]] = {}
+        try:
+            await self.refresh(batch)
+            yield "batch", self.to_dict(batch)
+            for item in batch["items"]:
+                sent[item["index"]] = self._item_state(item)
+            while True:
+                if batch["status"] == "completed":
+                    yield "completed", self.summarize(batch)
+                    return
+                try:
+                    await asyncio.wait_for(waiter.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    yield None, None
+                waiter.clear()
+                if batch_id not in self._batches:
+                    return
+                await self.refresh(batch)
+                for item in batch["items"]:
+                    state = self._item_state(item)
+                    if sent.get(item["index"]) != state:
+                        sent[item["index"]] = state
+                        yield "item", dict(item)
+        finally:
+            waiters = self._waiters.get(batch_id)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[batch_id]
+
+    @staticmethod
+    def _item_state(item: Dict[str, Any]) -> Tuple[Any, ...]:
+        return (item["status"], item["queue_position"], item["progress"], len(item["outputs"]), item["prompt_id"])
+
+    def summarize(self, batch: Dict[str, Any]) -> Dict[str, Any]:
+        """件数の集計"""
+        counts = {"queued": 0, "pending": 0, "running": 0, "completed": 0, "error": 0}
+        for item in batch["items"]:
+            counts[item["status"]] = counts.get(item["status"], 0) + 1
+        return {
+            "batch_id": batch["batch_id"],
+            "status": batch["status"],
+            "total": len(batch["items"]),
+            "counts": counts,
+            "created_at": batch["created_at"],
+            "completed_at": batch["completed_at"]
+        }
+
+    def to_dict(self, batch: Dict[str, Any]) -> Dict[str, Any]:
+        """APIで返す形式に変換"""
+        return {
+            **self.summarize(batch),
+            "axes": batch["axes"],
+            "columns": batch["columns"],
+            "items": [dict(item) for item in batch["items"]]
+        }
+
+    async def contact_sheet(self, batch_id: str, cell_size: int = 256) -> Optional[bytes]:
+        """各項目の最初の出力を並べたコンタクトシートを作成（完了後はキャッシュ）"""
+        batch = self._batches.get(batch_id)
+        if batch is None:
+            return None
+        cached = batch["contact_sheets"].get(cell_size)
+        if cached is not None:
+            return cached
+
+        async def load(item: Dict[str, Any]) -> Optional[bytes]:
+            outputs = [output for output in item["outputs"] if output.get("type", "output") == "output"]
+            if not outputs:
+                return None
+            async with self._semaphore:
+                try:
+                    return await self._fetch_image(item["prompt_id"], outputs[0])
+                except Exception as e:
+                    print(f"[WARNING] Failed to fetch {outputs[0]['filename']} for contact sheet: {e}")
+                    return None
+
+        await self.refresh(batch)
+        images = await asyncio.gather(*(load(item) for item in batch["items"]))
+        labels = [format_label(item["index"], item["params"]) for item in batch["items"]]
+        data = await asyncio.to_thread(render_contact_sheet, images, labels, batch["columns"], cell_size)
+        if batch["status"] == "completed":
+            batch["contact_sheets"][cell_size] = data
+        return data
@@ -0,0 +1,344 @@
+"""
+ComfyUI Bridge Pool - 複数のComfyUIインスタンスへの振り分けを管理
+"""
+
+import asyncio
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple, Callable
+
+from comfyui_bridge import ComfyUIBridge
+from job_status import JobStatusTable
+
+def get_model_key(workflow: Dict[str, Any]) -> Optional[Tuple]:
+    """ワークフローが読み込むチェックポイント・VAE・LoRAの組を返す"""
+    checkpoint = None
+    vae = None
+    loras = []
+    for node in workflow.values():
+        class_type = node.get("class_type")
+        inputs = node.get("inputs", {})
+        if class_type == "CheckpointLoaderSimple":
+            checkpoint = inputs.get("ckpt_name")
+        elif class_type == "VAELoader":
+            vae = inputs.get("vae_name")
+        elif class_type == "LoraLoader":
+            loras.append(inputs.get("lora_name"))
+    if checkpoint is None:
+        return None
+    return (checkpoint, vae, tuple(sorted(loras)))
+
+class ComfyUIBridgePool:
+    def __init__(
+        self,
+        comfyui_urls: List[str],
+        connection_limit: int = 100,
+        health_interval: float = 10.0,
+        max_tracked_prompts: int = 10000,
+        affinity_max_extra_queue: int = 3,
+        max_status_entries: int = 5000,
+        catalog_ttl: float = 300.0
+    ):
+        if not comfyui_urls:
+            raise ValueError("At least one ComfyUI URL is required")
+        self.bridges = [
+            ComfyUIBridge(url, connection_limit=connection_limit, catalog_ttl=catalog_ttl)
+            for url in comfyui_urls
+        ]
+        self.health_interval = health_interval
+        self.max_tracked_prompts = max_tracked_prompts
+        # モデルが常駐しているインスタンスを優先する際に許容するキュー長の差
+        self.affinity_max_extra_queue = affinity_max_extra_queue
+        # 各インスタンスが最後に読み込んだモデルの組（実行を開始したプロンプトのもの）
+        self.loaded_models: Dict[str, Optional[Tuple]] = {bridge.comfyui_url: None for bridge in self.bridges}
+        # 実行開始前のprompt_id → 読み込むモデルの組
+        self._prompt_models: "OrderedDict[str, Tuple]" = OrderedDict()
+        self.affinity_stats = {"hits": 0, "misses": 0, "overflows": 0}
+        self._route_counter = 0
+        self._last_routed: Dict[str, int] = {bridge.comfyui_url: 0 for bridge in self.bridges}
+        self.healthy: Dict[str, bool] = {bridge.comfyui_url: True for bridge in self.bridges}
+        # 送信中（まだキュー深さに反映されていない）プロンプト数
+        self._submitting: Dict[str, int] = {bridge.comfyui_url: 0 for bridge in self.bridges}
+        # prompt_id / 出力ファイル名 → 担当インスタンス
+        self._prompt_owner: "OrderedDict[str, ComfyUIBridge]" = OrderedDict()
+        self._output_owner: "OrderedDict[str, ComfyUIBridge]" = OrderedDict()
+        self._health_task: Optional[asyncio.Task] = None
+        # WebSocketイベントから更新される実行状態テーブル
+        self.jobs = JobStatusTable(max_entries=max_status_entries)
+        self._event_listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+
+    async def start(self):
+        """全インスタンスのセッションを開き、ヘルスチェックを開始"""
+        for bridge in self.bridges:
+            await bridge.start()
+            bridge.start_event_listener(self._on_event, self._on_events_connected)
+        await self.check_health()
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        """ヘルスチェックを停止し、全セッションを閉じる"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+        for bridge in self.bridges:
+            await bridge.close()
+
+    async def _health_loop(self):
+        """定期的に全インスタンスの疎通を確認"""
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check_health()
+
+    def _on_event(self, bridge: ComfyUIBridge, message: Dict[str, Any]):
+        """ComfyUIのイベントを状態テーブルに反映し、リスナーへ通知"""
+        entry = self.jobs.handle_event(bridge.comfyui_url, message)
+        if entry is not None and message.get("type") == "executed":
+            for output in entry["outputs"]:
+                self._remember(self._output_owner, output["filename"], bridge)
+        self._track_loaded_model(bridge.comfyui_url, message)
+        self._notify_listeners(bridge.comfyui_url, message)
+
+    def publish_event(self, instance: Optional[str], message: Dict[str, Any]):
+        """ComfyUIを経由しないイベント（送信前の失敗など）を状態テーブルとリスナーに反映"""
+        self.jobs.handle_event(instance, message)
+        self._track_loaded_model(instance, message)
+        self._notify_listeners(instance, message)
+
+    def _track_loaded_model(self, instance: Optional[str], message: Dict[str, Any]):
+        """実行を開始したプロンプトのモデルを常駐モデルとする（開始前に取り消されたものは反映しない）"""
+        event_type = message.get("type")
+        if event_type not in ("execution_start", "execution_success", "execution_error", "execution_interrupted"):
+            return
+        model_key = self._prompt_models.pop((message.get("data") or {}).get("prompt_id"), None)
+        if event_type == "execution_start" and model_key is not None and instance in self.loaded_models:
+            self.loaded_models[instance] = model_key
+
+    def _notify_listeners(self, instance: Optional[str], message: Dict[str, Any]):
+        for listener in self._event_listeners:
+            try:
+                listener(instance, message)
+            except Exception as e:
+                print(f"[WARNING] Event listener failed: {e}")
+
+    def add_event_listener(self, listener: Callable[[str, Dict[str, Any]], None]):
+        """ComfyUIのイベントを受け取るリスナーを登録"""
+        self._event_listeners.append(listener)
+
+    def _on_events_connected(self, bridge: ComfyUIBridge):
+        """再接続時、切断中に取りこぼした可能性のあるエントリに印を付ける"""
+        self.jobs.mark_stale(bridge.comfyui_url)
+
+    async def check_health(self) -> Dict[str, bool]:
+        """全インスタンスの疎通を確認して状態を更新"""
+        results = await asyncio.gather(*(bridge.check_connection() for bridge in self.bridges))
+        for bridge, ok in zip(self.bridges, results):
+            if self.healthy.get(bridge.comfyui_url) != ok:
+                print(f"[INFO] ComfyUI instance {bridge.comfyui_url} is now {'healthy' if ok else 'unhealthy'}")
+            self.healthy[bridge.comfyui_url] = ok
+        return dict(self.healthy)
+
+    async def check_connection(self) -> bool:
+        """いずれかのインスタンスに接続できるか確認"""
+        results = await self.check_health()
+        return any(results.values())
+
+    def healthy_bridges(self) -> List[ComfyUIBridge]:
+        """正常なインスタンスの一覧（全滅時は全インスタンス）"""
+        bridges = [bridge for bridge in self.bridges if self.healthy.get(bridge.comfyui_url)]
+        return bridges or list(self.bridges)
+
+    def get_bridge(self, comfyui_url: str) -> Optional[ComfyUIBridge]:
+        """URLからインスタンスを取得"""
+        for bridge in self.bridges:
+            if bridge.comfyui_url == comfyui_url.rstrip("/"):
+                return bridge
+        return None
+
+    async def get_queue_depths(self, bridges: Optional[List[ComfyUIBridge]] = None) -> Dict[str, int]:
+        """各インスタンスのキュー深さ（送信中を含む）を取得"""
+        bridges = bridges if bridges is not None else self.healthy_bridges()
+        depths = await asyncio.gather(*(bridge.get_queue_depth() for bridge in bridges))
+        result = {}
+        for bridge, depth in zip(bridges, depths):
+            if depth < 0:
+                # 取得に失敗したインスタンスは後回しにする
+                self.healthy[bridge.comfyui_url] = False
+                depth = float("inf")
+            result[bridge.comfyui_url] = depth + self._submitting[bridge.comfyui_url]
+        return result
+
+    async def select_bridge(self, model_key: Optional[Tuple] = None) -> ComfyUIBridge:
+        """モデルが常駐しているインスタンスを優先し、なければキューが最も短いインスタンスを選択"""
+        bridges = self.healthy_bridges()
+        if len(bridges) == 1:
+            return bridges[0]
+        depths = await self.get_queue_depths(bridges)
+        # 同じキュー長なら、モデル未読み込み→最も長く使われていないインスタンスを優先（常駐モデルの追い出しを避ける）
+        least_loaded = min(bridges, key=lambda bridge: (
+            depths[bridge.comfyui_url],
+            self.loaded_models[bridge.comfyui_url] is not None,
+            self._last_routed[bridge.comfyui_url]
+        ))
+        if model_key is None:
+            return least_loaded
+        
+        resident = [bridge for bridge in bridges if self.loaded_models[bridge.comfyui_url] == model_key]
+        if not resident:
+            self.affinity_stats["misses"] += 1
+            return least_loaded
+        
+        best = min(resident, key=lambda bridge: depths[bridge.comfyui_url])
+        if depths[best.comfyui_url] - depths[least_loaded.comfyui_url] <= self.affinity_max_extra_queue:
+            self.affinity_stats["hits"] += 1
+            return best
+        # 常駐インスタンスが混みすぎている場合は最も空いているインスタンスへ
+        self.affinity_stats["overflows"] += 1
+        return least_loaded
+
+    def _remember(self, table: "OrderedDict[str, Any]", key: str, value: Any):
+        """担当インスタンスなどを記録（上限を超えたら古いものから削除）"""
+        table[key] = value
+        table.move_to_end(key)
+        while len(table) > self.max_tracked_prompts:
+            table.popitem(last=False)
+
+    def get_bridge_for_prompt(self, prompt_id: str) -> ComfyUIBridge:
+        """prompt_idを担当するインスタンスを取得"""
+        return self._prompt_owner.get(prompt_id) or self.healthy_bridges()[0]
+
+    def get_instance(self, prompt_id: str) -> Optional[str]:
+        """prompt_idを送信したインスタンスのURL（未送信・不明ならNone）"""
+        bridge = self._prompt_owner.get(prompt_id)
+        return bridge.comfyui_url if bridge is not None else None
+
+    def get_bridge_for_output(self, filename: str) -> ComfyUIBridge:
+        """出力ファイルを保持しているインスタンスを取得"""
+        return self._output_owner.get(filename) or self.healthy_bridges()[0]
+
+    async def queue_prompt(
+        self,
+        workflow: Dict[str, Any],
+        input_images: Optional[List[Dict[str, Any]]] = None,
+        prompt_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """モデルの常駐状況とキュー長を考慮してワークフローを送信（必要な入力画像は先にアップロード）"""
+        model_key = get_model_key(workflow)
+        bridge = await self.select_bridge(model_key)
+        self._submitting[bridge.comfyui_url] += 1
+        try:
+            for image in input_images or []:
+                await bridge.ensure_uploaded(image["filename"], image["path"])
+            result = await bridge.queue_prompt(workflow, prompt_id)
+        except Exception as e:
+            result = {"success": False, "error": f"Failed to upload input image: {e}"}
+        finally:
+            self._submitting[bridge.comfyui_url] -= 1
+        if result.get("success"):
+            self._remember(self._prompt_owner, result["prompt_id"], bridge)
+            job = self.jobs.track(result["prompt_id"], bridge.comfyui_url, result.get("number"))
+            self._route_counter += 1
+            self._last_routed[bridge.comfyui_url] = self._route_counter
+            # 常駐モデルはexecution_startで更新する（実行前に取り消されたプロンプトのモデルは読み込まれない）
+            if model_key is not None:
+                if job["started_at"] is not None:
+                    # 応答より先にexecution_startが届いていた場合
+                    self.loaded_models[bridge.comfyui_url] = model_key
+                elif job["status"] == "pending":
+                    self._remember(self._prompt_models, result["prompt_id"], model_key)
+        result["instance"] = bridge.comfyui_url
+        return result
+
+    async def cancel_prompt(self, prompt_id: str) -> Dict[str, Any]:
+        """担当インスタンスでプロンプトを取り消す（キューから削除した場合は中断イベントを代わりに通知）"""
+        bridge = self._prompt_owner.get(prompt_id)
+        if bridge is None:
+            return {"status": "not_found", "instance": None}
+        status = await bridge.cancel_prompt(prompt_id)
+        if status == "removed":
+            # 実行前に削除されたプロンプトについてComfyUIはイベントを送らない
+            self.publish_event(bridge.comfyui_url, {
+                "type": "execution_interrupted",
+                "data": {"prompt_id": prompt_id}
+            })
+        return {"status": status, "instance": bridge.comfyui_url}
+
+    async def get_prompt_status(self, prompt_id: str) -> Dict[str, Any]:
+        """プロンプトの状態を取得（イベント購読中はメモリから、それ以外は担当インスタンスに問い合わせ）"""
+        bridge = self.get_bridge_for_prompt(prompt_id)
+        entry = self.jobs.get(prompt_id)
+        if entry is not None and bridge.events_connected and not entry.get("stale"):
+            status = self.jobs.to_status(entry)
+            # 出力イベントを受け取れなかった完了ジョブは履歴で補う
+            if status["status"] != "completed" or status["outputs"]:
+                return status
+        return await bridge.get_prompt_status(prompt_id)
+
+    async def get_history(self, prompt_id: str) -> Dict[str, Any]:
+        """担当インスタンスから履歴を取得し、出力ファイルの所在を記録"""
+        bridge = self.get_bridge_for_prompt(prompt_id)
+        history = await bridge.get_history(prompt_id)
+        for output in history.get("outputs", []):
+            self._remember(self._output_owner, output["filename"], bridge)
+        return history
+
+    def resolve_output_bridge(self, filename: str, prompt_id: Optional[str] = None) -> ComfyUIBridge:
+        """出力ファイルを保持しているインスタンスを特定"""
+        if prompt_id:
+            return self.get_bridge_for_prompt(prompt_id)
+        return self.get_bridge_for_output(filename)
+
+    async def get_image(
+        self,
+        filename: str,
+        subfolder: str = "",
+        folder_type: str = "output",
+        prompt_id: Optional[str] = None
+    ) -> bytes:
+        """出力ファイルを保持しているインスタンスから画像を取得"""
+        bridge = self.resolve_output_bridge(filename, prompt_id)
+        return await bridge.get_image(filename, subfolder, folder_type)
+
+    async def get_catalog(self, force_refresh: bool = False) -> Dict[str, Any]:
+        """正常なインスタンスのカタログを取得"""
+        return await self.healthy_bridges()[0].get_catalog(force_refresh)
+
+    def invalidate_catalogs(self):
+        """全インスタンスのカタログキャッシュを無効化"""
+        for bridge in self.bridges:
+            bridge.invalidate_catalog()
+
+    async def get_models(self) -> List[Dict[str, str]]:
+        """利用可能なモデルの一覧を取得"""
+        return await self.healthy_bridges()[0].get_models()
+
+    async def get_loras(self) -> List[Dict[str, str]]:
+        """利用可能なLoRAの一覧を取得"""
+        return await self.healthy_bridges()[0].get_loras()
+
+    def get_instances(self) -> List[Dict[str, Any]]:
+        """インスタンスの一覧と状態"""
+        instances = []
+        for bridge in self.bridges:
+            loaded = self.loaded_models[bridge.comfyui_url]
+            instances.append({
+                "url": bridge.comfyui_url,
+                "healthy": self.healthy.get(bridge.comfyui_url, False),
+                "loaded_models": {
+                    "checkpoint": loaded[0],
+                    "vae": loaded[1],
+                    "loras": list(loaded[2])
+                } if loaded else None
+            })
+        return instances
+    
+    def get_affinity_stats(self) -> Dict[str, Any]:
+        """モデル常駐ルーティングのヒット数・ミス数"""
+        routed = sum(self.affinity_stats.values())
+        return {
+            **self.affinity_stats,
+            "hit_ratio": self.affinity_stats["hits"] / routed if routed else 0.0,
+            "max_extra_queue": self.affinity_max_extra_queue
+        }
@@ -0,0 +1,60 @@
+"""
+Catalog View - フロントエンド向けの統合カタログ（カタログ更新時に一度だけJSON化・圧縮）
+"""
+
+import gzip
+import hashlib
+import json
+from typing import Dict, Any, Optional
+
+from samplers_config import SAMPLERS, SCHEDULERS, group_by_category
+
+# 応答ボディがこのサイズ未満なら圧縮しない
+MIN_GZIP_SIZE = 1024
+
+def build_catalog_view(catalog: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """ComfyUIのカタログとsamplers_configの説明をまとめる（カタログがなければ設定の一覧のみ）"""
+    catalog = catalog or {}
+    # ComfyUIが実際に受け付ける値を優先し、説明はsamplers_configから補う
+    samplers = catalog.get("samplers") or list(SAMPLERS)
+    schedulers = catalog.get("schedulers") or list(SCHEDULERS)
+    # 取得時刻などは含めない（内容が同じなら再取得後もETagが変わらない）
+    return {
+        "models": [{"name": name, "type": "checkpoint"} for name in catalog.get("checkpoints", [])],
+        "loras": [{"name": name, "type": "lora"} for name in catalog.get("loras", [])],
+        "vaes": catalog.get("vaes", []),
+        "embeddings": catalog.get("embeddings", []),
+        "upscale_models": catalog.get("upscale_models", []),
+        "controlnets": catalog.get("controlnets", []),
+        "samplers": samplers,
+        "samplers_by_category": group_by_category(samplers, SAMPLERS),
+        "schedulers": schedulers,
+        "schedulers_by_category": group_by_category(schedulers, SCHEDULERS)
+    }
+
+class CatalogView:
+    """シリアライズ済みのカタログ応答（ボディ・gzip・ETag）"""
+
+    __slots__ = ("body", "gzip_body", "etag")
+
+    def __init__(self, view: Dict[str, Any]):
+        self.body = json.dumps(view, ensure_ascii=False, separators=(",", ":")).encode()
+        self.gzip_body = gzip.compress(self.body, mtime=0) if len(self.body) >= MIN_GZIP_SIZE else None
+        # 圧縮の有無で表現が変わるため弱いETagにする
+        self.etag = 'W/"' + hashlib.sha1(self.body).hexdigest() + '"'
+
+class CatalogViewCache:
+    """カタログが更新されたときだけ応答を作り直す"""
+
+    def __init__(self):
+        self._catalog: Optional[Dict[str, Any]] = None
+        self._view = CatalogView(build_catalog_view(None))
+        self.builds = 0
+
+    def get(self, catalog: Optional[Dict[str, Any]]) -> CatalogView:
+        """カタログに対応する応答を取得（カタログがない場合は前回のもの）"""
+        if catalog is not None and catalog is not self._catalog:
+            self._view = CatalogView(build_catalog_view(catalog))
+            self._catalog = catalog
+            self.builds += 1
+        return self._view
@@ -5,108 +5,198 @@ ComfyUI Bridge - ComfyUIとの通信を管理
 import aiohttp
 import json
 import asyncio
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Callable
 import websockets
 import uuid
 import os
+import time
 from datetime import datetime
 
+# 呼び出し種別ごとのタイムアウト（秒）
+DEFAULT_TIMEOUTS = {
+    "health": 5,
+    "queue": 30,
+    "status": 10,
+    "image": 60,
+    "object_info": 30,
+    "control": 10,
+}
+
+def _get_input_options(object_info: Dict[str, Any], class_type: str, input_name: str) -> List[str]:
+    """ノード定義から列挙型入力の選択肢を取得"""
+    inputs = object_info.get(class_type, {}).get("input", {})
+    spec = inputs.get("required", {}).get(input_name) or inputs.get("optional", {}).get(input_name)
+    if not spec:
+        return []
+    # 旧形式: [["a", "b"], {...}]、新形式: ["COMBO", {"options": ["a", "b"]}]
+    if isinstance(spec[0], list):
+        return spec[0]
+    if spec[0] == "COMBO" and len(spec) > 1:
+        return spec[1].get("options", [])
+    return []
+
 class ComfyUIBridge:
-    def __init__(self, comfyui_url: str = "http://127.0.0.1:8188"):
-        self.comfyui_url = comfyui_url
+    def __init__(
+        self,
+        comfyui_url: str = "http://127.0.0.1:8188",
+        connection_limit: int = 100,
+        timeouts: Optional[Dict[str, float]] = None,
+        catalog_ttl: float = 300.0
+    ):
+        self.comfyui_url = comfyui_url.rstrip("/")
         self.client_id = str(uuid.uuid4())
+        self.connection_limit = connection_limit
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self._session: Optional[aiohttp.ClientSession] = None
+        # 常駐WebSocketによるイベント購読
+        self.events_connected = False
+        self._event_task: Optional[asyncio.Task] = None
+        # /object_infoのカタログキャッシュ
+        self.catalog_ttl = catalog_ttl
+        self.catalog_version = 0
+        self._catalog: Optional[Dict[str, Any]] = None
+        self._catalog_fetched_at = 0.0
+        self._catalog_fetch: Optional[asyncio.Future] = None
+        # アップロード済みの入力画像（コンテンツハッシュ名）
+        self.uploaded_inputs: set = set()
+        self._uploading: Dict[str, asyncio.Future] = {}
+    
+    async def start(self):
+        """共有HTTPセッションを開く（アプリ起動時に呼ぶ）"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.connection_limit,
+                limit_per_host=self.connection_limit,
+                keepalive_timeout=60,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+    
+    async def close(self):
+        """共有HTTPセッションを閉じる（アプリ終了時に呼ぶ）"""
+        await self.stop_event_listener()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """共有セッションを取得（未起動の場合は遅延生成）"""
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+    
+    def _timeout(self, kind: str) -> aiohttp.ClientTimeout:
+        """呼び出し種別に応じたタイムアウトを返す"""
+        return aiohttp.ClientTimeout(total=self.timeouts[kind])
         
     async def check_connection(self) -> bool:
         """ComfyUIへの接続状態を確認"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{self.comfyui_url}/system_stats",
-                    timeout=aiohttp.ClientTimeout(total=5)
-                ) as response:
-                    return response.status == 200
+            session = await self._get_session()
+            async with session.get(
+                f"{self.comfyui_url}/system_stats",
+                timeout=self._timeout("health")
+            ) as response:
+                return response.status == 200
         except Exception as e:
             print(f"[WARNING] ComfyUI connection check failed: {e}")
             return False
         
-    async def queue_prompt(self, workflow: Dict[str, Any]) -> Dict[str, Any]:
-        """ワークフローをComfyUIのキューに送信"""
+    async def queue_prompt(self, workflow: Dict[str, Any], prompt_id: Optional[str] = None) -> Dict[str, Any]:
+        """ワークフローをComfyUIのキューに送信（prompt_idを指定するとそのIDで登録される）"""
         try:
             prompt = {"prompt": workflow, "client_id": self.client_id}
+            if prompt_id is not None:
+                prompt["prompt_id"] = prompt_id
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{self.comfyui_url}/prompt",
-                    json=prompt
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return {
-                            "success": True,
-                            "prompt_id": result.get("prompt_id"),
-                            "number": result.get("number", 0)
-                        }
-                    else:
-                        error_text = await response.text()
-                        return {
-                            "success": False,
-                            "error": f"ComfyUI returned status {response.status}: {error_text}"
-                        }
+            session = await self._get_session()
+            async with session.post(
+                f"{self.comfyui_url}/prompt",
+                json=prompt,
+                timeout=self._timeout("queue")
+            ) as response:
+                if response.status == 200:
+                    result = await response.json()
+                    return {
+                        "success": True,
+                        "prompt_id": result.get("prompt_id"),
+                        "number": result.get("number", 0)
+                    }
+                else:
+                    error_text = await response.text()
+                    return {
+                        "success": False,
+                        "error": f"ComfyUI returned status {response.status}: {error_text}"
+                    }
         except Exception as e:
             return {
                 "success": False,
                 "error": f"Failed to connect to ComfyUI: {str(e)}"
             }
     
+    async def get_queue_depth(self) -> int:
+        """キューに残っているプロンプト数を取得（取得失敗時は-1）"""
+        try:
+            session = await self._get_session()
+            # /queueは全プロンプトを含むため、軽量な/promptのexec_infoを使う
+            async with session.get(f"{self.comfyui_url}/prompt", timeout=self._timeout("status")) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    return int(data.get("exec_info", {}).get("queue_remaining", 0))
+                return -1
+        except Exception as e:
+            print(f"[WARNING] Failed to get queue depth from {self.comfyui_url}: {e}")
+            return -1
+    
     async def get_prompt_status(self, prompt_id: str) -> Dict[str, Any]:
         """プロンプトの実行状態を取得"""
         try:
-            async with aiohttp.ClientSession() as session:
-                # キューの状態を確認
-                async with session.get(f"{self.comfyui_url}/queue") as response:
-                    if response.status == 200:
-                        queue_data = await response.json()
-                        
-                        # 実行中のプロンプトを確認
-                        running = queue_data.get("queue_running", [])
-                        for item in running:
-                            if item[1] == prompt_id:
-                                return {
-                                    "status": "running",
-                                    "queue_position": 0,
-                                    "progress": item[2] if len(item) > 2 else None
-                                }
-                        
-                        # 待機中のプロンプトを確認
-                        pending = queue_data.get("queue_pending", [])
-                        for i, item in enumerate(pending):
-                            if item[1] == prompt_id:
-                                return {
-                                    "status": "pending",
-                                    "queue_position": i + 1,
-                                    "progress": None
-                                }
-                        
-                        # 履歴を確認（完了済み）
-                        history = await self.get_history(prompt_id)
-                        if history.get("outputs"):
+            session = await self._get_session()
+            # キューの状態を確認
+            async with session.get(f"{self.comfyui_url}/queue", timeout=self._timeout("status")) as response:
+                if response.status == 200:
+                    queue_data = await response.json()
+                    
+                    # 実行中のプロンプトを確認
+                    running = queue_data.get("queue_running", [])
+                    for item in running:
+                        if item[1] == prompt_id:
                             return {
-                                "status": "completed",
+                                "status": "running",
                                 "queue_position": 0,
-                                "progress": None,
-                                "outputs": history["outputs"]
+                                "progress": item[2] if len(item) > 2 else None
                             }
-                        
-                        return {
-                            "status": "not_found",
-                            "queue_position": -1,
-                            "progress": None
-                        }
-                    else:
+                    
+                    # 待機中のプロンプトを確認
+                    pending = queue_data.get("queue_pending", [])
+                    for i, item in enumerate(pending):
+                        if item[1] == prompt_id:
+                            return {
+                                "status": "pending",
+                                "queue_position": i + 1,
+                                "progress": None
+                            }
+                    
+                    # 履歴を確認（完了済み）
+                    history = await self.get_history(prompt_id)
+                    if history.get("outputs"):
                         return {
-                            "status": "error",
-                            "error": f"Failed to get queue status: {response.status}"
+                            "status": "completed",
+                            "queue_position": 0,
+                            "progress": None,
+                            "outputs": history["outputs"]
                         }
+                    
+                    return {
+                        "status": "not_found",
+                        "queue_position": -1,
+                        "progress": None
+                    }
+                else:
+                    return {
+                        "status": "error",
+                        "error": f"Failed to get queue status: {response.status}"
+                    }
         except Exception as e:
             return {
                 "status": "error",
@@ -116,43 +206,55 @@ class ComfyUIBridge:
     async def get_history(self, prompt_id: str) -> Dict[str, Any]:
         """プロンプトの実行履歴を取得"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{self.comfyui_url}/history/{prompt_id}") as response:
-                    if response.status == 200:
-                        history = await response.json()
+            session = await self._get_session()
+            async with session.get(
+                f"{self.comfyui_url}/history/{prompt_id}",
+                timeout=self._timeout("status")
+            ) as response:
+                if response.status == 200:
+                    history = await response.json()
+                    
+                    if prompt_id in history:
+                        prompt_history = history[prompt_id]
+                        outputs = prompt_history.get("outputs", {})
                         
-                        if prompt_id in history:
-                            prompt_history = history[prompt_id]
-                            outputs = prompt_history.get("outputs", {})
-                            
-                            # 画像出力を整理
-                            images = []
-                            for node_id, node_output in outputs.items():
-                                if "images" in node_output:
-                                    for image in node_output["images"]:
-                                        images.append({
-                                            "filename": image["filename"],
-                                            "subfolder": image.get("subfolder", ""),
-                                            "type": image.get("type", "output"),
-                                            "node_id": node_id
-                                        })
-                            
-                            return {
-                                "prompt_id": prompt_id,
-                                "outputs": images,
-                                "status": prompt_history.get("status", {}),
-                                "completed_at": datetime.now().isoformat()
-                            }
-                        else:
-                            return {
-                                "prompt_id": prompt_id,
-                                "outputs": [],
-                                "status": "not_found"
-                            }
+                        # 画像出力を整理
+                        images = []
+                        for node_id, node_output in outputs.items():
+                            if "images" in node_output:
+                                for image in node_output["images"]:
+                                    images.append({
+                                        "filename": image["filename"],
+                                        "subfolder": image.get("subfolder", ""),
+                                        "type": image.get("type", "output"),
+                                        "node_id": node_id
+                                    })
+                        
+                        # 完了時刻はComfyUIが記録した終了メッセージのタイムスタンプ（ミリ秒）から求める
+                        completed_at = None
+                        status = prompt_history.get("status", {})
+                        for message_type, message_data in status.get("messages", []):
+                            if message_type in ("execution_success", "execution_error", "execution_interrupted"):
+                                timestamp = (message_data or {}).get("timestamp")
+                                if timestamp:
+                                    completed_at = datetime.fromtimestamp(timestamp / 1000).isoformat()
+                        
+                        return {
+                            "prompt_id": prompt_id,
+                            "outputs": images,
+                            "status": status,
+                            "completed_at": completed_at
+                        }
                     else:
                         return {
-                            "error": f"Failed to get history: {response.status}"
+                            "prompt_id": prompt_id,
+                            "outputs": [],
+                            "status": "not_found"
                         }
+                else:
+                    return {
+                        "error": f"Failed to get history: {response.status}"
+                    }
         except Exception as e:
             return {
                 "error": str(e)
@@ -167,41 +269,154 @@ class ComfyUIBridge:
                 "type": folder_type
             }
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f"{self.comfyui_url}/view",
-                    params=params
-                ) as response:
-                    if response.status == 200:
-                        return await response.read()
-                    else:
-                        raise Exception(f"Failed to get image: {response.status}")
+            session = await self._get_session()
+            async with session.get(
+                f"{self.comfyui_url}/view",
+                params=params,
+                timeout=self._timeout("image")
+            ) as response:
+                if response.status == 200:
+                    return await response.read()
+                else:
+                    raise Exception(f"Failed to get image: {response.status}")
         except Exception as e:
             raise Exception(f"Failed to get image: {str(e)}")
     
+    async def open_image(
+        self,
+        filename: str,
+        subfolder: str = "",
+        folder_type: str = "output",
+        range_header: Optional[str] = None
+    ) -> aiohttp.ClientResponse:
+        """ComfyUIの/viewをストリーミング用に開く（呼び出し側でrelease()すること）"""
+        params = {
+            "filename": filename,
+            "subfolder": subfolder,
+            "type": folder_type
+        }
+        headers = {"Range": range_header} if range_header else None
+        session = await self._get_session()
+        # 大きな画像でも打ち切られないよう、全体ではなく読み取り間隔で制限する
+        return await session.get(
+            f"{self.comfyui_url}/view",
+            params=params,
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.timeouts["health"], sock_read=self.timeouts["image"])
+        )
+    
+    async def has_input_image(self, filename: str) -> bool:
+        """入力フォルダに画像が存在するか確認"""
+        try:
+            session = await self._get_session()
+            async with session.head(
+                f"{self.comfyui_url}/view",
+                params={"filename": filename, "type": "input"},
+                timeout=self._timeout("status")
+            ) as response:
+                return response.status == 200
+        except Exception:
+            return False
+    
+    async def upload_image(self, filename: str, path: str) -> bool:
+        """入力画像を/upload/imageへストリーミング送信"""
+        session = await self._get_session()
+        with open(path, "rb") as f:
+            form = aiohttp.FormData()
+            form.add_field("image", f, filename=filename)
+            form.add_field("type", "input")
+            form.add_field("overwrite", "true")
+            async with session.post(
+                f"{self.comfyui_url}/upload/image",
+                data=form,
+                timeout=self._timeout("image")
+            ) as response:
+                if response.status != 200:
+                    raise Exception(f"Failed to upload image: {response.status}")
+        return True
+    
+    async def ensure_uploaded(self, filename: str, path: str):
+        """入力画像がなければアップロード（同じ画像は二度送らない）"""
+        if filename in self.uploaded_inputs:
+            return
+        upload = self._uploading.get(filename)
+        if upload is None:
+            async def run():
+                try:
+                    if not await self.has_input_image(filename):
+                        await self.upload_image(filename, path)
+                    self.uploaded_inputs.add(filename)
+                finally:
+                    self._uploading.pop(filename, None)
+            upload = self._uploading[filename] = asyncio.ensure_future(run())
+        await asyncio.shield(upload)
+    
+    async def get_catalog(self, force_refresh: bool = False) -> Dict[str, Any]:
+        """/object_infoを解析したカタログを取得（TTL付きキャッシュ、同時呼び出しは1回の取得を共有）"""
+        if (
+            not force_refresh
+            and self._catalog is not None
+            and time.monotonic() - self._catalog_fetched_at < self.catalog_ttl
+        ):
+            return self._catalog
+        if self._catalog_fetch is None:
+            self._catalog_fetch = asyncio.ensure_future(self._fetch_catalog())
+        try:
+            # 呼び出し元のキャンセルで共有の取得処理が止まらないようにする
+            return await asyncio.shield(self._catalog_fetch)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # 取得に失敗した場合は古いカタログがあればそれを返す
+            if self._catalog is not None:
+                return self._catalog
+            raise
+    
+    def invalidate_catalog(self):
+        """カタログキャッシュを無効化（次回呼び出し時に再取得）"""
+        self._catalog_fetched_at = 0.0
+    
+    async def _fetch_catalog(self) -> Dict[str, Any]:
+        """/object_infoと/embeddingsを取得してカタログを作成"""
+        try:
+            session = await self._get_session()
+            async with session.get(f"{self.comfyui_url}/object_info", timeout=self._timeout("object_info")) as response:
+                if response.status != 200:
+                    raise Exception(f"Failed to get object_info: {response.status}")
+                object_info = await response.json()
+            
+            embeddings = []
+            try:
+                async with session.get(f"{self.comfyui_url}/embeddings", timeout=self._timeout("status")) as response:
+                    if response.status == 200:
+                        embeddings = await response.json()
+            except Exception as e:
+                print(f"[WARNING] Failed to get embeddings: {e}")
+            
+            self.catalog_version += 1
+            self._catalog = {
+                "version": self.catalog_version,
+                "fetched_at": datetime.now().isoformat(),
+                "checkpoints": _get_input_options(object_info, "CheckpointLoaderSimple", "ckpt_name"),
+                "loras": _get_input_options(object_info, "LoraLoader", "lora_name"),
+                "vaes": _get_input_options(object_info, "VAELoader", "vae_name"),
+                "embeddings": embeddings,
+                "upscale_models": _get_input_options(object_info, "UpscaleModelLoader", "model_name"),
+                "controlnets": _get_input_options(object_info, "ControlNetLoader", "control_net_name"),
+                "samplers": _get_input_options(object_info, "KSampler", "sampler_name"),
+                "schedulers": _get_input_options(object_info, "KSampler", "scheduler"),
+                "object_info": object_info
+            }
+            self._catalog_fetched_at = time.monotonic()
+            return self._catalog
+        finally:
+            self._catalog_fetch = None
+    
     async def get_models(self) -> List[Dict[str, str]]:
         """利用可能なモデルの一覧を取得"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{self.comfyui_url}/object_info") as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        
-                        # CheckpointLoaderSimpleノードの情報から取得
-                        checkpoint_loader = data.get("CheckpointLoaderSimple", {})
-                        input_info = checkpoint_loader.get("input", {}).get("required", {})
-                        ckpt_names = input_info.get("ckpt_name", [[]])[0]
-                        
-                        models = []
-                        for model_name in ckpt_names:
-                            models.append({
-                                "name": model_name,
-                                "type": "checkpoint"
-                            })
-                        
-                        return models
-                    else:
-                        return []
+            catalog = await self.get_catalog()
+            return [{"name": name, "type": "checkpoint"} for name in catalog["checkpoints"]]
         except Exception as e:
             print(f"Failed to get models: {e}")
             return []
@@ -209,26 +424,8 @@ class ComfyUIBridge:
     async def get_loras(self) -> List[Dict[str, str]]:
         """利用可能なLoRAの一覧を取得"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{self.comfyui_url}/object_info") as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        
-                        # LoraLoaderノードの情報から取得
-                        lora_loader = data.get("LoraLoader", {})
-                        input_info = lora_loader.get("input", {}).get("required", {})
-                        lora_names = input_info.get("lora_name", [[]])[0]
-                        
-                        loras = []
-                        for lora_name in lora_names:
-                            loras.append({
-                                "name": lora_name,
-                                "type": "lora"
-                            })
-                        
-                        return loras
-                    else:
-                        return []
+            catalog = await self.get_catalog()
+            return [{"name": name, "type": "lora"} for name in catalog["loras"]]
         except Exception as e:
             print(f"Failed to get LoRAs: {e}")
             return []
@@ -236,24 +433,114 @@ class ComfyUIBridge:
     async def interrupt(self) -> bool:
         """現在の生成を中断"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(f"{self.comfyui_url}/interrupt") as response:
-                    return response.status == 200
+            session = await self._get_session()
+            async with session.post(f"{self.comfyui_url}/interrupt", timeout=self._timeout("control")) as response:
+                return response.status == 200
         except Exception as e:
             print(f"Failed to interrupt: {e}")
             return False
     
+    async def _find_in_queue(self, prompt_id: str) -> Optional[str]:
+        """キュー内のプロンプトの状態（"running" / "pending"、見つからなければNone）"""
+        session = await self._get_session()
+        async with session.get(f"{self.comfyui_url}/queue", timeout=self._timeout("status")) as response:
+            response.raise_for_status()
+            queue_data = await response.json()
+        if any(item[1] == prompt_id for item in queue_data.get("queue_running", [])):
+            return "running"
+        if any(item[1] == prompt_id for item in queue_data.get("queue_pending", [])):
+            return "pending"
+        return None
+    
+    async def cancel_prompt(self, prompt_id: str) -> str:
+        """指定したプロンプトだけを取り消す（待機中はキューから削除、実行中なら中断）
+
+        "removed" / "interrupted" / "not_found" / "error" を返す。
+        削除の間に実行が始まった場合は中断する
+        """
+        try:
+            session = await self._get_session()
+            state = await self._find_in_queue(prompt_id)
+            if state == "pending":
+                async with session.post(
+                    f"{self.comfyui_url}/queue",
+                    json={"delete": [prompt_id]},
+                    timeout=self._timeout("control")
+                ) as response:
+                    response.raise_for_status()
+                state = await self._find_in_queue(prompt_id)
+                if state is None:
+                    return "removed"
+            if state == "running":
+                # prompt_idを渡すと、実行中のプロンプトが別のものに替わっていた場合は中断されない
+                async with session.post(
+                    f"{self.comfyui_url}/interrupt",
+                    json={"prompt_id": prompt_id},
+                    timeout=self._timeout("control")
+                ) as response:
+                    return "interrupted" if response.status == 200 else "error"
+            return "not_found" if state is None else "error"
+        except Exception as e:
+            print(f"[WARNING] Failed to cancel {prompt_id} on {self.comfyui_url}: {e}")
+            return "error"
+    
     async def clear_queue(self) -> bool:
         """キューをクリア"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(f"{self.comfyui_url}/queue") as response:
-                    return response.status == 200
+            session = await self._get_session()
+            async with session.post(f"{self.comfyui_url}/queue", timeout=self._timeout("control")) as response:
+                return response.status == 200
         except Exception as e:
             print(f"Failed to clear queue: {e}")
             return False
     
-    async def connect_websocket(self):
-        """ComfyUIのWebSocketに接続"""
+    def connect_websocket(self):
+        """ComfyUIのWebSocketに接続（await / async with の両方で利用可能）"""
         ws_url = self.comfyui_url.replace("http://", "ws://").replace("https://", "wss://")
-        return await websockets.connect(f"{ws_url}/ws?clientId={self.client_id}")
\ No newline at end of file
+        return websockets.connect(f"{ws_url}/ws?clientId={self.client_id}")
+    
+    def start_event_listener(
+        self,
+        on_message: Callable[["ComfyUIBridge", Dict[str, Any]], None],
+        on_connect: Optional[Callable[["ComfyUIBridge"], None]] = None
+    ):
+        """ComfyUIのWebSocketを常時購読し、受信したJSONメッセージをコールバックに渡す"""
+        if self._event_task is None:
+            self._event_task = asyncio.create_task(self._event_loop(on_message, on_connect))
+    
+    async def stop_event_listener(self):
+        """イベント購読を停止"""
+        if self._event_task is not None:
+            self._event_task.cancel()
+            try:
+                await self._event_task
+            except asyncio.CancelledError:
+                pass
+            self._event_task = None
+    
+    async def _event_loop(self, on_message, on_connect):
+        """切断時は指数バックオフで再接続しながらイベントを受信"""
+        backoff = 1
+        while True:
+            try:
+                async with self.connect_websocket() as ws:
+                    self.events_connected = True
+                    backoff = 1
+                    if on_connect is not None:
+                        on_connect(self)
+                    async for message in ws:
+                        # バイナリはプレビュー画像なので無視
+                        if isinstance(message, bytes):
+                            continue
+                        try:
+                            on_message(self, json.loads(message))
+                        except Exception as e:
+                            print(f"[WARNING] Failed to handle ComfyUI event: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[WARNING] ComfyUI event stream {self.comfyui_url} disconnected: {e}")
+            finally:
+                self.events_connected = False
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
\ No newline at end of file
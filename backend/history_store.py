@@ -0,0 +1,323 @@
+"""
+History Store - 完了した生成をSQLiteに保存（書き込みはまとめてスレッドで実行）
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+# 一覧・検索で一度に返す最大件数
+MAX_PAGE_SIZE = 200
+
+COLUMNS = (
+    "prompt_id", "user", "mode", "model", "prompt", "negative_prompt", "seed", "params",
+    "outputs", "status", "error", "instance", "queued_at", "started_at", "completed_at"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    prompt_id TEXT PRIMARY KEY,
+    user TEXT,
+    mode TEXT,
+    model TEXT,
+    prompt TEXT,
+    negative_prompt TEXT,
+    seed TEXT,
+    params TEXT,
+    outputs TEXT,
+    status TEXT,
+    error TEXT,
+    instance TEXT,
+    queued_at REAL,
+    started_at REAL,
+    completed_at REAL
+);
+CREATE INDEX IF NOT EXISTS generations_completed_at ON generations(completed_at, prompt_id);
+CREATE INDEX IF NOT EXISTS generations_model ON generations(model, completed_at, prompt_id);
+CREATE INDEX IF NOT EXISTS generations_user ON generations(user, completed_at, prompt_id);
+CREATE TRIGGER IF NOT EXISTS generations_fts_insert AFTER INSERT ON generations BEGIN
+    INSERT INTO generations_fts(rowid, prompt, negative_prompt) VALUES (new.rowid, new.prompt, new.negative_prompt);
+END;
+CREATE TRIGGER IF NOT EXISTS generations_fts_delete AFTER DELETE ON generations BEGIN
+    INSERT INTO generations_fts(generations_fts, rowid, prompt, negative_prompt) VALUES ('delete', old.rowid, old.prompt, old.negative_prompt);
+END;
+CREATE TRIGGER IF NOT EXISTS generations_fts_update AFTER UPDATE ON generations BEGIN
+    INSERT INTO generations_fts(generations_fts, rowid, prompt, negative_prompt) VALUES ('delete', old.rowid, old.prompt, old.negative_prompt);
+    INSERT INTO generations_fts(rowid, prompt, negative_prompt) VALUES (new.rowid, new.prompt, new.negative_prompt);
+END;
+"""
+
+# 3文字単位の索引（空白で区切られない日本語のプロンプトも部分一致で検索できる）
+FTS_SCHEMA = "CREATE VIRTUAL TABLE IF NOT EXISTS generations_fts USING fts5(prompt, negative_prompt, content='generations', content_rowid='rowid', tokenize='{tokenizer}')"
+MIN_TRIGRAM_LENGTH = 3
+
+def workflow_seed(workflow: Dict[str, Any]) -> Optional[int]:
+    """ワークフローで実際に使われるシード（ランダム指定でも確定した値）"""
+    for node in workflow.values():
+        inputs = node.get("inputs") or {}
+        for name in ("seed", "noise_seed"):
+            if isinstance(inputs.get(name), int):
+                return inputs[name]
+    return None
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
+
+def _cursor(record: Dict[str, Any]) -> str:
+    return f"{record['completed_at']!r}:{record['prompt_id']}"
+
+def _parse_cursor(cursor: Optional[str]) -> Optional[Tuple[float, str]]:
+    if not cursor:
+        return None
+    completed_at, _, prompt_id = cursor.partition(":")
+    try:
+        return float(completed_at), prompt_id
+    except ValueError:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+class HistoryStore:
+    def __init__(self, path: str = "data/history.db", flush_interval: float = 0.5, max_active: int = 10000):
+        self.path = path
+        # 完了した記録をまとめて書き込む間隔
+        self.flush_interval = flush_interval
+        self.max_active = max_active
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.tokenizer = "trigram"
+        # 実行待ち・実行中の記録
+        self._active: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # 完了して書き込み待ちの記録（書き込むまでの問い合わせはここから返す）
+        self._unflushed: Dict[str, Dict[str, Any]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"recorded": 0, "flushes": 0, "write_errors": 0}
+
+    async def start(self):
+        await asyncio.to_thread(self._open)
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            conn.execute(FTS_SCHEMA.format(tokenizer="trigram"))
+        except sqlite3.OperationalError:
+            # trigramはSQLite 3.34以降
+            self.tokenizer = "unicode61"
+            conn.execute(FTS_SCHEMA.format(tokenizer="unicode61"))
+        conn.executescript(SCHEMA)
+        conn.commit()
+        self._conn = conn
+
+    def register(self, prompt_id: str, record: Dict[str, Any]):
+        """送信したプロンプトの条件を記録（完了時に保存する）"""
+        self._active[prompt_id] = {
+            **{column: None for column in COLUMNS},
+            **record,
+            "prompt_id": prompt_id,
+            "outputs": [],
+            "status": "pending",
+            "queued_at": time.time()
+        }
+        while len(self._active) > self.max_active:
+            self._active.popitem(last=False)
+
+    def handle_event(self, instance: Optional[str], message: Dict[str, Any]):
+        """実行イベントから出力・時刻・結果を記録"""
+        event_type = message.get("type")
+        data = message.get("data") or {}
+        record = self._active.get(data.get("prompt_id"))
+        if record is None:
+            return
+        if instance and not record["instance"]:
+            record["instance"] = instance
+        if event_type == "execution_start":
+            record["status"] = "running"
+            record["started_at"] = time.time()
+        elif event_type == "executed":
+            for image in (data.get("output") or {}).get("images", []):
+                record["outputs"].append({
+                    "filename": image["filename"],
+                    "subfolder": image.get("subfolder", ""),
+                    "type": image.get("type", "output"),
+                    "node_id": data.get("node")
+                })
+        elif event_type == "execution_success" or (event_type == "executing" and data.get("node") is None):
+            self._finish(record, "completed", None)
+        elif event_type == "execution_error":
+            self._finish(record, "error", data.get("exception_message") or "Execution failed")
+        elif event_type == "execution_interrupted":
+            self._finish(record, "interrupted", "Execution interrupted")
+
+    def _finish(self, record: Dict[str, Any], status: str, error: Optional[str]):
+        self._active.pop(record["prompt_id"], None)
+        record["status"] = status
+        record["error"] = error
+        record["completed_at"] = time.time()
+        self._unflushed[record["prompt_id"]] = record
+        self.stats["recorded"] += 1
+        self._wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """書き込み待ちの記録を1つのトランザクションで保存"""
+        if not self._unflushed or self._conn is None:
+            return
+        records = list(self._unflushed.values())
+        try:
+            await asyncio.to_thread(self._write, records)
+        except Exception as e:
+            # 書き込めない記録が他の記録を巻き込まないよう1件ずつ書き直す
+            print(f"[WARNING] Batch write of generation history failed, retrying one by one: {e}")
+            for record in records:
+                try:
+                    await asyncio.to_thread(self._write, [record])
+                except Exception as e:
+                    self.stats["write_errors"] += 1
+                    print(f"[ERROR] Dropping history of {record['prompt_id']}: {e}")
+        for record in records:
+            if self._unflushed.get(record["prompt_id"]) is record:
+                del self._unflushed[record["prompt_id"]]
+        self.stats["flushes"] += 1
+
+    def _write(self, records: List[Dict[str, Any]]):
+        rows = [tuple(self._column_value(record, column) for column in COLUMNS) for record in records]
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in COLUMNS[1:])
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    f"INSERT INTO generations ({', '.join(COLUMNS)}) VALUES ({placeholders}) "
+                    f"ON CONFLICT(prompt_id) DO UPDATE SET {updates}",
+                    rows
+                )
+
+    @staticmethod
+    def _column_value(record: Dict[str, Any], column: str) -> Any:
+        value = record[column]
+        if column in ("params", "outputs"):
+            return json.dumps(value, ensure_ascii=False)
+        if column == "seed" and value is not None:
+            # シードは64ビット符号なしのためSQLiteの整数に収まらない
+            return str(value)
+        return value
+
+    def _query(self, sql: str, params: List[Any]) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        records = []
+        for row in rows:
+            record = dict(row)
+            record["params"] = json.loads(record["params"]) if record["params"] else {}
+            record["outputs"] = json.loads(record["outputs"]) if record["outputs"] else []
+            record["seed"] = int(record["seed"]) if record["seed"] is not None else None
+            records.append(record)
+        return records
+
+    async def get(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        """1件取得（実行中・書き込み待ちの記録も含む）"""
+        record = self._active.get(prompt_id) or self._unflushed.get(prompt_id)
+        if record is not None:
+            return self.to_dict(record)
+        rows = await asyncio.to_thread(self._query, f"SELECT {', '.join(COLUMNS)} FROM generations WHERE prompt_id = ?", [prompt_id])
+        return self.to_dict(rows[0]) if rows else None
+
+    async def list(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        model: Optional[str] = None,
+        user: Optional[str] = None,
+        status: Optional[str] = None,
+        query: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """完了の新しい順に一覧（cursorは前のページのnext_cursor、queryでプロンプトを全文検索）"""
+        await self.flush()
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        conditions, params = [], []
+        for column, value in (("g.model", model), ("g.user", user), ("g.status", status)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        position = _parse_cursor(cursor)
+        if position is not None:
+            conditions.append("(g.completed_at, g.prompt_id) < (?, ?)")
+            params.extend(position)
+
+        source = "generations g"
+        terms = (query or "").split()
+        if terms:
+            matched = [term for term in terms if self.tokenizer != "trigram" or len(term) >= MIN_TRIGRAM_LENGTH]
+            if matched:
+                source = "generations_fts f JOIN generations g ON g.rowid = f.rowid"
+                conditions.append("generations_fts MATCH ?")
+                params.append(" ".join('"' + term.replace('"', '""') + '"' for term in matched))
+            # 索引で引けない短い語は部分一致で絞り込む
+            for term in terms:
+                if term not in matched:
+                    conditions.append("(g.prompt LIKE ? ESCAPE '\\' OR g.negative_prompt LIKE ? ESCAPE '\\')")
+                    pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                    params.extend([pattern, pattern])
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = (
+            f"SELECT {', '.join('g.' + column for column in COLUMNS)} FROM {source} {where} "
+            f"ORDER BY g.completed_at DESC, g.prompt_id DESC LIMIT ?"
+        )
+        rows = await asyncio.to_thread(self._query, sql, params + [limit + 1])
+        items = rows[:limit]
+        return {
+            "items": [self.to_dict(record) for record in items],
+            "next_cursor": _cursor(items[-1]) if len(rows) > limit else None
+        }
+
+    @staticmethod
+    def to_dict(record: Dict[str, Any]) -> Dict[str, Any]:
+        """APIレスポンス用（時刻はISO形式、待ち時間と実行時間を付ける）"""
+        started_at, completed_at = record["started_at"], record["completed_at"]
+        return {
+            **record,
+            "queued_at": _iso(record["queued_at"]),
+            "started_at": _iso(started_at),
+            "completed_at": _iso(completed_at),
+            "wait_seconds": round(started_at - record["queued_at"], 3) if started_at and record["queued_at"] else None,
+            "run_seconds": round(completed_at - started_at, 3) if completed_at and started_at else None
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "active": len(self._active),
+            "unflushed": len(self._unflushed),
+            "tokenizer": self.tokenizer
+        }
@@ -0,0 +1,192 @@
+"""
+Image Cache - 生成画像の2層LRUキャッシュ（メモリ＋ディスク）
+"""
+
+import asyncio
+import hashlib
+import mimetypes
+import os
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple, Callable, Awaitable
+
+# (インスタンスURL, ファイル名, サブフォルダ, 種別)
+CacheKey = Tuple[str, str, str, str]
+
+def guess_content_type(filename: str) -> str:
+    """ファイル名からContent-Typeを推定"""
+    return mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+class ImageCache:
+    def __init__(
+        self,
+        memory_budget: int = 256 * 1024 * 1024,
+        disk_dir: Optional[str] = "cache/images",
+        disk_budget: int = 2 * 1024 * 1024 * 1024,
+        max_entry_size: int = 32 * 1024 * 1024,
+        prefetch_concurrency: int = 4
+    ):
+        self.memory_budget = memory_budget
+        self.disk_dir = disk_dir if disk_dir and disk_budget > 0 else None
+        self.disk_budget = disk_budget
+        self.max_entry_size = max_entry_size
+        self._memory: "OrderedDict[CacheKey, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        # ダイジェスト → ファイルサイズ（LRU順）
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._prefetching: Dict[CacheKey, asyncio.Task] = {}
+        self._prefetch_semaphore = asyncio.Semaphore(prefetch_concurrency)
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "bytes_served": 0,
+            "prefetched": 0
+        }
+        if self.disk_dir:
+            self._load_disk_index()
+
+    def _load_disk_index(self):
+        """起動時にディスク上のキャッシュを古い順に読み込む"""
+        os.makedirs(self.disk_dir, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    @staticmethod
+    def _digest(key: CacheKey) -> str:
+        return hashlib.sha1("|".join(key).encode()).hexdigest()
+
+    def _disk_path(self, digest: str) -> str:
+        return os.path.join(self.disk_dir, digest)
+
+    async def get(self, key: CacheKey) -> Optional[bytes]:
+        """キャッシュから取得（ディスクのヒットはメモリに昇格）"""
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return data
+
+        if self.disk_dir:
+            digest = self._digest(key)
+            if digest in self._disk:
+                try:
+                    data = await asyncio.to_thread(self._read_file, self._disk_path(digest))
+                except OSError:
+                    self._forget_disk(digest)
+                else:
+                    self._disk.move_to_end(digest)
+                    self.stats["disk_hits"] += 1
+                    self._put_memory(key, data)
+                    return data
+
+        self.stats["misses"] += 1
+        return None
+
+    def contains(self, key: CacheKey) -> bool:
+        """キャッシュ済みか（統計には数えない）"""
+        return key in self._memory or (self.disk_dir is not None and self._digest(key) in self._disk)
+
+    async def put(self, key: CacheKey, data: bytes):
+        """メモリとディスクの両方に格納"""
+        if len(data) > self.max_entry_size:
+            return
+        self._put_memory(key, data)
+        if self.disk_dir:
+            digest = self._digest(key)
+            if digest not in self._disk:
+                try:
+                    await asyncio.to_thread(self._write_file, self._disk_path(digest), data)
+                except OSError as e:
+                    print(f"[WARNING] Failed to write image cache: {e}")
+                    return
+                self._disk[digest] = len(data)
+                self._disk_bytes += len(data)
+                self._evict_disk()
+
+    def record_served(self, size: int):
+        """キャッシュから配信したバイト数を記録"""
+        self.stats["bytes_served"] += size
+
+    def _put_memory(self, key: CacheKey, data: bytes):
+        if len(data) > self.memory_budget:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_budget:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.disk_budget and self._disk:
+            digest = next(iter(self._disk))
+            try:
+                os.remove(self._disk_path(digest))
+            except OSError:
+                pass
+            self._forget_disk(digest)
+
+    def _forget_disk(self, digest: str):
+        size = self._disk.pop(digest, None)
+        if size is not None:
+            self._disk_bytes -= size
+
+    @staticmethod
+    def _read_file(path: str) -> bytes:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)
+        return data
+
+    @staticmethod
+    def _write_file(path: str, data: bytes):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def prefetch(self, key: CacheKey, fetch: Callable[[], Awaitable[bytes]]):
+        """バックグラウンドで取得してキャッシュに格納（同じキーの重複取得はしない）"""
+        if key in self._prefetching or self.contains(key):
+            return
+
+        async def run():
+            try:
+                async with self._prefetch_semaphore:
+                    data = await fetch()
+                await self.put(key, data)
+                self.stats["prefetched"] += 1
+            except Exception as e:
+                print(f"[WARNING] Failed to prefetch {key[1]}: {e}")
+            finally:
+                self._prefetching.pop(key, None)
+
+        self._prefetching[key] = asyncio.create_task(run())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """ヒット率と使用量"""
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "memory_budget": self.memory_budget,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_bytes,
+            "disk_budget": self.disk_budget if self.disk_dir else 0
+        }
@@ -0,0 +1,174 @@
+"""
+Image Proxy - ComfyUIの画像をストリーミングで中継（Range / ETag / キャッシュ制御）
+"""
+
+import hashlib
+from typing import Optional, Tuple, Dict, Callable, Awaitable
+
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+from comfyui_bridge import ComfyUIBridge
+
+CHUNK_SIZE = 64 * 1024
+
+# 生成済みの出力は上書きされないため、ブラウザやnginxに無期限キャッシュさせる
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+NO_CACHE_CONTROL = "no-cache"
+
+def make_etag(instance: str, filename: str, subfolder: str, folder_type: str) -> str:
+    """出力ファイルの所在から強いETagを作成"""
+    key = f"{instance}|{folder_type}|{subfolder}|{filename}"
+    return '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Matchヘッダーが指定のETagに一致するか"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in candidates or f"W/{etag}" in candidates
+
+def parse_range(range_header: str, total: int) -> Optional[Tuple[int, int]]:
+    """単一のbytes範囲を(開始, 終了)に変換（満たせない場合はNone）"""
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start_text, _, end_text = spec.strip().partition("-")
+    try:
+        if start_text == "":
+            # bytes=-N は末尾Nバイト
+            length = int(end_text)
+            if length <= 0:
+                return None
+            return max(0, total - length), total - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else total - 1
+    except ValueError:
+        return None
+    if start >= total or start > end:
+        return None
+    return start, min(end, total - 1)
+
+def cache_headers(etag: str, folder_type: str) -> Dict[str, str]:
+    """キャッシュ関連のレスポンスヘッダー"""
+    return {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if folder_type == "output" else NO_CACHE_CONTROL
+    }
+
+def not_modified_response(etag: str, folder_type: str) -> Response:
+    """304 Not Modified"""
+    return Response(status_code=304, headers=cache_headers(etag, folder_type))
+
+def bytes_response(
+    data: bytes,
+    content_type: str,
+    etag: str,
+    folder_type: str = "output",
+    range_header: Optional[str] = None
+) -> Response:
+    """メモリ上の画像データを返す（Range対応）"""
+    headers = {
+        **cache_headers(etag, folder_type),
+        "Accept-Ranges": "bytes"
+    }
+    if range_header:
+        byte_range = parse_range(range_header, len(data))
+        if byte_range is None:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{len(data)}"})
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+        return Response(content=data[start:end + 1], status_code=206, headers=headers, media_type=content_type)
+    return Response(content=data, headers=headers, media_type=content_type)
+
+async def stream_image(
+    bridge: ComfyUIBridge,
+    filename: str,
+    subfolder: str = "",
+    folder_type: str = "output",
+    range_header: Optional[str] = None,
+    on_complete: Optional[Callable[[bytes], Awaitable[None]]] = None,
+    max_capture_size: int = 0
+) -> Response:
+    """ComfyUIの/viewをチャンク単位で中継（メモリ使用量はチャンクサイズに比例）
+
+    on_complete を指定すると、全体を返した場合に限り受信した内容を渡す（キャッシュ格納用）
+    """
+    etag = make_etag(bridge.comfyui_url, filename, subfolder, folder_type)
+    try:
+        upstream = await bridge.open_image(filename, subfolder, folder_type, range_header)
+    except Exception as e:
+        print(f"[ERROR] Failed to open image {filename}: {e}")
+        raise HTTPException(status_code=502, detail="Failed to connect to ComfyUI")
+
+    if upstream.status == 416:
+        upstream.release()
+        return Response(status_code=416, headers={"Content-Range": upstream.headers.get("Content-Range", "bytes */*")})
+    if upstream.status not in (200, 206):
+        upstream.release()
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    headers = {
+        **cache_headers(etag, folder_type),
+        "Accept-Ranges": "bytes"
+    }
+    status_code = upstream.status
+    skip = 0
+    remaining = upstream.content_length
+
+    if upstream.status == 206:
+        headers["Content-Range"] = upstream.headers.get("Content-Range", "")
+    elif range_header and upstream.content_length is not None:
+        # ComfyUIがRangeを無視した場合はこちらで切り出す
+        byte_range = parse_range(range_header, upstream.content_length)
+        if byte_range is None:
+            upstream.release()
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{upstream.content_length}"})
+        skip = byte_range[0]
+        remaining = byte_range[1] - byte_range[0] + 1
+        status_code = 206
+        headers["Content-Range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{upstream.content_length}"
+    if remaining is not None:
+        headers["Content-Length"] = str(remaining)
+
+    # 全体を返す場合のみ、上限以下のサイズなら内容を保持してキャッシュに渡す
+    capture = (
+        on_complete is not None
+        and status_code == 200
+        and upstream.content_length is not None
+        and upstream.content_length <= max_capture_size
+    )
+
+    async def body():
+        to_skip = skip
+        to_send = remaining
+        captured = [] if capture else None
+        try:
+            async for chunk in upstream.content.iter_chunked(CHUNK_SIZE):
+                if to_skip:
+                    if len(chunk) <= to_skip:
+                        to_skip -= len(chunk)
+                        continue
+                    chunk = chunk[to_skip:]
+                    to_skip = 0
+                if to_send is not None:
+                    chunk = chunk[:to_send]
+                    to_send -= len(chunk)
+                if captured is not None:
+                    captured.append(chunk)
+                yield chunk
+                if to_send == 0:
+                    break
+            if captured is not None:
+                await on_complete(b"".join(captured))
+        finally:
+            upstream.release()
+
+    return StreamingResponse(
+        body(),
+        status_code=status_code,
+        headers=headers,
+        media_type=upstream.headers.get("Content-Type", "image/png")
+    )
@@ -0,0 +1,285 @@
+"""
+Job Queue - ComfyUIの前段で優先度とユーザーごとの重み付き公平性に従ってプロンプトを送り出す
+"""
+
+import asyncio
+import bisect
+import itertools
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable
+
+# 優先度（小さいほど先に送り出す）
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+# コストの基準（512x512・20ステップ・1枚を1とする）
+BASE_PIXELS = 512 * 512
+BASE_STEPS = 20
+
+def relative_cost(steps: float, width: int, height: int, images: int = 1) -> float:
+    """基準（512x512・20ステップ・1枚）に対する処理量"""
+    return max(0.05, (steps or BASE_STEPS) / BASE_STEPS * width * height / BASE_PIXELS * images)
+
+def estimate_cost(workflow: Dict[str, Any], input_images: Optional[List[Dict[str, Any]]] = None) -> float:
+    """ワークフローの相対的な処理量（サンプラーのステップ数×Latentの画素数×枚数）
+
+    img2img/inpaintのようにEmptyLatentImageがない場合は、LoadImageが読む入力画像
+    （input_imagesの寸法）の画素数を使う
+    """
+    sizes = {
+        image["filename"]: image["width"] * image["height"]
+        for image in input_images or ()
+        if image.get("width") and image.get("height")
+    }
+    steps = 0
+    latent_pixels = None
+    image_pixels = None
+    images = 1
+    for node in workflow.values():
+        class_type = node.get("class_type")
+        inputs = node.get("inputs") or {}
+        if class_type == "KSampler" and isinstance(inputs.get("steps"), int):
+            steps += inputs["steps"] * (inputs.get("denoise") if isinstance(inputs.get("denoise"), (int, float)) else 1)
+        elif class_type == "EmptyLatentImage":
+            if isinstance(inputs.get("width"), int) and isinstance(inputs.get("height"), int):
+                latent_pixels = inputs["width"] * inputs["height"]
+            if isinstance(inputs.get("batch_size"), int):
+                images = inputs["batch_size"]
+        elif class_type == "LoadImage" and inputs.get("image") in sizes:
+            image_pixels = max(image_pixels or 0, sizes[inputs["image"]])
+        elif class_type == "RepeatLatentBatch" and isinstance(inputs.get("amount"), int):
+            images = inputs["amount"]
+    return relative_cost(steps, latent_pixels or image_pixels or BASE_PIXELS, 1, images)
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """"user=2,other=0.5" 形式の重み指定を解析"""
+    weights = {}
+    for item in value.split(","):
+        user, _, weight = item.partition("=")
+        if user.strip() and weight.strip():
+            weights[user.strip()] = float(weight)
+    return weights
+
+class _QueuedPrompt:
+    __slots__ = ("prompt_id", "workflow", "input_images", "owner", "priority", "cost", "tag", "seq", "queued_at")
+
+    def __init__(self, prompt_id, workflow, input_images, owner, priority, cost, tag, seq):
+        self.prompt_id = prompt_id
+        self.workflow = workflow
+        self.input_images = input_images
+        self.owner = owner
+        self.priority = priority
+        self.cost = cost
+        self.tag = tag
+        self.seq = seq
+        self.queued_at = time.time()
+
+    def key(self) -> Tuple[float, int]:
+        return (self.tag, self.seq)
+
+class JobQueue:
+    """優先度ごとのStart-time Fair Queueing
+
+    ユーザーの各プロンプトに「そのユーザーの前回の終了仮想時刻」と「現在の仮想時刻」の
+    大きい方を開始タグとして付け、タグ順に送り出す。大量に投入したユーザーのプロンプトは
+    タグが先の方に並ぶため、後から来た他のユーザーのプロンプトが間に割り込める
+    """
+
+    def __init__(
+        self,
+        dispatch: Callable[..., Awaitable[Dict[str, Any]]],
+        instance_count: Callable[[], int],
+        window: int = 2,
+        weights: Optional[Dict[str, float]] = None,
+        max_queued: int = 10000,
+        inflight_timeout: float = 1800.0,
+        on_failed: Optional[Callable[[str, str], None]] = None
+    ):
+        self._dispatch = dispatch
+        self._instance_count = instance_count
+        # インスタンスごとにComfyUIへ送り出しておくプロンプト数（残りはここで並べ替え可能なまま待つ）
+        self.window = window
+        self.weights = weights or {}
+        self.max_queued = max_queued
+        # 完了イベントを取りこぼした場合に送り出し枠を解放するまでの時間
+        self.inflight_timeout = inflight_timeout
+        self._on_failed = on_failed
+        # 優先度ごとに (開始タグ, 到着順) でソートした待ち行列
+        self._queues: List[List[Tuple[Tuple[float, int], _QueuedPrompt]]] = [[] for _ in PRIORITIES]
+        self._queued: Dict[str, _QueuedPrompt] = {}
+        # 優先度ごとの仮想時刻と、ユーザーごとの最後の終了タグ
+        self._virtual_time = [0.0 for _ in PRIORITIES]
+        self._finish_tags: List[Dict[str, float]] = [{} for _ in PRIORITIES]
+        # 送り出し済みで未完了のprompt_id → 送り出した時刻
+        self._inflight: "OrderedDict[str, float]" = OrderedDict()
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+        # 送り出し中のprompt_id → 送信タスク
+        self._sending: Dict[str, asyncio.Task] = {}
+        # 送り出しの応答より先に終了イベントが届いたprompt_id
+        self._finished_early: set = set()
+        self.stats = {"queued": 0, "dispatched": 0, "failed": 0, "timed_out": 0}
+
+    def start(self):
+        if self._task is None:
+            self._running = True
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            # wait_forが起床と同時のキャンセルを握りつぶす場合があるため、フラグでもループを止める
+            self._running = False
+            self._wakeup.set()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(
+        self,
+        workflow: Dict[str, Any],
+        input_images: Optional[List[Dict[str, Any]]] = None,
+        owner: str = "anonymous",
+        priority: str = "normal",
+        cost: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """待ち行列に追加し、送り出し時に使うprompt_idを返す"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority} (expected one of {', '.join(PRIORITIES)})")
+        if len(self._queued) >= self.max_queued:
+            raise OverflowError(f"Queue is full ({self.max_queued} prompts)")
+        level = PRIORITIES[priority]
+        cost = estimate_cost(workflow, input_images) if cost is None else cost
+        finish_tags = self._finish_tags[level]
+        tag = max(self._virtual_time[level], finish_tags.get(owner, 0.0))
+        finish_tags[owner] = tag + cost / self.weights.get(owner, 1.0)
+
+        item = _QueuedPrompt(str(uuid.uuid4()), workflow, input_images, owner, priority, cost, tag, next(self._seq))
+        bisect.insort(self._queues[level], (item.key(), item))
+        self._queued[item.prompt_id] = item
+        self.stats["queued"] += 1
+        self._wakeup.set()
+        return {"success": True, "prompt_id": item.prompt_id, "instance": None, "queued": True}
+
+    def cancel(self, prompt_id: str) -> bool:
+        """送り出し前のプロンプトを取り消す"""
+        item = self._queued.pop(prompt_id, None)
+        if item is None:
+            return False
+        queue = self._queues[PRIORITIES[item.priority]]
+        index = bisect.bisect_left(queue, (item.key(),))
+        if index < len(queue) and queue[index][1] is item:
+            del queue[index]
+        return True
+
+    def position(self, prompt_id: str) -> Optional[int]:
+        """待ち行列内の順番（送り出し済み・不明ならNone）。ComfyUIで実行待ちの分も含める"""
+        item = self._queued.get(prompt_id)
+        if item is None:
+            if prompt_id in self._sending:
+                # 送信中（待ち行列から外れたが、まだComfyUIのキューにも記録にもない）
+                return len(self._inflight) + 1
+            return None
+        level = PRIORITIES[item.priority]
+        ahead = sum(len(queue) for queue in self._queues[:level])
+        ahead += bisect.bisect_left(self._queues[level], (item.key(),))
+        return ahead + len(self._inflight) + 1
+
+    def is_queued(self, prompt_id: str) -> bool:
+        return prompt_id in self._queued
+
+    def dispatching(self, prompt_id: str) -> Optional[asyncio.Task]:
+        """ComfyUIへ送信中のプロンプトの送信タスク（取り消す前に送信の完了を待つため）"""
+        return self._sending.get(prompt_id)
+
+    def handle_event(self, instance: Optional[str], message: Dict[str, Any]):
+        """ComfyUIでの終了を受けて送り出し枠を空ける"""
+        event_type = message.get("type")
+        data = message.get("data") or {}
+        finished = event_type in ("execution_success", "execution_error", "execution_interrupted") or (
+            event_type == "executing" and data.get("node") is None
+        )
+        if not finished:
+            return
+        prompt_id = data.get("prompt_id")
+        if self._inflight.pop(prompt_id, None) is not None:
+            self._wakeup.set()
+        elif prompt_id in self._sending:
+            self._finished_early.add(prompt_id)
+
+    def _capacity(self) -> int:
+        return self.window * max(1, self._instance_count()) - len(self._inflight) - len(self._sending)
+
+    def _pop_next(self) -> Optional[_QueuedPrompt]:
+        for level, queue in enumerate(self._queues):
+            if queue:
+                _, item = queue.pop(0)
+                self._queued.pop(item.prompt_id, None)
+                self._virtual_time[level] = item.tag
+                # 仮想時刻より前に終わったユーザーの記録は不要（次の投入は現在の仮想時刻から始まる）
+                finish_tags = self._finish_tags[level]
+                if len(finish_tags) > 1000:
+                    for owner in [owner for owner, finish in finish_tags.items() if finish <= item.tag]:
+                        del finish_tags[owner]
+                return item
+        return None
+
+    def _expire_inflight(self):
+        now = time.time()
+        while self._inflight:
+            prompt_id, dispatched_at = next(iter(self._inflight.items()))
+            if now - dispatched_at < self.inflight_timeout:
+                break
+            del self._inflight[prompt_id]
+            self.stats["timed_out"] += 1
+            print(f"[WARNING] No completion event for {prompt_id}, releasing its dispatch slot")
+
+    async def _run(self):
+        """空きがある限り優先度・タグ順に送り出す"""
+        while self._running:
+            self._wakeup.clear()
+            self._expire_inflight()
+            while self._capacity() > 0:
+                item = self._pop_next()
+                if item is None:
+                    break
+                task = asyncio.create_task(self._send(item))
+                self._sending[item.prompt_id] = task
+                task.add_done_callback(lambda _, prompt_id=item.prompt_id: self._sending.pop(prompt_id, None))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send(self, item: _QueuedPrompt):
+        try:
+            result = await self._dispatch(item.workflow, item.input_images, prompt_id=item.prompt_id)
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+        if result.get("success"):
+            if item.prompt_id in self._finished_early:
+                self._finished_early.discard(item.prompt_id)
+            else:
+                self._inflight[item.prompt_id] = time.time()
+            self.stats["dispatched"] += 1
+        else:
+            self.stats["failed"] += 1
+            print(f"[ERROR] Failed to dispatch {item.prompt_id}: {result.get('error')}")
+            if self._on_failed is not None:
+                self._on_failed(item.prompt_id, result.get("error") or "Unknown error")
+        self._wakeup.set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """待ち行列の統計（ユーザー名は含めない）"""
+        return {
+            **self.stats,
+            "window": self.window,
+            "inflight": len(self._inflight),
+            "queued_by_priority": {name: len(self._queues[level]) for name, level in PRIORITIES.items()},
+            "owners": len({item.owner for item in self._queued.values()})
+        }
@@ -0,0 +1,150 @@
+"""
+Job Status Table - ComfyUIのWebSocketイベントから最近のプロンプトの状態を保持
+"""
+
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+class JobStatusTable:
+    def __init__(self, max_entries: int = 5000):
+        self.max_entries = max_entries
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # インスタンスごとに現在実行中のキュー番号
+        self._running_number: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def __contains__(self, prompt_id: str) -> bool:
+        return prompt_id in self._jobs
+
+    def _entry(self, prompt_id: str, instance: Optional[str] = None) -> Dict[str, Any]:
+        """エントリを取得（なければ作成し、上限を超えたら古いものから削除）"""
+        entry = self._jobs.get(prompt_id)
+        if entry is None:
+            entry = {
+                "prompt_id": prompt_id,
+                "instance": instance,
+                "status": "pending",
+                "number": None,
+                "progress": None,
+                "step": None,
+                "max_steps": None,
+                "current_node": None,
+                "outputs": [],
+                "error": None,
+                "queued_at": time.time(),
+                "started_at": None,
+                "completed_at": None
+            }
+            self._jobs[prompt_id] = entry
+            while len(self._jobs) > self.max_entries:
+                self._jobs.popitem(last=False)
+        elif instance and not entry["instance"]:
+            entry["instance"] = instance
+        return entry
+
+    def track(self, prompt_id: str, instance: str, number: Optional[int] = None) -> Dict[str, Any]:
+        """キューに送信したプロンプトを登録"""
+        entry = self._entry(prompt_id, instance)
+        entry["number"] = number
+        return entry
+
+    def mark_stale(self, instance: str):
+        """イベントを取りこぼした可能性がある未完了エントリに印を付ける"""
+        for entry in self._jobs.values():
+            if entry["instance"] == instance and entry["status"] in ("pending", "running"):
+                entry["stale"] = True
+
+    def get(self, prompt_id: str) -> Optional[Dict[str, Any]]:
+        """エントリを取得"""
+        return self._jobs.get(prompt_id)
+
+    def handle_event(self, instance: str, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """ComfyUIのWebSocketメッセージを反映し、更新したエントリを返す"""
+        event_type = message.get("type")
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return None
+        entry = self._entry(prompt_id, instance)
+
+        if event_type == "execution_start":
+            entry["status"] = "running"
+            entry["started_at"] = time.time()
+            if entry["number"] is not None:
+                self._running_number[instance] = entry["number"]
+        elif event_type == "executing":
+            if data.get("node") is None:
+                # 旧バージョンのComfyUIはnode=Noneで完了を通知する
+                self._complete(entry)
+            else:
+                entry["status"] = "running"
+                entry["current_node"] = data["node"]
+        elif event_type == "progress":
+            entry["status"] = "running"
+            entry["step"] = data.get("value")
+            entry["max_steps"] = data.get("max")
+            if data.get("max"):
+                entry["progress"] = data.get("value", 0) / data["max"]
+        elif event_type == "executed":
+            node_id = data.get("node")
+            for image in (data.get("output") or {}).get("images", []):
+                entry["outputs"].append({
+                    "filename": image["filename"],
+                    "subfolder": image.get("subfolder", ""),
+                    "type": image.get("type", "output"),
+                    "node_id": node_id
+                })
+        elif event_type == "execution_success":
+            self._complete(entry)
+        elif event_type == "execution_error":
+            entry["status"] = "error"
+            entry["error"] = data.get("exception_message") or "Execution failed"
+            entry["completed_at"] = time.time()
+        elif event_type == "execution_interrupted":
+            entry["status"] = "error"
+            entry["error"] = "Execution interrupted"
+            entry["interrupted"] = True
+            entry["completed_at"] = time.time()
+        else:
+            return None
+        return entry
+
+    def _complete(self, entry: Dict[str, Any]):
+        """エントリを完了状態にする"""
+        if entry["status"] in ("completed", "error"):
+            return
+        entry["status"] = "completed"
+        entry["progress"] = None
+        entry["current_node"] = None
+        entry["completed_at"] = time.time()
+
+    def to_status(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """/api/statusと同じ形式に変換"""
+        status = entry["status"]
+        if status == "pending":
+            running_number = self._running_number.get(entry["instance"])
+            if entry["number"] is not None and running_number is not None:
+                queue_position = max(1, entry["number"] - running_number)
+            else:
+                queue_position = 1
+            return {"status": "pending", "queue_position": queue_position, "progress": None}
+        if status == "running":
+            return {
+                "status": "running",
+                "queue_position": 0,
+                "progress": entry["progress"],
+                "step": entry["step"],
+                "max_steps": entry["max_steps"],
+                "current_node": entry["current_node"]
+            }
+        if status == "completed":
+            return {
+                "status": "completed",
+                "queue_position": 0,
+                "progress": None,
+                "outputs": entry["outputs"]
+            }
+        return {"status": "error", "error": entry["error"]}
@@ -2,28 +2,169 @@
 ComfyUI A1111-Style Interface - Backend API Server
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import StreamingResponse, Response
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import uvicorn
-import aiohttp
 import json
-import uuid
+import hashlib
 import asyncio
-import io
-from PIL import Image
-import base64
+import random
 from datetime import datetime
 import os
+from contextlib import asynccontextmanager
 
-from comfyui_bridge import ComfyUIBridge
+from abandon_monitor import AbandonMonitor
+from admission_control import AdmissionController, AdmissionRejected
+from bridge_pool import ComfyUIBridgePool, get_model_key
+from ws_hub import WebSocketHub
+from image_proxy import make_etag, etag_matches, not_modified_response, stream_image, bytes_response
+from image_cache import ImageCache, guess_content_type
+from upload_store import UploadStore, InvalidImageError, UploadTooLargeError
+from batch_manager import BatchManager, expand_grid
+from history_store import HistoryStore, workflow_seed
+from job_queue import JobQueue, PRIORITIES, parse_weights, estimate_cost, relative_cost
+from prompt_events import PromptEventLog
+from refine_manager import RefineManager, draft_size
+from result_index import ResultIndex, workflow_hash
+from micro_batcher import MicroBatcher, slice_outputs
+from workflow_validator import ValidatorCache, WorkflowValidator, WorkflowValidationError
+from catalog_view import CatalogViewCache
+from sse import SSE_HEADERS, format_sse, format_sse_comment
 from workflow_manager import WorkflowManager
+from workflow_registry import WorkflowRegistry, WorkflowDefinitionError
 from samplers_config import get_sampler_list, get_scheduler_list, get_samplers_by_category, get_schedulers_by_category
 
+# ComfyUIインスタンス一覧（カンマ区切り、未指定時はCOMFYUI_URL）
+COMFYUI_URLS = [
+    url.strip()
+    for url in os.getenv("COMFYUI_URLS", os.getenv("COMFYUI_URL", "http://127.0.0.1:8188")).split(",")
+    if url.strip()
+]
+
+# ComfyUIブリッジプールとワークフロー管理の初期化
+comfyui_pool = ComfyUIBridgePool(
+    COMFYUI_URLS,
+    connection_limit=int(os.getenv("COMFYUI_CONNECTION_LIMIT", "100")),
+    health_interval=float(os.getenv("COMFYUI_HEALTH_INTERVAL", "10")),
+    affinity_max_extra_queue=int(os.getenv("COMFYUI_AFFINITY_MAX_EXTRA_QUEUE", "3")),
+    max_status_entries=int(os.getenv("JOB_STATUS_MAX_ENTRIES", "5000")),
+    catalog_ttl=float(os.getenv("OBJECT_INFO_TTL", "300"))
+)
+workflow_manager = WorkflowManager(
+    tiled_vae_min_pixels=int(os.getenv("TILED_VAE_MIN_PIXELS", str(1536 * 1536)))
+)
+
+# ユーザー登録のAPI形式ワークフロー（mode=<名前>で生成、起動時にディスクから読み込む）
+workflow_registry = WorkflowRegistry(directory=os.getenv("WORKFLOW_REGISTRY_DIR", "workflows"))
+
+def report_dispatch_failure(prompt_id: str, error: str):
+    """ComfyUIへの送り出しに失敗したプロンプトを実行エラーとして通知"""
+    comfyui_pool.publish_event(None, {
+        "type": "execution_error",
+        "data": {"prompt_id": prompt_id, "exception_message": error}
+    })
+
+# ComfyUIの前段の待ち行列（優先度とユーザーごとの重み付き公平性で並べ替え、インスタンスごとに少数だけ送り出す）
+job_queue = JobQueue(
+    dispatch=comfyui_pool.queue_prompt,
+    instance_count=lambda: len(comfyui_pool.healthy_bridges()),
+    window=int(os.getenv("JOB_QUEUE_WINDOW", "2")),
+    weights=parse_weights(os.getenv("QUEUE_USER_WEIGHTS", "")),
+    max_queued=int(os.getenv("JOB_QUEUE_MAX_QUEUED", "10000")),
+    on_failed=report_dispatch_failure
+)
+comfyui_pool.add_event_listener(job_queue.handle_event)
+
+# 受け付け制御（未処理の仕事量をインスタンスごとの推定GPU秒で管理し、最も空いているインスタンスでも予算を超えたら429）
+admission = AdmissionController(
+    instances=lambda: [bridge.comfyui_url for bridge in comfyui_pool.healthy_bridges()],
+    instance_of=comfyui_pool.get_instance,
+    budgets={
+        "interactive": float(os.getenv("ADMISSION_INTERACTIVE_BUDGET", "60")),
+        "batch": float(os.getenv("ADMISSION_BATCH_BUDGET", "600"))
+    },
+    seconds_per_unit=float(os.getenv("ADMISSION_SECONDS_PER_UNIT", "1.5"))
+)
+comfyui_pool.add_event_listener(admission.handle_event)
+
+# 互換性のあるtxt2imgリクエストのまとめ実行（ウィンドウ0で無効）
+# まとめたプロンプトのイベントは呼び出し元ごとの仮想prompt_idに分けて配信する
+micro_batcher = MicroBatcher(
+    submit=job_queue.submit,
+    window=float(os.getenv("MICRO_BATCH_WINDOW_MS", "0")) / 1000,
+    max_batch_size=int(os.getenv("MICRO_BATCH_MAX_SIZE", "8"))
+)
+comfyui_pool.add_event_listener(micro_batcher.handle_event)
+
+# ブラウザ向けWebSocket配信ハブ（ComfyUIへの接続はインスタンスごとに1本）
+ws_hub = WebSocketHub(max_queue=int(os.getenv("WS_CLIENT_QUEUE_SIZE", "256")))
+micro_batcher.add_event_listener(ws_hub.publish)
+
+# 生成画像のキャッシュ（メモリ＋ディスク）
+image_cache = ImageCache(
+    memory_budget=int(float(os.getenv("IMAGE_CACHE_MEMORY_MB", "256")) * 1024 * 1024),
+    disk_dir=os.getenv("IMAGE_CACHE_DIR", "cache/images"),
+    disk_budget=int(float(os.getenv("IMAGE_CACHE_DISK_MB", "2048")) * 1024 * 1024),
+    max_entry_size=int(float(os.getenv("IMAGE_CACHE_MAX_ENTRY_MB", "32")) * 1024 * 1024)
+)
+
+def prefetch_outputs(instance: str, message: Dict[str, Any]):
+    """出力ノードの完了時に画像をキャッシュへ先読み"""
+    if message.get("type") != "executed":
+        return
+    bridge = comfyui_pool.get_bridge(instance)
+    for image in ((message.get("data") or {}).get("output") or {}).get("images", []):
+        if image.get("type", "output") != "output":
+            continue
+        filename, subfolder = image["filename"], image.get("subfolder", "")
+        image_cache.prefetch(
+            (instance, filename, subfolder, "output"),
+            lambda filename=filename, subfolder=subfolder: bridge.get_image(filename, subfolder, "output")
+        )
+
+comfyui_pool.add_event_listener(prefetch_outputs)
+
+# 同一ワークフローの相乗り・結果再利用（シード固定のリクエストのみ）
+result_index = ResultIndex(
+    comfyui_pool.jobs,
+    max_entries=int(os.getenv("RESULT_REUSE_MAX_ENTRIES", "1000")),
+    ttl=float(os.getenv("RESULT_REUSE_TTL", "3600"))
+)
+comfyui_pool.add_event_listener(result_index.handle_event)
+
+# img2img/inpaint用の入力画像（コンテンツハッシュで重複排除）
+upload_store = UploadStore(
+    upload_dir=os.getenv("UPLOAD_DIR", "uploads"),
+    max_size=int(float(os.getenv("MAX_UPLOAD_SIZE_MB", "50")) * 1024 * 1024)
+)
+
+# 生成履歴（完了時にSQLiteへ保存、履歴の参照ではComfyUIに問い合わせない）
+history_store = HistoryStore(path=os.getenv("HISTORY_DB_PATH", "data/history.db"))
+micro_batcher.add_event_listener(history_store.handle_event)
+
+# プロンプトごとの進捗イベント（/api/events/{prompt_id}のSSEで配信）
+prompt_events = PromptEventLog(get_position=lambda prompt_id: job_queue.position(micro_batcher.resolve(prompt_id)[0]))
+micro_batcher.add_event_listener(prompt_events.handle_event)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """アプリのライフサイクルに合わせて共有リソースを開閉"""
+    await history_store.start()
+    await comfyui_pool.start()
+    job_queue.start()
+    try:
+        yield
+    finally:
+        abandon_monitor.close()
+        await job_queue.close()
+        await comfyui_pool.close()
+        await history_store.close()
+
 # FastAPIアプリケーションの初期化
-app = FastAPI(title="ComfyUI A1111-Style API", version="1.0.0")
+app = FastAPI(title="ComfyUI A1111-Style API", version="1.0.0", lifespan=lifespan)
 
 # CORS設定（開発環境用に寛容な設定）
 app.add_middleware(
@@ -35,10 +176,6 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
-# ComfyUIブリッジとワークフロー管理の初期化
-comfyui_bridge = ComfyUIBridge()
-workflow_manager = WorkflowManager()
-
 # リクエストモデル
 class GenerateRequest(BaseModel):
     mode: str = "txt2img"  # txt2img, img2img, inpaint
@@ -55,11 +192,41 @@ class GenerateRequest(BaseModel):
     model: str = "v1-5-pruned-emaonly.safetensors"
     vae: Optional[str] = None
     loras: Optional[List[Dict[str, Any]]] = None
-    # img2img specific
+    # img2img specific（/api/uploadの参照ID、またはdata URL）
     init_image: Optional[str] = None
     denoising_strength: float = 0.75
     # inpaint specific
     mask_image: Optional[str] = None
+    # WebSocket(/ws?clientId=...)で進捗を受け取るクライアントID
+    client_id: Optional[str] = None
+    # Falseにすると同一ワークフローでも必ず新しく生成する
+    reuse: bool = True
+    # タイル分割のVAE（未指定なら解像度で自動判定）とタイルサイズ
+    tiled_vae: Optional[bool] = None
+    vae_tile_size: Optional[int] = None
+    # 低ステップ・縮小解像度の下書きを先に生成（本番は/api/jobs/{job_id}/refineで確定、auto_refineで自動）
+    draft: bool = False
+    auto_refine: bool = False
+    # 待ち行列の優先度（high / normal / low）
+    priority: str = "normal"
+    # 公平性の単位となる利用者（サーバー側でAPIキー・クライアントID・接続元から設定する）
+    user: Optional[str] = None
+    # クライアント（client_idのWebSocket、またはこのプロンプトのSSE）が切断したまま戻らなければ取り消す
+    cancel_on_disconnect: bool = False
+
+class RegisterWorkflowRequest(BaseModel):
+    # ComfyUIの「Save (API Format)」で書き出したワークフロー
+    workflow: Dict[str, Any]
+    # パラメータ名 → "ノードID.入力名"（複数可）例: {"prompt": "6.text", "seed": ["3.seed", "12.noise_seed"]}
+    parameters: Dict[str, Any] = {}
+    description: str = ""
+
+class BatchGenerateRequest(BaseModel):
+    # 個別のリクエスト一覧、またはbase + grid（例: {"cfg_scale": [5, 7], "steps": [20, 30]}）
+    requests: Optional[List[GenerateRequest]] = None
+    base: Optional[GenerateRequest] = None
+    grid: Optional[Dict[str, List[Any]]] = None
+    client_id: Optional[str] = None
 
 class ModelInfo(BaseModel):
     name: str
@@ -77,11 +244,23 @@ async def health_check():
     """APIサーバーの状態を確認"""
     try:
         # ComfyUIへの接続を確認
-        comfyui_status = await comfyui_bridge.check_connection()
+        comfyui_status = await comfyui_pool.check_connection()
         return {
             "status": "healthy",
             "api_version": "1.0.3",
             "comfyui_connected": comfyui_status,
+            "comfyui_instances": comfyui_pool.get_instances(),
+            "model_affinity": comfyui_pool.get_affinity_stats(),
+            "websocket_hub": ws_hub.get_stats(),
+            "image_cache": image_cache.get_stats(),
+            "result_reuse": result_index.get_stats(),
+            "micro_batching": micro_batcher.get_stats(),
+            "draft_refine": refine_manager.get_stats(),
+            "job_queue": job_queue.get_stats(),
+            "history": history_store.get_stats(),
+            "prompt_events": prompt_events.get_stats(),
+            "abandon_monitor": abandon_monitor.get_stats(),
+            "admission": admission.get_stats(),
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
@@ -91,80 +270,396 @@ async def health_check():
             "timestamp": datetime.now().isoformat()
         }
 
+async def build_workflow(request: GenerateRequest):
+    """リクエストからワークフローと必要な入力画像を作成"""
+    # 入力画像（参照IDまたは旧形式のdata URL）を解決
+    input_images = []
+    init_image = mask_image = None
+    if request.mode in ("img2img", "inpaint"):
+        try:
+            init_image = await upload_store.resolve(request.init_image)
+            mask_image = await upload_store.resolve(request.mask_image)
+        except (InvalidImageError, UploadTooLargeError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if init_image is None:
+            raise HTTPException(status_code=400, detail="init_image is required")
+        if request.mode == "inpaint" and mask_image is None:
+            raise HTTPException(status_code=400, detail="mask_image is required")
+        input_images = [image for image in (init_image, mask_image) if image]
+    
+    # ワークフローの作成
+    if request.mode == "txt2img":
+        workflow = workflow_manager.create_txt2img_workflow(
+            prompt=request.prompt,
+            negative_prompt=request.negative_prompt,
+            width=request.width,
+            height=request.height,
+            steps=request.steps,
+            cfg_scale=request.cfg_scale,
+            sampler_name=request.sampler_name,
+            scheduler=request.scheduler,
+            seed=request.seed,
+            batch_size=request.batch_size,
+            model=request.model,
+            vae=request.vae,
+            loras=request.loras,
+            tiled_vae=request.tiled_vae,
+            vae_tile_size=request.vae_tile_size
+        )
+    elif request.mode == "img2img":
+        workflow = workflow_manager.create_img2img_workflow(
+            prompt=request.prompt,
+            negative_prompt=request.negative_prompt,
+            init_image=init_image["filename"],
+            width=init_image["width"],
+            height=init_image["height"],
+            denoising_strength=request.denoising_strength,
+            steps=request.steps,
+            cfg_scale=request.cfg_scale,
+            sampler_name=request.sampler_name,
+            scheduler=request.scheduler,
+            seed=request.seed,
+            batch_size=request.batch_size,
+            model=request.model,
+            vae=request.vae,
+            loras=request.loras,
+            tiled_vae=request.tiled_vae,
+            vae_tile_size=request.vae_tile_size
+        )
+    elif request.mode == "inpaint":
+        workflow = workflow_manager.create_inpaint_workflow(
+            prompt=request.prompt,
+            negative_prompt=request.negative_prompt,
+            init_image=init_image["filename"],
+            mask_image=mask_image["filename"],
+            width=init_image["width"],
+            height=init_image["height"],
+            denoising_strength=request.denoising_strength,
+            steps=request.steps,
+            cfg_scale=request.cfg_scale,
+            sampler_name=request.sampler_name,
+            scheduler=request.scheduler,
+            seed=request.seed,
+            batch_size=request.batch_size,
+            model=request.model,
+            vae=request.vae,
+            loras=request.loras,
+            tiled_vae=request.tiled_vae,
+            vae_tile_size=request.vae_tile_size
+        )
+    else:
+        raise HTTPException(status_code=400, detail=f"Unknown mode: {request.mode}")
+    return workflow, input_images
+
+async def build_registered_workflow(request: GenerateRequest):
+    """登録済みワークフローに、リクエストで明示されたパラメータだけを差し込む"""
+    definition = workflow_registry.get(request.mode)
+    if definition is None:
+        raise HTTPException(status_code=400, detail=f"Unknown mode: {request.mode}")
+    values = {
+        name: getattr(request, name)
+        for name in definition.parameters
+        if name in request.model_fields_set and name not in ("seed", "init_image", "mask_image")
+    }
+    if "seed" in definition.parameters:
+        # 組み込みモードと同じく-1はランダム
+        values["seed"] = request.seed if request.seed != -1 else random.randint(0, 0xffffffffffffffff)
+    
+    input_images = []
+    for name in ("init_image", "mask_image"):
+        if name not in definition.parameters or not getattr(request, name):
+            continue
+        try:
+            image = await upload_store.resolve(getattr(request, name))
+        except (InvalidImageError, UploadTooLargeError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if image is None:
+            raise HTTPException(status_code=400, detail=f"{name} not found")
+        values[name] = image["filename"]
+        input_images.append(image)
+    return definition.instantiate(values), input_images
+
+# ノード定義から組み立てた検証器（カタログ更新時のみ再構築）
+validator_cache = ValidatorCache()
+
+async def get_workflow_validator() -> WorkflowValidator:
+    """現在のカタログに対応する検証器（カタログを取得できない場合は前回のもの）"""
+    try:
+        catalog = await comfyui_pool.get_catalog()
+    except Exception as e:
+        print(f"[WARNING] Validating with last known node schema: {e}")
+        catalog = None
+    return validator_cache.get(catalog)
+
+def admission_error(e: AdmissionRejected) -> HTTPException:
+    """受け付けなかったリクエストへの429応答"""
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def submit_generation(
+    request: GenerateRequest,
+    traffic: str = "interactive",
+    check_admission: bool = False
+) -> Dict[str, Any]:
+    """ワークフローを作成してComfyUIに送信（失敗時はHTTPException）
+
+    trafficは受け付け制御の区分。check_admissionがTrueなら予算を超えたとき429にする
+    （バッチの項目は受付時にまとめて、確認後の本番生成は/api/jobs/{job_id}/refineで確認済み。
+    下書きから自動で続ける本番生成は、下書きを受け付けた時点で引き受けたものとして確認しない）
+    """
+    if request.priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Unknown priority: {request.priority}")
+    definition = None if request.mode in ("txt2img", "img2img", "inpaint") else workflow_registry.get(request.mode)
+    if definition is not None:
+        workflow, input_images = await build_registered_workflow(request)
+    else:
+        workflow, input_images = await build_workflow(request)
+    
+    # ComfyUIに送る前にノード定義と照合（キューを消費させない）
+    try:
+        (await get_workflow_validator()).check(workflow)
+    except WorkflowValidationError as e:
+        if definition is not None:
+            for error in e.errors:
+                error["field"] = definition.field_names.get((error["node"], error["input"]), error["field"])
+        raise HTTPException(status_code=422, detail={"message": "Invalid generation parameters", "errors": e.errors})
+    
+    # ComfyUIに送信（再利用できる結果がある場合は受け付け制御の対象外）
+    cost = estimate_cost(workflow, input_images)
+    async def queue():
+        if check_admission:
+            try:
+                admission.check(traffic, cost)
+            except AdmissionRejected as e:
+                raise admission_error(e)
+        ticket = admission.admit(traffic, cost)
+        options = {"owner": request.user or "anonymous", "priority": request.priority}
+        try:
+            if request.mode == "txt2img" and request.seed == -1:
+                # ランダムシードのtxt2imgは同条件・同じ区分のリクエストとまとめて実行できる
+                result = await micro_batcher.submit(workflow, group=traffic, **options)
+            else:
+                result = await job_queue.submit(workflow, input_images, cost=cost, **options)
+        except OverflowError as e:
+            admission.discard(ticket)
+            raise HTTPException(status_code=503, detail=str(e))
+        except BaseException:
+            admission.discard(ticket)
+            raise
+        if not result["success"]:
+            admission.discard(ticket)
+            print(f"[ERROR] ComfyUI returned error: {result}")
+            raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
+        admission.assign(ticket, micro_batcher.resolve(result["prompt_id"])[0])
+        return result
+    
+    # シード固定のリクエストは同じワークフローの実行中・完了済みプロンプトを再利用
+    if request.reuse and request.seed != -1:
+        result = await result_index.submit(workflow_hash(workflow), queue)
+    else:
+        result = {**await queue(), "reused": None}
+    
+    if request.client_id and result["reused"] != "completed":
+        ws_hub.subscribe(request.client_id, result["prompt_id"])
+    if result["reused"] == "inflight":
+        # 相乗りしたリクエストがあるプロンプトは送信元が切断しても取り消さない
+        abandon_monitor.release(result["prompt_id"])
+    elif result["reused"] is None and request.cancel_on_disconnect:
+        abandon_monitor.watch(result["prompt_id"], request.client_id or result["prompt_id"])
+    if result["reused"] is None:
+        history_store.register(result["prompt_id"], history_record(request, workflow, result))
+        prompt_events.track(result["prompt_id"], job_queue.position(micro_batcher.resolve(result["prompt_id"])[0]))
+    # 待ち行列に入れただけのプロンプトは送り出し先が未定（送り出し後は/api/statusのinstanceで分かる）
+    response = {
+        "prompt_id": result["prompt_id"],
+        "instance": result["instance"] or prompt_instance(result["prompt_id"]),
+        "reused": result["reused"]
+    }
+    if result["reused"] == "completed":
+        response["outputs"] = result["outputs"]
+    return response
+
+def history_record(request: GenerateRequest, workflow: Dict[str, Any], result: Dict[str, Any]) -> Dict[str, Any]:
+    """履歴に保存する生成条件（data URLの画像とクライアント情報は除く）
+
+    まとめ実行のメンバーは実際に実行されたシードと、その何枚目からが自分の画像か（batch_index）を残す
+    """
+    params = request.model_dump(exclude={"client_id", "user"})
+    for name in ("init_image", "mask_image"):
+        if params[name] and params[name].startswith("data:"):
+            params[name] = None
+    if "batch_index" in result:
+        params["batch_index"] = result["batch_index"]
+    model_key = get_model_key(workflow)
+    return {
+        "user": owner_label(request.user),
+        "mode": request.mode,
+        "model": model_key[0] if model_key else None,
+        "prompt": request.prompt,
+        "negative_prompt": request.negative_prompt,
+        "seed": result["seed"] if "seed" in result else workflow_seed(workflow),
+        "params": params
+    }
+
+def prompt_instance(prompt_id: str) -> Optional[str]:
+    """プロンプトの送り出し先のインスタンス（まとめ実行の仮想prompt_idは実際のプロンプトのもの）"""
+    return comfyui_pool.get_instance(micro_batcher.resolve(prompt_id)[0])
+
+async def get_prompt_status(prompt_id: str) -> Dict[str, Any]:
+    """プロンプトの状態を取得（まとめ実行の仮想prompt_idは自分の出力だけを返す）
+
+    instanceは送り出し先のインスタンス（バックエンドの待ち行列にある間はNone）
+    """
+    real_id, member = micro_batcher.resolve(prompt_id)
+    position = job_queue.position(real_id)
+    if position is not None:
+        # まだバックエンドの待ち行列にあるか送信中（ComfyUIのキューには入っていない）
+        return {"status": "pending", "queue_position": position, "progress": None, "instance": None}
+    status = await comfyui_pool.get_prompt_status(real_id)
+    if member is not None and status.get("outputs"):
+        status = {**status, "outputs": slice_outputs(status["outputs"], *member)}
+    return {**status, "instance": comfyui_pool.get_instance(real_id)}
+
+async def cancel_prompt(prompt_id: str) -> str:
+    """プロンプトを取り消して結果を返す
+
+    "dequeued"（バックエンドの待ち行列から削除）/ "removed"（ComfyUIのキューから削除）/
+    "interrupted"（実行中を中断）/ "detached"（まとめ実行から外しただけ）/ "finished" / "not_found" / "error"
+    """
+    abandon_monitor.release(prompt_id)
+    real_id, member = micro_batcher.resolve(prompt_id)
+    entry = comfyui_pool.jobs.get(real_id)
+    if entry is not None and entry["status"] in ("completed", "error"):
+        return "finished"
+    result_index.forget(prompt_id)
+    if member is not None:
+        # 他のメンバーの生成は続ける（全員が取り消した場合だけ実際のプロンプトを止める）
+        _, shared = micro_batcher.detach(prompt_id)
+        comfyui_pool.publish_event(None, {"type": "execution_interrupted", "data": {"prompt_id": prompt_id}})
+        if shared:
+            return "detached"
+    if job_queue.cancel(real_id):
+        comfyui_pool.publish_event(None, {"type": "execution_interrupted", "data": {"prompt_id": real_id}})
+        return "dequeued"
+    sending = job_queue.dispatching(real_id)
+    if sending is not None:
+        # 送信中のプロンプトはComfyUIのキューに入ってから取り消す
+        await asyncio.shield(sending)
+    status = (await comfyui_pool.cancel_prompt(real_id))["status"]
+    if member is not None and status == "not_found":
+        # 外したメンバーには以後のイベントが届かないため取り消し済みとして扱う
+        return "detached"
+    return status
+
+# クライアントが切断したまま戻らないプロンプトの取り消し（cancel_on_disconnectを指定したリクエストのみ）
+abandon_monitor = AbandonMonitor(
+    cancel=cancel_prompt,
+    grace=float(os.getenv("ABANDON_GRACE_SECONDS", "30"))
+)
+micro_batcher.add_event_listener(abandon_monitor.handle_event)
+
+async def fetch_output_image(prompt_id: str, output: Dict[str, Any]) -> bytes:
+    """出力画像をキャッシュ経由で取得"""
+    bridge = comfyui_pool.resolve_output_bridge(output["filename"], micro_batcher.resolve(prompt_id)[0])
+    key = (bridge.comfyui_url, output["filename"], output.get("subfolder", ""), output.get("type", "output"))
+    data = await image_cache.get(key)
+    if data is None:
+        data = await bridge.get_image(*key[1:])
+        await image_cache.put(key, data)
+    return data
+
+# バッチ・グリッド生成（ComfyUIへの同時投入数を制限）
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "256"))
+batch_manager = BatchManager(
+    # バッチ全体は受付時に確認済みのため、項目ごとには確認しない
+    submit=lambda request: submit_generation(request, traffic="batch"),
+    get_status=get_prompt_status,
+    fetch_image=fetch_output_image,
+    max_concurrency=int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+)
+micro_batcher.add_event_listener(batch_manager.handle_event)
+
+# 下書き生成（同じシードで低ステップ・縮小解像度、本番生成とジョブで紐付ける）
+DRAFT_STEPS = int(os.getenv("DRAFT_STEPS", "8"))
+DRAFT_SCALE = float(os.getenv("DRAFT_SCALE", "0.5"))
+refine_manager = RefineManager(submit=submit_generation)
+micro_batcher.add_event_listener(refine_manager.handle_event)
+
+async def submit_draft(request: GenerateRequest, check_admission: bool = False) -> Dict[str, Any]:
+    """下書きを送信し、本番生成用のリクエストとともにジョブとして登録"""
+    seed = request.seed if request.seed != -1 else random.randint(0, 0xffffffffffffffff)
+    final_request = request.model_copy(update={
+        "seed": seed,
+        "draft": False,
+        "auto_refine": False,
+        # 自動の本番生成は確認待ちの操作より後回しにする
+        "priority": "low" if request.auto_refine else request.priority
+    })
+    
+    current = {"steps": request.steps, "width": request.width, "height": request.height}
+    definition = None if request.mode in ("txt2img", "img2img", "inpaint") else workflow_registry.get(request.mode)
+    if definition is not None:
+        # 登録済みワークフローはリクエストで指定されていない値をワークフローの既定値で判断
+        for name in current:
+            if name not in request.model_fields_set and name in definition.defaults:
+                current[name] = definition.defaults[name]
+    update = {"steps": min(current["steps"], DRAFT_STEPS)}
+    # img2img/inpaintは入力画像の解像度で生成するためステップ数のみ減らす
+    if request.mode not in ("img2img", "inpaint"):
+        update["width"], update["height"] = draft_size(current["width"], current["height"], DRAFT_SCALE)
+    
+    result = await submit_generation(final_request.model_copy(update=update), check_admission=check_admission)
+    job = refine_manager.create(result, final_request, request.auto_refine)
+    return {**result, "job_id": job["job_id"], "draft": True}
+
+def estimate_request_cost(request: GenerateRequest) -> float:
+    """ワークフローを組み立てる前のおおよその処理量（バッチ全体・本番生成の受け付け判定用）
+
+    img2img/inpaintは入力画像の解像度で生成するため、アップロード済みの入力画像の寸法を使う
+    """
+    width, height = request.width, request.height
+    steps = request.steps
+    if request.mode in ("img2img", "inpaint"):
+        steps *= request.denoising_strength
+        init_image = upload_store.get(request.init_image) if request.init_image else None
+        if init_image is not None:
+            width, height = init_image["width"], init_image["height"]
+    return relative_cost(steps, width, height, request.batch_size)
+
+def request_owner(http_request: Request) -> str:
+    """待ち行列の公平性の単位（X-API-Keyがあればキー、なければ接続元アドレス）"""
+    api_key = http_request.headers.get("x-api-key")
+    if api_key:
+        return api_key
+    return f"ip:{http_request.client.host if http_request.client else 'unknown'}"
+
+def owner_label(owner: Optional[str]) -> Optional[str]:
+    """履歴に残す利用者名（APIキーはそのまま保存せずハッシュにする）"""
+    if owner is None or owner.startswith("ip:"):
+        return owner
+    return "key:" + hashlib.sha256(owner.encode()).hexdigest()[:12]
+
 # 画像生成エンドポイント
 @app.post("/api/generate")
-async def generate_image(request: GenerateRequest):
+async def generate_image(request: GenerateRequest, http_request: Request):
     """画像生成のメインエンドポイント"""
     print(f"[DEBUG] Generate request received: mode={request.mode}, model={request.model}")
-    print(f"[DEBUG] Request details: {request.dict()}")
+    request = request.model_copy(update={"user": request_owner(http_request)})
+    print(f"[DEBUG] Request details: {request.model_dump(exclude={'user'})}")
     
     try:
-        # ワークフローの作成
-        if request.mode == "txt2img":
-            workflow = workflow_manager.create_txt2img_workflow(
-                prompt=request.prompt,
-                negative_prompt=request.negative_prompt,
-                width=request.width,
-                height=request.height,
-                steps=request.steps,
-                cfg_scale=request.cfg_scale,
-                sampler_name=request.sampler_name,
-                scheduler=request.scheduler,
-                seed=request.seed,
-                batch_size=request.batch_size,
-                model=request.model,
-                vae=request.vae,
-                loras=request.loras
-            )
-        elif request.mode == "img2img":
-            workflow = workflow_manager.create_img2img_workflow(
-                prompt=request.prompt,
-                negative_prompt=request.negative_prompt,
-                init_image=request.init_image,
-                denoising_strength=request.denoising_strength,
-                steps=request.steps,
-                cfg_scale=request.cfg_scale,
-                sampler_name=request.sampler_name,
-                scheduler=request.scheduler,
-                seed=request.seed,
-                batch_size=request.batch_size,
-                model=request.model,
-                vae=request.vae,
-                loras=request.loras
-            )
-        elif request.mode == "inpaint":
-            workflow = workflow_manager.create_inpaint_workflow(
-                prompt=request.prompt,
-                negative_prompt=request.negative_prompt,
-                init_image=request.init_image,
-                mask_image=request.mask_image,
-                denoising_strength=request.denoising_strength,
-                steps=request.steps,
-                cfg_scale=request.cfg_scale,
-                sampler_name=request.sampler_name,
-                scheduler=request.scheduler,
-                seed=request.seed,
-                batch_size=request.batch_size,
-                model=request.model,
-                vae=request.vae,
-                loras=request.loras
-            )
+        if request.draft:
+            result = await submit_draft(request, check_admission=True)
         else:
-            raise HTTPException(status_code=400, detail=f"Unknown mode: {request.mode}")
-        
-        # ComfyUIに送信
-        result = await comfyui_bridge.queue_prompt(workflow)
-        
-        if result["success"]:
-            return {
-                "success": True,
-                "prompt_id": result["prompt_id"],
-                "message": "画像生成を開始しました"
-            }
+            result = await submit_generation(request, check_admission=True)
+        if result["reused"] == "completed":
+            message = "生成済みの画像を再利用しました"
+        elif request.draft:
+            message = "下書きの生成を開始しました"
         else:
-            print(f"[ERROR] ComfyUI returned error: {result}")
-            raise HTTPException(status_code=500, detail=result.get("error", "Unknown error"))
-            
+            message = "画像生成を開始しました"
+        return {"success": True, **result, "message": message}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"[ERROR] Generate image failed: {str(e)}")
         print(f"[ERROR] Exception type: {type(e).__name__}")
@@ -172,32 +667,231 @@ async def generate_image(request: GenerateRequest):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+# バッチ・グリッド生成エンドポイント
+@app.post("/api/generate/batch")
+async def generate_batch(request: BatchGenerateRequest, http_request: Request):
+    """複数のリクエスト、またはグリッド指定を展開してまとめて生成"""
+    if request.grid:
+        if request.base is None:
+            raise HTTPException(status_code=400, detail="base is required with grid")
+        try:
+            # 登録済みワークフローは明示されたパラメータだけを差し込むため、未指定の項目は既定値のままにする
+            variants = expand_grid(request.base.model_dump(exclude_unset=True), request.grid, BATCH_MAX_ITEMS)
+            requests = [GenerateRequest(**values) for _, values in variants]
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        params = [item_params for item_params, _ in variants]
+    elif request.requests:
+        if len(request.requests) > BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=400, detail=f"Too many requests (max {BATCH_MAX_ITEMS})")
+        requests = request.requests
+        params = [{} for _ in requests]
+    else:
+        raise HTTPException(status_code=400, detail="requests or grid is required")
+    
+    owner = request_owner(http_request)
+    # バッチの項目は対話的な生成を先に送り出せるよう低い優先度で並べる
+    requests = [
+        item.model_copy(update={"client_id": item.client_id or request.client_id, "user": owner, "priority": "low"})
+        for item in requests
+    ]
+    try:
+        admission.check("batch", sum(estimate_request_cost(item) for item in requests))
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    batch = batch_manager.create(requests, params, request.grid)
+    batch_id = batch["batch_id"]
+    return {
+        "success": True,
+        "batch_id": batch_id,
+        "total": len(requests),
+        "stream_url": f"/api/batch/{batch_id}/stream",
+        "contact_sheet_url": f"/api/batch/{batch_id}/contact_sheet",
+        "message": f"{len(requests)}件の画像生成を開始しました"
+    }
+
+# 進捗イベント配信エンドポイント
+@app.get("/api/events/{prompt_id}")
+async def stream_prompt_events(prompt_id: str, request: Request, last_event_id: Optional[int] = None):
+    """待ち行列・開始・進捗・ノード実行・出力・完了/失敗をSSEで配信（Last-Event-IDで続きから再開）"""
+    if last_event_id is None:
+        try:
+            last_event_id = int(request.headers.get("last-event-id") or 0)
+        except ValueError:
+            last_event_id = 0
+    
+    if prompt_id not in prompt_events:
+        # 記録の上限で消えた古いプロンプトは保存済みの履歴から結果だけを返す
+        record = await history_store.get(prompt_id)
+        if record is None or record["status"] in ("pending", "running"):
+            raise HTTPException(status_code=404, detail="Prompt not found")
+        if record["status"] == "completed":
+            event, data = "completed", {"prompt_id": prompt_id, "outputs": record["outputs"]}
+        else:
+            event, data = "failed", {"prompt_id": prompt_id, "error": record["error"]}
+        return StreamingResponse(iter([format_sse(event, data)]), media_type="text/event-stream", headers=SSE_HEADERS)
+    
+    async def events():
+        # 配信中のSSEもクライアントの接続として数える
+        client_key = abandon_monitor.owner(prompt_id)
+        if client_key is not None:
+            abandon_monitor.connected(client_key)
+        try:
+            async for event_id, event, data in prompt_events.stream(prompt_id, last_event_id):
+                if event is None:
+                    yield format_sse_comment()
+                else:
+                    yield format_sse(event, data, str(event_id) if event_id is not None else None)
+        finally:
+            if client_key is not None:
+                abandon_monitor.disconnected(client_key)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+# 生成の取り消しエンドポイント
+@app.delete("/api/jobs/{prompt_id}")
+async def cancel_job(prompt_id: str):
+    """待機中ならキューから削除し、実行中ならそのプロンプトだけを中断（他のユーザーの生成は止めない）"""
+    status = await cancel_prompt(prompt_id)
+    if status == "not_found":
+        raise HTTPException(status_code=404, detail="Prompt not found")
+    if status == "finished":
+        raise HTTPException(status_code=409, detail="Prompt has already finished")
+    if status == "error":
+        raise HTTPException(status_code=502, detail="Failed to cancel the prompt on ComfyUI")
+    return {"success": True, "prompt_id": prompt_id, "status": status}
+
+# 下書きジョブ状態取得エンドポイント
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """下書きと本番生成の状態をまとめて取得"""
+    job = refine_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    response = refine_manager.to_dict(job)
+    for stage in ("draft", "final"):
+        if job[stage] is None:
+            continue
+        try:
+            response[stage] = {**job[stage], **await get_prompt_status(job[stage]["prompt_id"])}
+        except Exception as e:
+            response[stage] = {**job[stage], "status": "unknown", "error": str(e)}
+    return response
+
+# 本番生成エンドポイント
+@app.post("/api/jobs/{job_id}/refine")
+async def refine_job(job_id: str):
+    """下書きを確定して本番品質で生成（既に送信済みなら同じprompt_idを返す）"""
+    job = refine_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["final"] is None and not refine_manager.is_refining(job_id):
+        # 確認後の本番生成は対話的な操作として受け付け制御する
+        try:
+            admission.check("interactive", estimate_request_cost(job["request"]))
+        except AdmissionRejected as e:
+            raise admission_error(e)
+    try:
+        job = await refine_manager.refine(job_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Job not found")
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=e.args[0])
+    final = {**job["final"], "instance": job["final"]["instance"] or prompt_instance(job["final"]["prompt_id"])}
+    return {"success": True, "job_id": job_id, **final, "message": "本番の生成を開始しました"}
+
+# バッチ状態取得エンドポイント
+@app.get("/api/batch/{batch_id}")
+async def get_batch(batch_id: str):
+    """バッチ内の各項目の状態"""
+    batch = batch_manager.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    await batch_manager.refresh(batch)
+    return batch_manager.to_dict(batch)
+
+# バッチ進捗のストリーミング（Server-Sent Events）
+@app.get("/api/batch/{batch_id}/stream")
+async def stream_batch(batch_id: str):
+    """項目の状態が変わるたびにイベントを送り、全項目の完了で終了"""
+    if batch_manager.get(batch_id) is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    
+    async def events():
+        async for event, data in batch_manager.watch(batch_id):
+            if event is None:
+                yield format_sse_comment()
+                continue
+            if event == "completed":
+                data = {**data, "contact_sheet_url": f"/api/batch/{batch_id}/contact_sheet"}
+            yield format_sse(event, data)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+# コンタクトシート取得エンドポイント
+@app.get("/api/batch/{batch_id}/contact_sheet")
+async def get_batch_contact_sheet(batch_id: str, cell_size: int = 256):
+    """バッチの結果を1枚に並べた画像（完了前は途中経過）"""
+    data = await batch_manager.contact_sheet(batch_id, max(64, min(cell_size, 1024)))
+    if data is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return Response(content=data, media_type="image/jpeg", headers={"Cache-Control": "no-cache"})
+
 # 生成状態確認エンドポイント
 @app.get("/api/status/{prompt_id}")
 async def get_generation_status(prompt_id: str):
     """生成状態の確認"""
     try:
-        status = await comfyui_bridge.get_prompt_status(prompt_id)
+        status = await get_prompt_status(prompt_id)
         return status
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# 生成履歴一覧エンドポイント
+@app.get("/api/history")
+async def list_generation_history(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    model: Optional[str] = None,
+    user: Optional[str] = None,
+    status: Optional[str] = None
+):
+    """保存済みの生成履歴を新しい順に取得（next_cursorで次のページ）"""
+    try:
+        return await history_store.list(limit=limit, cursor=cursor, model=model, user=user, status=status)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# 生成履歴検索エンドポイント
+@app.get("/api/history/search")
+async def search_generation_history(
+    q: str,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    model: Optional[str] = None,
+    user: Optional[str] = None
+):
+    """プロンプトの全文検索（語はすべて含むものに一致）"""
+    try:
+        return await history_store.list(limit=limit, cursor=cursor, model=model, user=user, query=q)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # 生成履歴取得エンドポイント
 @app.get("/api/history/{prompt_id}")
 async def get_generation_history(prompt_id: str):
-    """生成履歴と画像の取得"""
-    try:
-        history = await comfyui_bridge.get_history(prompt_id)
-        return history
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    """生成履歴と画像の取得（保存済みの履歴から返し、ComfyUIには問い合わせない）"""
+    record = await history_store.get(prompt_id)
+    if record is None:
+        return {"prompt_id": prompt_id, "outputs": [], "status": "not_found"}
+    return record
 
 # モデル一覧取得エンドポイント
 @app.get("/api/models")
 async def get_models():
     """利用可能なモデルの一覧を取得"""
     try:
-        models = await comfyui_bridge.get_models()
+        models = await comfyui_pool.get_models()
         return {"models": models}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -207,11 +901,75 @@ async def get_models():
 async def get_loras():
     """利用可能なLoRAの一覧を取得"""
     try:
-        loras = await comfyui_bridge.get_loras()
+        loras = await comfyui_pool.get_loras()
         return {"loras": loras}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# フロントエンド向けの統合カタログ（カタログ更新時のみ再構築）
+catalog_view_cache = CatalogViewCache()
+
+# 統合カタログ取得エンドポイント
+@app.get("/api/catalog")
+async def get_catalog(request: Request):
+    """モデル・LoRA・VAE・サンプラー・スケジューラーをまとめて取得（ETag・gzip対応）"""
+    try:
+        catalog = await comfyui_pool.get_catalog()
+    except Exception as e:
+        print(f"[WARNING] Serving last known catalog: {e}")
+        catalog = None
+    view = catalog_view_cache.get(catalog)
+    headers = {"ETag": view.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), view.etag):
+        return Response(status_code=304, headers=headers)
+    if view.gzip_body is not None and "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(view.gzip_body, media_type="application/json", headers={**headers, "Content-Encoding": "gzip"})
+    return Response(view.body, media_type="application/json", headers=headers)
+
+# カタログ再取得エンドポイント
+@app.post("/api/catalog/refresh")
+async def refresh_catalog():
+    """モデル等のカタログキャッシュを破棄して再取得"""
+    try:
+        comfyui_pool.invalidate_catalogs()
+        catalog = await comfyui_pool.get_catalog(force_refresh=True)
+        return {"success": True, "version": catalog["version"], "fetched_at": catalog["fetched_at"]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# 登録済みワークフロー一覧エンドポイント
+@app.get("/api/workflows")
+async def list_workflows():
+    """登録済みワークフローと割り当て可能なパラメータの一覧"""
+    return {"workflows": workflow_registry.list()}
+
+# 登録済みワークフロー取得エンドポイント
+@app.get("/api/workflows/{name}")
+async def get_workflow(name: str):
+    """登録済みワークフローの定義（登録時と同じ形式）"""
+    definition = workflow_registry.get(name)
+    if definition is None:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    return definition.to_dict()
+
+# ワークフロー登録エンドポイント
+@app.put("/api/workflows/{name}")
+async def register_workflow(name: str, request: RegisterWorkflowRequest):
+    """API形式のワークフローを名前付きで登録（同名は置き換え）"""
+    try:
+        definition = await workflow_registry.register(name, request.workflow, request.parameters, request.description)
+    except WorkflowDefinitionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"success": True, **definition.summary()}
+
+# ワークフロー削除エンドポイント
+@app.delete("/api/workflows/{name}")
+async def delete_workflow(name: str):
+    """登録済みワークフローを削除"""
+    if not await workflow_registry.delete(name):
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    return {"success": True}
+
 # サンプラー一覧取得エンドポイント
 @app.get("/api/samplers")
 async def get_samplers():
@@ -233,56 +991,97 @@ async def get_schedulers():
 # 画像アップロードエンドポイント
 @app.post("/api/upload")
 async def upload_image(file: UploadFile = File(...)):
-    """画像のアップロード（img2img/inpaint用）"""
+    """画像のアップロード（img2img/inpaint用、同じ内容の画像は一度だけ保存・送信）"""
     try:
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents))
-        
-        # Base64エンコード
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode()
-        
+        record = await upload_store.save_file(file.file)
         return {
             "success": True,
-            "image": f"data:image/png;base64,{img_base64}",
-            "width": image.width,
-            "height": image.height
+            "image_id": record["id"],
+            "image": record["id"],
+            "width": record["width"],
+            "height": record["height"],
+            "size": record["size"]
         }
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # プレビュー画像取得エンドポイント
 @app.get("/api/preview/{filename}")
-async def get_preview_image(filename: str):
-    """生成された画像の取得"""
-    try:
-        image_data = await comfyui_bridge.get_image(filename)
-        return StreamingResponse(io.BytesIO(image_data), media_type="image/png")
-    except Exception as e:
-        raise HTTPException(status_code=404, detail="Image not found")
+async def get_preview_image(
+    request: Request,
+    filename: str,
+    subfolder: str = "",
+    type: str = "output",
+    prompt_id: Optional[str] = None
+):
+    """生成された画像の取得（ComfyUIからストリーミングで中継）"""
+    if prompt_id:
+        prompt_id = micro_batcher.resolve(prompt_id)[0]
+    bridge = comfyui_pool.resolve_output_bridge(filename, prompt_id)
+    etag = make_etag(bridge.comfyui_url, filename, subfolder, type)
+    range_header = request.headers.get("range")
+    if type != "output":
+        return await stream_image(bridge, filename, subfolder, type, range_header)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified_response(etag, type)
+    
+    # 出力画像は不変なのでキャッシュから返す
+    key = (bridge.comfyui_url, filename, subfolder, type)
+    data = await image_cache.get(key)
+    if data is not None:
+        response = bytes_response(data, guess_content_type(filename), etag, type, range_header)
+        image_cache.record_served(len(response.body))
+        return response
+    
+    async def store(data: bytes):
+        await image_cache.put(key, data)
+    
+    return await stream_image(
+        bridge, filename, subfolder, type, range_header,
+        on_complete=store,
+        max_capture_size=image_cache.max_entry_size
+    )
+
+# 画像キャッシュ統計エンドポイント
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """画像キャッシュのヒット率と使用量"""
+    return image_cache.get_stats()
 
 # WebSocketエンドポイント（リアルタイム更新用）
 from fastapi import WebSocket, WebSocketDisconnect
 
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(websocket: WebSocket, clientId: Optional[str] = None):
     await websocket.accept()
+    client = ws_hub.connect(websocket, clientId)
+    abandon_monitor.connected(client.client_id)
+    sender = asyncio.create_task(client.run_sender())
     try:
-        # ComfyUIのWebSocketに接続
-        async with comfyui_bridge.connect_websocket() as comfyui_ws:
-            # メッセージの中継
-            async def relay_from_comfyui():
-                async for message in comfyui_ws:
-                    await websocket.send_text(message)
-            
-            # 並行してメッセージを処理
-            await relay_from_comfyui()
+        await websocket.send_text(json.dumps({"type": "hub_connected", "data": {"client_id": client.client_id}}))
+        # クライアントからの購読要求を処理
+        while True:
+            message = json.loads(await websocket.receive_text())
+            prompt_id = (message.get("data") or {}).get("prompt_id")
+            if not prompt_id:
+                continue
+            if message.get("type") == "subscribe":
+                ws_hub.subscribe(client.client_id, prompt_id)
+            elif message.get("type") == "unsubscribe":
+                ws_hub.unsubscribe(client.client_id, prompt_id)
             
     except WebSocketDisconnect:
         print("Client disconnected")
     except Exception as e:
         print(f"WebSocket error: {e}")
+    finally:
+        sender.cancel()
+        ws_hub.disconnect(client)
+        abandon_monitor.disconnected(client.client_id)
 
 # サーバー起動
 if __name__ == "__main__":
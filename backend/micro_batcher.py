@@ -0,0 +1,217 @@
+"""
+Micro Batcher - 互換性のあるtxt2imgリクエストを短時間まとめて1つのLatentバッチで実行
+"""
+
+import asyncio
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable
+
+from result_index import workflow_hash
+
+def _find_node(workflow: Dict[str, Any], class_type: str) -> Optional[str]:
+    for node_id, node in workflow.items():
+        if node.get("class_type") == class_type:
+            return node_id
+    return None
+
+def batch_key(workflow: Dict[str, Any]) -> Optional[str]:
+    """シードとバッチサイズ以外が同一なワークフローで等しくなるキー（まとめられない場合はNone）"""
+    latent_id = _find_node(workflow, "EmptyLatentImage")
+    sampler_id = _find_node(workflow, "KSampler")
+    if latent_id is None or sampler_id is None:
+        return None
+    latent, sampler = workflow[latent_id], workflow[sampler_id]
+    normalized = {
+        **workflow,
+        latent_id: {**latent, "inputs": {**latent["inputs"], "batch_size": 0}},
+        sampler_id: {**sampler, "inputs": {**sampler["inputs"], "seed": 0}}
+    }
+    return workflow_hash(normalized)
+
+def slice_outputs(outputs: List[Dict[str, Any]], start: int, count: int) -> List[Dict[str, Any]]:
+    """出力ノードごとにバッチ内の担当範囲の画像だけを取り出す"""
+    by_node: Dict[Any, List[Dict[str, Any]]] = {}
+    for output in outputs:
+        by_node.setdefault(output.get("node_id"), []).append(output)
+    return [output for group in by_node.values() for output in group[start:start + count]]
+
+class _PendingBatch:
+    def __init__(self, workflow: Dict[str, Any], options: Dict[str, Any]):
+        self.workflow = workflow
+        # 送信時のオプション（所有者・優先度など、全メンバーで同じ）
+        self.options = options
+        self.size = 0
+        # (開始位置, 枚数, 結果を受け取るFuture)
+        self.members: List[Tuple[int, int, asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+class MicroBatcher:
+    def __init__(
+        self,
+        submit: Callable[..., Awaitable[Dict[str, Any]]],
+        window: float = 0.0,
+        max_batch_size: int = 8,
+        max_tracked: int = 10000
+    ):
+        self._submit = submit
+        # リクエストを待ち合わせる時間（0で無効）
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.max_tracked = max_tracked
+        self._pending: Dict[Tuple[str, Optional[str], Tuple[Tuple[str, Any], ...]], _PendingBatch] = {}
+        # 実際のprompt_id → [(仮想prompt_id, 開始位置, 枚数)]
+        self._groups: "OrderedDict[str, List[Tuple[str, int, int]]]" = OrderedDict()
+        # 仮想prompt_id → (実際のprompt_id, 開始位置, 枚数)
+        self._members: Dict[str, Tuple[str, int, int]] = {}
+        self._tasks = set()
+        self._event_listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+        self.stats = {"requests": 0, "batches": 0, "merged_requests": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 and self.max_batch_size > 1
+
+    async def submit(self, workflow: Dict[str, Any], group: Optional[str] = None, **options) -> Dict[str, Any]:
+        """まとめられる相手を待ってから送信し、呼び出し元ごとの結果を返す（optionsは送信先にそのまま渡す）
+
+        groupが異なるリクエストはまとめない（受け付け制御の区分など、送信先には渡さない）。
+        まとめた場合の結果には、実際に使われたシード（seed）とバッチ内の開始位置（batch_index）が付く
+        """
+        key = batch_key(workflow) if self.enabled else None
+        latent_id = _find_node(workflow, "EmptyLatentImage")
+        count = workflow[latent_id]["inputs"]["batch_size"] if latent_id else 1
+        if key is None or count >= self.max_batch_size:
+            return await self._submit(workflow, **options)
+        # 所有者や優先度が異なるリクエストはまとめない（公平性の計上や優先度を他のメンバーに付け替えないため）
+        key = (key, group, tuple(sorted(options.items())))
+
+        self.stats["requests"] += 1
+        batch = self._pending.get(key)
+        if batch is not None and batch.size + count > self.max_batch_size:
+            self._flush(key)
+            batch = None
+        if batch is None:
+            batch = _PendingBatch(workflow, options)
+            batch.timer = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+            self._pending[key] = batch
+        future = asyncio.get_running_loop().create_future()
+        batch.members.append((batch.size, count, future))
+        batch.size += count
+        if batch.size >= self.max_batch_size:
+            self._flush(key)
+        # 呼び出し元が切断しても他のメンバーの送信は続ける
+        return await asyncio.shield(future)
+
+    def _flush(self, key: Tuple[str, Optional[str], Tuple[Tuple[str, Any], ...]]):
+        """待ち合わせを締め切って送信"""
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = asyncio.create_task(self._submit_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _submit_batch(self, batch: _PendingBatch):
+        """まとめたワークフローを送信し、各メンバーに仮想prompt_idを割り当てる"""
+        workflow = batch.workflow
+        if len(batch.members) > 1:
+            latent_id = _find_node(workflow, "EmptyLatentImage")
+            latent = workflow[latent_id]
+            workflow = {**workflow, latent_id: {**latent, "inputs": {**latent["inputs"], "batch_size": batch.size}}}
+        try:
+            result = await self._submit(workflow, **batch.options)
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+
+        if len(batch.members) == 1 or not result.get("success"):
+            for _, _, future in batch.members:
+                if not future.done():
+                    future.set_result(result)
+            return
+
+        self.stats["batches"] += 1
+        self.stats["merged_requests"] += len(batch.members)
+        # 実行されるのは最初のメンバーのシード（各メンバーの画像はバッチ内の位置で決まる）
+        seed = workflow[_find_node(workflow, "KSampler")]["inputs"]["seed"]
+        members = []
+        for start, count, future in batch.members:
+            virtual_id = str(uuid.uuid4())
+            members.append((virtual_id, start, count))
+            self._members[virtual_id] = (result["prompt_id"], start, count)
+            if not future.done():
+                future.set_result({
+                    **result,
+                    "prompt_id": virtual_id,
+                    "batched_with": len(batch.members),
+                    "seed": seed,
+                    "batch_index": start
+                })
+        self._groups[result["prompt_id"]] = members
+        while len(self._groups) > self.max_tracked:
+            _, evicted = self._groups.popitem(last=False)
+            for virtual_id, _, _ in evicted:
+                self._members.pop(virtual_id, None)
+
+    def resolve(self, prompt_id: str) -> Tuple[str, Optional[Tuple[int, int]]]:
+        """仮想prompt_idを (実際のprompt_id, (開始位置, 枚数)) に変換（通常のIDはそのまま）"""
+        member = self._members.get(prompt_id)
+        if member is None:
+            return prompt_id, None
+        return member[0], (member[1], member[2])
+
+    def detach(self, prompt_id: str) -> Optional[Tuple[str, bool]]:
+        """まとめたプロンプトからメンバーを外し (実際のprompt_id, 他のメンバーが残っているか) を返す
+
+        外したメンバーには以後のイベントを配信しない（まとめ実行のメンバーでなければNone）
+        """
+        member = self._members.pop(prompt_id, None)
+        if member is None:
+            return None
+        real_id = member[0]
+        members = [entry for entry in self._groups.get(real_id, []) if entry[0] != prompt_id]
+        if members:
+            self._groups[real_id] = members
+        else:
+            self._groups.pop(real_id, None)
+        return real_id, bool(members)
+
+    def add_event_listener(self, listener: Callable[[str, Dict[str, Any]], None]):
+        """仮想prompt_idに置き換えたイベントを受け取るリスナーを登録"""
+        self._event_listeners.append(listener)
+
+    def handle_event(self, instance: str, message: Dict[str, Any]):
+        """まとめたプロンプトのイベントをメンバーごとのイベントに分けて通知"""
+        for translated in self.translate(message):
+            for listener in self._event_listeners:
+                try:
+                    listener(instance, translated)
+                except Exception as e:
+                    print(f"[WARNING] Event listener failed: {e}")
+
+    def translate(self, message: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """実際のprompt_idのイベントを各メンバー向けに変換"""
+        data = message.get("data") or {}
+        members = self._groups.get(data.get("prompt_id"))
+        if not members:
+            return [message]
+        translated = []
+        for virtual_id, start, count in members:
+            member_data = {**data, "prompt_id": virtual_id}
+            output = data.get("output")
+            if message.get("type") == "executed" and output and "images" in output:
+                member_data["output"] = {**output, "images": output["images"][start:start + count]}
+            translated.append({**message, "data": member_data})
+        return translated
+
+    def get_stats(self) -> Dict[str, Any]:
+        """まとめ実行の統計"""
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "window_ms": self.window * 1000,
+            "max_batch_size": self.max_batch_size,
+            "pending_batches": len(self._pending)
+        }
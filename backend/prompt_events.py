@@ -0,0 +1,162 @@
+"""
+Prompt Events - プロンプトごとの進捗イベントの記録（SSE配信とLast-Event-IDからの再開用）
+"""
+
+import asyncio
+import itertools
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple, Callable, AsyncIterator
+
+# 終了イベント（"error"はブラウザのEventSourceが接続エラーに使う名前のため"failed"にする）
+TERMINAL_EVENTS = ("completed", "failed")
+
+class _PromptLog:
+    __slots__ = ("events", "outputs", "finished", "waiters")
+
+    def __init__(self):
+        # (イベントID, イベント名, データ)
+        self.events: List[Tuple[int, str, Dict[str, Any]]] = []
+        self.outputs: List[Dict[str, Any]] = []
+        self.finished = False
+        self.waiters: set = set()
+
+class PromptEventLog:
+    def __init__(
+        self,
+        get_position: Optional[Callable[[str], Optional[int]]] = None,
+        max_prompts: int = 5000,
+        poll_interval: float = 1.0,
+        keepalive_interval: float = 15.0
+    ):
+        # バックエンドの待ち行列内の順番（送り出し後はNone）
+        self._get_position = get_position
+        self.max_prompts = max_prompts
+        self.poll_interval = poll_interval
+        self.keepalive_interval = keepalive_interval
+        self._logs: "OrderedDict[str, _PromptLog]" = OrderedDict()
+        # イベントIDは全プロンプトで単調増加（再接続時のLast-Event-IDで続きから送る）
+        self._ids = itertools.count(1)
+
+    def __contains__(self, prompt_id: str) -> bool:
+        return prompt_id in self._logs
+
+    def track(self, prompt_id: str, queue_position: Optional[int] = None):
+        """送信したプロンプトの記録を開始"""
+        if prompt_id in self._logs:
+            return
+        self._logs[prompt_id] = _PromptLog()
+        while len(self._logs) > self.max_prompts:
+            _, evicted = self._logs.popitem(last=False)
+            for waiter in evicted.waiters:
+                waiter.set()
+        self._append(prompt_id, "queued", {"queue_position": queue_position})
+
+    def _append(self, prompt_id: str, event: str, data: Dict[str, Any]):
+        log = self._logs.get(prompt_id)
+        if log is None or log.finished:
+            return
+        entry = (next(self._ids), event, {"prompt_id": prompt_id, **data})
+        if event == "progress" and log.events and log.events[-1][1] == "progress":
+            # 連続する進捗は最新の1件だけ残す（再開時に古い進捗を送り直さない）
+            log.events[-1] = entry
+        else:
+            log.events.append(entry)
+        if event in TERMINAL_EVENTS:
+            log.finished = True
+        for waiter in log.waiters:
+            waiter.set()
+
+    def handle_event(self, instance: Optional[str], message: Dict[str, Any]):
+        """ComfyUIのイベントをプロンプトごとのイベントに変換して記録"""
+        event_type = message.get("type")
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        log = self._logs.get(prompt_id)
+        if log is None:
+            return
+        if event_type == "execution_start":
+            self._append(prompt_id, "started", {"instance": instance})
+        elif event_type == "executing":
+            if data.get("node") is None:
+                self._append(prompt_id, "completed", {"outputs": list(log.outputs)})
+            else:
+                self._append(prompt_id, "executing", {"node": data["node"]})
+        elif event_type == "progress":
+            maximum = data.get("max")
+            self._append(prompt_id, "progress", {
+                "value": data.get("value"),
+                "max": maximum,
+                "progress": data.get("value", 0) / maximum if maximum else None,
+                "node": data.get("node")
+            })
+        elif event_type == "executed":
+            images = [
+                {
+                    "filename": image["filename"],
+                    "subfolder": image.get("subfolder", ""),
+                    "type": image.get("type", "output"),
+                    "node_id": data.get("node")
+                }
+                for image in (data.get("output") or {}).get("images", [])
+            ]
+            if images:
+                log.outputs.extend(images)
+                self._append(prompt_id, "output", {"node": data.get("node"), "images": images})
+        elif event_type == "execution_success":
+            self._append(prompt_id, "completed", {"outputs": list(log.outputs)})
+        elif event_type == "execution_error":
+            self._append(prompt_id, "failed", {
+                "error": data.get("exception_message") or "Execution failed",
+                "node": data.get("node_id")
+            })
+        elif event_type == "execution_interrupted":
+            self._append(prompt_id, "failed", {"error": "Execution interrupted", "interrupted": True})
+
+    async def stream(
+        self,
+        prompt_id: str,
+        last_event_id: int = 0
+    ) -> AsyncIterator[Tuple[Optional[int], Optional[str], Optional[Dict[str, Any]]]]:
+        """last_event_idより後のイベントを順に返し、終了イベントで終わる
+
+        (ID, イベント名, データ) を返す。待ち行列内の順番の変化はIDなし、
+        接続維持は (None, None, None)
+        """
+        log = self._logs.get(prompt_id)
+        if log is None:
+            return
+        waiter = asyncio.Event()
+        log.waiters.add(waiter)
+        cursor = last_event_id
+        position = None
+        idle = 0.0
+        try:
+            while True:
+                for event_id, event, data in list(log.events):
+                    if event_id > cursor:
+                        cursor = event_id
+                        idle = 0.0
+                        yield event_id, event, data
+                if log.finished or self._logs.get(prompt_id) is not log:
+                    return
+                try:
+                    await asyncio.wait_for(waiter.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    idle += self.poll_interval
+                    current = self._get_position(prompt_id) if self._get_position else None
+                    if current is not None and current != position:
+                        position = current
+                        idle = 0.0
+                        yield None, "queued", {"prompt_id": prompt_id, "queue_position": current}
+                    elif idle >= self.keepalive_interval:
+                        idle = 0.0
+                        yield None, None, None
+                waiter.clear()
+        finally:
+            log.waiters.discard(waiter)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "prompts": len(self._logs),
+            "streams": sum(len(log.waiters) for log in self._logs.values())
+        }
@@ -0,0 +1,125 @@
+"""
+Refine Manager - 低ステップ・縮小解像度の下書きと、確認後の本番生成を1つのジョブにまとめる
+"""
+
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple, Callable, Awaitable
+
+def draft_size(width: int, height: int, scale: float, min_side: int = 256) -> Tuple[int, int]:
+    """下書きの解像度（縦横比を保って縮小し8の倍数に丸める、元より大きくはしない）"""
+    factor = max(scale, min_side / max(1, min(width, height)))
+    def fit(side: int) -> int:
+        return min(side, max(8, round(side * factor / 8) * 8))
+    return fit(width), fit(height)
+
+class RefineManager:
+    def __init__(
+        self,
+        submit: Callable[[Any], Awaitable[Dict[str, Any]]],
+        max_jobs: int = 1000
+    ):
+        self._submit = submit
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # 下書きのprompt_id → job_id
+        self._draft_jobs: Dict[str, str] = {}
+        self._refining: Dict[str, asyncio.Task] = {}
+        self.stats = {"drafts": 0, "refined": 0, "auto_refined": 0}
+
+    def create(self, draft_result: Dict[str, Any], final_request: Any, auto_refine: bool) -> Dict[str, Any]:
+        """送信済みの下書きをジョブとして登録（自動で本番生成する場合は下書きの完了を待つ）"""
+        job_id = str(uuid.uuid4())
+        job = {
+            "job_id": job_id,
+            "created_at": time.time(),
+            "auto_refine": auto_refine,
+            "draft": {"prompt_id": draft_result["prompt_id"], "instance": draft_result.get("instance")},
+            "final": None,
+            "error": None,
+            "request": final_request
+        }
+        self._jobs[job_id] = job
+        self._draft_jobs[draft_result["prompt_id"]] = job_id
+        while len(self._jobs) > self.max_jobs:
+            self._forget(next(iter(self._jobs)))
+        self.stats["drafts"] += 1
+        # 下書きが生成済みの結果を再利用した場合は完了イベントが来ない
+        if auto_refine and draft_result.get("reused") == "completed":
+            self._start_refine(job_id)
+        return job
+
+    def _forget(self, job_id: str):
+        job = self._jobs.pop(job_id, None)
+        if job is not None:
+            self._draft_jobs.pop(job["draft"]["prompt_id"], None)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self._jobs.get(job_id)
+
+    def is_refining(self, job_id: str) -> bool:
+        """本番生成を送信中か"""
+        return job_id in self._refining
+
+    async def refine(self, job_id: str) -> Dict[str, Any]:
+        """本番生成を送信（送信済みなら既存の結果を返す）"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            raise KeyError(job_id)
+        if job["final"] is None:
+            task = self._refining.get(job_id) or self._start_refine(job_id)
+            # 呼び出し元が切断しても送信は続ける
+            await asyncio.shield(task)
+        if job["error"] is not None and job["final"] is None:
+            raise RuntimeError(job["error"])
+        return job
+
+    def _start_refine(self, job_id: str) -> asyncio.Task:
+        task = asyncio.create_task(self._submit_final(job_id))
+        self._refining[job_id] = task
+        task.add_done_callback(lambda _: self._refining.pop(job_id, None))
+        return task
+
+    async def _submit_final(self, job_id: str):
+        job = self._jobs.get(job_id)
+        if job is None or job["final"] is not None:
+            return
+        try:
+            result = await self._submit(job["request"])
+        except Exception as e:
+            job["error"] = getattr(e, "detail", None) or str(e)
+            print(f"[ERROR] Refine failed for job {job_id}: {job['error']}")
+            return
+        job["final"] = {"prompt_id": result["prompt_id"], "instance": result.get("instance")}
+        job["error"] = None
+        self.stats["refined"] += 1
+
+    def handle_event(self, instance: str, message: Dict[str, Any]):
+        """下書きの完了を受けて、自動の本番生成を送信"""
+        event_type = message.get("type")
+        data = message.get("data") or {}
+        job_id = self._draft_jobs.get(data.get("prompt_id"))
+        if job_id is None:
+            return
+        finished = event_type == "execution_success" or (event_type == "executing" and data.get("node") is None)
+        failed = event_type in ("execution_error", "execution_interrupted")
+        if not finished and not failed:
+            return
+        job = self._jobs[job_id]
+        self._draft_jobs.pop(data["prompt_id"], None)
+        if failed:
+            job["error"] = "Draft generation failed"
+            return
+        if job["auto_refine"] and job["final"] is None and job_id not in self._refining:
+            # 下書きの後ろに積むため、同時に届いた他のリクエストより後回しになる
+            self.stats["auto_refined"] += 1
+            self._start_refine(job_id)
+
+    def to_dict(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """APIレスポンス用（元のリクエストは含めない）"""
+        return {key: value for key, value in job.items() if key != "request"}
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "jobs": len(self._jobs), "refining": len(self._refining)}
@@ -0,0 +1,137 @@
+"""
+Result Index - 同一ワークフローの実行中プロンプトへの相乗りと完了結果の再利用
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Awaitable
+
+from job_status import JobStatusTable
+
+def _canonicalize(value: Any) -> Any:
+    """数値表現の揺れ（7と7.0など）を揃える"""
+    if isinstance(value, dict):
+        return {str(key): _canonicalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonicalize(item) for item in value]
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def workflow_hash(workflow: Dict[str, Any]) -> str:
+    """ワークフローの正規化JSONのSHA-256"""
+    canonical = json.dumps(_canonicalize(workflow), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+class ResultIndex:
+    def __init__(self, jobs: JobStatusTable, max_entries: int = 1000, ttl: float = 3600.0):
+        self.jobs = jobs
+        self.max_entries = max_entries
+        # 完了結果を再利用する期間（ComfyUI側で出力が消される可能性があるため）
+        self.ttl = ttl
+        # ハッシュ → 完了したプロンプト
+        self._completed: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # ハッシュ → 実行中のプロンプト
+        self._inflight: Dict[str, Dict[str, Any]] = {}
+        self._prompt_keys: Dict[str, str] = {}
+        # 送信中（prompt_id未確定）のハッシュ
+        self._submitting: Dict[str, asyncio.Future] = {}
+        self.stats = {"reused_completed": 0, "reused_inflight": 0, "submitted": 0}
+
+    async def submit(self, key: str, submit: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """同じハッシュの結果があれば再利用し、なければsubmitを呼んで登録"""
+        entry = self._completed.get(key)
+        if entry is not None:
+            if time.time() - entry["completed_at"] <= self.ttl:
+                self._completed.move_to_end(key)
+                self.stats["reused_completed"] += 1
+                return {**entry, "reused": "completed"}
+            del self._completed[key]
+
+        while True:
+            entry = self._inflight.get(key)
+            if entry is not None:
+                # 終了イベントを取りこぼした古いエントリには相乗りしない
+                if time.time() - entry["submitted_at"] <= self.ttl:
+                    self.stats["reused_inflight"] += 1
+                    return {**entry, "reused": "inflight"}
+                self._forget_inflight(key)
+
+            future = self._submitting.get(key)
+            if future is None:
+                break
+            # 同時に届いた同一リクエストは最初の送信結果を待つ
+            await asyncio.wait([future])
+            if not future.cancelled():
+                self.stats["reused_inflight"] += 1
+                return {**future.result(), "reused": "inflight"}
+            # 最初の送信が失敗（受け付け拒否など）した場合、その結果は返さず自分のリクエストとして送り直す
+
+        future = asyncio.get_running_loop().create_future()
+        self._submitting[key] = future
+        try:
+            result = await submit()
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            self._submitting.pop(key, None)
+        entry = {"prompt_id": result["prompt_id"], "instance": result.get("instance"), "submitted_at": time.time()}
+        self._inflight[key] = entry
+        self._prompt_keys[entry["prompt_id"]] = key
+        while len(self._inflight) > self.max_entries:
+            self._forget_inflight(next(iter(self._inflight)))
+        future.set_result(entry)
+        self.stats["submitted"] += 1
+        return {**result, "reused": None}
+
+    def handle_event(self, instance: str, message: Dict[str, Any]):
+        """プロンプトの終了を受けて、成功した結果だけを再利用対象にする"""
+        event_type = message.get("type")
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if prompt_id not in self._prompt_keys:
+            return
+        finished = event_type == "execution_success" or (event_type == "executing" and data.get("node") is None)
+        failed = event_type in ("execution_error", "execution_interrupted")
+        if not finished and not failed:
+            return
+
+        key = self._prompt_keys.pop(prompt_id)
+        entry = self._inflight.pop(key, None)
+        job = self.jobs.get(prompt_id)
+        if failed or entry is None or job is None or not job["outputs"]:
+            return
+        self._completed[key] = {
+            **entry,
+            "outputs": list(job["outputs"]),
+            "completed_at": time.time()
+        }
+        self._completed.move_to_end(key)
+        while len(self._completed) > self.max_entries:
+            self._completed.popitem(last=False)
+
+    def _forget_inflight(self, key: str):
+        entry = self._inflight.pop(key, None)
+        if entry is not None:
+            self._prompt_keys.pop(entry["prompt_id"], None)
+
+    def forget(self, prompt_id: str):
+        """プロンプトを再利用対象から外す（キャンセル時など）"""
+        key = self._prompt_keys.get(prompt_id)
+        if key is not None:
+            self._forget_inflight(key)
+        for key, entry in list(self._completed.items()):
+            if entry["prompt_id"] == prompt_id:
+                del self._completed[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """再利用の統計"""
+        return {
+            **self.stats,
+            "inflight": len(self._inflight),
+            "completed": len(self._completed)
+        }
@@ -3,6 +3,8 @@
 ComfyUIで利用可能なすべてのサンプラーとスケジューラーの定義
 """
 
+from functools import lru_cache
+
 # ComfyUIで利用可能なサンプラーの完全なリスト
 SAMPLERS = {
     # Euler系
@@ -295,30 +297,24 @@ def get_scheduler_info(scheduler_name):
     """スケジューラーの詳細情報を取得"""
     return SCHEDULERS.get(scheduler_name, {})
 
-def get_samplers_by_category():
-    """カテゴリー別にサンプラーを整理"""
+def group_by_category(names, definitions):
+    """名前の一覧をカテゴリー別に整理（定義にない名前は「その他」に名前そのままで入れる）"""
     categories = {}
-    for key, info in SAMPLERS.items():
-        category = info.get("category", "その他")
-        if category not in categories:
-            categories[category] = []
-        categories[category].append({
+    for key in names:
+        info = definitions.get(key) or {"name": key, "description": ""}
+        categories.setdefault(info.get("category", "その他"), []).append({
             "value": key,
             "name": info["name"],
             "description": info["description"]
         })
     return categories
 
+@lru_cache(maxsize=1)
+def get_samplers_by_category():
+    """カテゴリー別にサンプラーを整理（定義は変わらないため一度だけ作成）"""
+    return group_by_category(SAMPLERS, SAMPLERS)
+
+@lru_cache(maxsize=1)
 def get_schedulers_by_category():
-    """カテゴリー別にスケジューラーを整理"""
-    categories = {}
-    for key, info in SCHEDULERS.items():
-        category = info.get("category", "その他")
-        if category not in categories:
-            categories[category] = []
-        categories[category].append({
-            "value": key,
-            "name": info["name"],
-            "description": info["description"]
-        })
-    return categories
\ No newline at end of file
+    """カテゴリー別にスケジューラーを整理（定義は変わらないため一度だけ作成）"""
+    return group_by_category(SCHEDULERS, SCHEDULERS)
@@ -0,0 +1,25 @@
+"""
+SSE - Server-Sent Eventsの整形ヘルパー
+"""
+
+import json
+from typing import Any, Optional
+
+# プロキシ（nginx等）にバッファさせずに逐次届ける
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"
+}
+
+def format_sse(event: str, data: Any, event_id: Optional[str] = None) -> str:
+    """1件のイベントをSSEの書式に変換"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+def format_sse_comment(text: str = "keepalive") -> str:
+    """接続維持用のコメント行"""
+    return f": {text}\n\n"
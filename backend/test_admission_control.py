@@ -0,0 +1,82 @@
+"""
+受け付け制御のテスト - 未処理の仕事量をインスタンスごとに数え、最も空いているインスタンスで判定する
+"""
+
+import pytest
+
+from admission_control import AdmissionController, AdmissionRejected
+
+INSTANCES = ["http://gpu-a", "http://gpu-b"]
+
+
+def controller(routes):
+    """routes: prompt_id → 送り出し先（含まれないものは送り出し前）"""
+    return AdmissionController(
+        instances=lambda: INSTANCES,
+        budgets={"interactive": 10.0, "batch": 0},
+        seconds_per_unit=1.0,
+        instance_of=routes.get
+    )
+
+
+def admit(admission, prompt_id, cost, traffic="interactive"):
+    ticket = admission.admit(traffic, cost)
+    admission.assign(ticket, prompt_id)
+
+
+def test_routed_work_counts_on_its_instance():
+    admission = controller({"p1": "http://gpu-a"})
+    admit(admission, "p1", 8.0)
+    assert admission.backlogs("interactive") == {"http://gpu-a": 8.0, "http://gpu-b": 0.0}
+    # gpu-aが混んでいても空いているgpu-bで実行できる
+    admission.check("interactive", 8.0)
+
+
+def test_rejects_when_every_instance_is_over_budget():
+    admission = controller({"p1": "http://gpu-a", "p2": "http://gpu-b"})
+    admit(admission, "p1", 8.0)
+    admit(admission, "p2", 6.0)
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.check("interactive", 5.0)
+    assert rejected.value.backlog == pytest.approx(6.0)
+    assert rejected.value.retry_after == 1
+    admission.check("interactive", 4.0)
+
+
+def test_queued_work_is_spread_over_instances():
+    admission = controller({})
+    admit(admission, "p1", 8.0)
+    assert admission.backlogs("interactive") == {"http://gpu-a": 4.0, "http://gpu-b": 4.0}
+    with pytest.raises(AdmissionRejected):
+        admission.check("interactive", 7.0)
+
+
+def test_finished_work_is_released():
+    admission = controller({"p1": "http://gpu-a"})
+    admit(admission, "p1", 8.0)
+    admission.handle_event("http://gpu-a", {"type": "execution_interrupted", "data": {"prompt_id": "p1"}})
+    assert admission.backlog("interactive") == 0.0
+
+
+def test_unlimited_budget_never_rejects():
+    admission = controller({})
+    admit(admission, "p1", 100.0, traffic="batch")
+    admission.check("batch", 100.0)
+
+
+def test_dispatched_batch_work_counts_against_interactive():
+    # ComfyUIへ送り出し済みのバッチの仕事は、後から来た対話的な生成より先に実行される
+    admission = controller({"b1": "http://gpu-a", "b2": "http://gpu-b"})
+    admit(admission, "b1", 8.0, traffic="batch")
+    admit(admission, "b2", 8.0, traffic="batch")
+    assert admission.backlogs("interactive") == {"http://gpu-a": 8.0, "http://gpu-b": 8.0}
+    with pytest.raises(AdmissionRejected):
+        admission.check("interactive", 4.0)
+
+
+def test_queued_batch_work_does_not_block_interactive():
+    # 待ち行列にあるバッチの仕事は低い優先度のため、対話的な生成が追い越せる
+    admission = controller({})
+    admit(admission, "b1", 100.0, traffic="batch")
+    assert admission.backlog("interactive") == 0.0
+    admission.check("interactive", 4.0)
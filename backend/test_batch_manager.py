@@ -0,0 +1,53 @@
+"""
+バッチ管理のテスト - 項目の状態が終端になればバッチが完了し、監視が終わることを確認する
+"""
+
+import asyncio
+
+from batch_manager import BatchManager
+
+
+def run_batch(statuses):
+    """各項目のget_statusがstatusesの値を返すバッチを作り、watchのイベントを最後まで集める"""
+    async def main():
+        async def submit(request):
+            return {"prompt_id": request, "instance": "local"}
+
+        async def get_status(prompt_id):
+            return statuses[prompt_id]
+
+        async def fetch_image(prompt_id, output):
+            return b""
+
+        manager = BatchManager(submit=submit, get_status=get_status, fetch_image=fetch_image, poll_interval=0.01)
+        batch = manager.create(list(statuses), [{} for _ in statuses])
+        await asyncio.sleep(0)
+        events = []
+
+        async def collect():
+            async for event, data in manager.watch(batch["batch_id"]):
+                if event is not None:
+                    events.append((event, data))
+
+        await asyncio.wait_for(collect(), 5)
+        return batch, events
+
+    return asyncio.run(main())
+
+
+def test_completed_items_finish_batch():
+    batch, events = run_batch({"a": {"status": "completed", "outputs": []}, "b": {"status": "error", "error": "boom"}})
+    assert batch["status"] == "completed"
+    assert events[-1][0] == "completed"
+    assert events[-1][1]["counts"]["completed"] == 1
+    assert events[-1][1]["counts"]["error"] == 1
+
+
+def test_not_found_item_is_reported_as_error():
+    # 見失ったプロンプトが残ってもバッチは完了し、監視のストリームも終わる
+    batch, events = run_batch({"a": {"status": "completed", "outputs": []}, "b": {"status": "not_found", "outputs": []}})
+    assert batch["status"] == "completed"
+    assert events[-1][0] == "completed"
+    item = batch["items"][1]
+    assert item["status"] == "error"
+    assert item["error"] == "Prompt not found"
@@ -0,0 +1,91 @@
+"""
+インスタンス振り分けのテスト - 常駐モデルは実行開始時に更新し、実行前に取り消されたプロンプトでは変わらないことを確認する
+"""
+
+import asyncio
+
+from bridge_pool import ComfyUIBridgePool
+from workflow_manager import WorkflowManager
+
+GPU_A, GPU_B = "http://gpu-a", "http://gpu-b"
+
+
+def make_pool(depths):
+    """depths: インスタンス → キュー深さ（送信・取り消しはComfyUIに接続せずに済ませる）"""
+    pool = ComfyUIBridgePool([GPU_A, GPU_B])
+    for bridge in pool.bridges:
+        async def get_queue_depth(url=bridge.comfyui_url):
+            return depths[url]
+
+        async def queue_prompt(workflow, prompt_id=None):
+            return {"success": True, "prompt_id": prompt_id, "number": 0}
+
+        async def cancel_prompt(prompt_id):
+            return "removed"
+
+        bridge.get_queue_depth = get_queue_depth
+        bridge.queue_prompt = queue_prompt
+        bridge.cancel_prompt = cancel_prompt
+    return pool
+
+
+def queue(pool, prompt_id, model):
+    workflow = WorkflowManager().create_txt2img_workflow(prompt="a cat", seed=1, model=model)
+    return asyncio.run(pool.queue_prompt(workflow, prompt_id=prompt_id))["instance"]
+
+
+def event(pool, event_type, prompt_id):
+    instance = pool.get_instance(prompt_id)
+    pool._on_event(pool.get_bridge(instance), {"type": event_type, "data": {"prompt_id": prompt_id}})
+
+
+def loaded_checkpoint(pool, instance):
+    loaded = pool.loaded_models[instance]
+    return loaded[0] if loaded else None
+
+
+def test_loaded_model_is_updated_when_execution_starts():
+    pool = make_pool({GPU_A: 0, GPU_B: 5})
+    assert queue(pool, "p1", "a.safetensors") == GPU_A
+    # 待ち行列に積んだだけでは読み込まれていない
+    assert loaded_checkpoint(pool, GPU_A) is None
+    event(pool, "execution_start", "p1")
+    assert loaded_checkpoint(pool, GPU_A) == "a.safetensors"
+    event(pool, "execution_success", "p1")
+    assert loaded_checkpoint(pool, GPU_A) == "a.safetensors"
+
+
+def test_affinity_survives_a_cancelled_prompt():
+    pool = make_pool({GPU_A: 0, GPU_B: 5})
+    queue(pool, "p1", "a.safetensors")
+    event(pool, "execution_start", "p1")
+    event(pool, "execution_success", "p1")
+
+    # 別モデルのプロンプトが実行前に取り消されても、gpu-aの常駐モデルはそのまま
+    assert queue(pool, "p2", "b.safetensors") == GPU_A
+    assert asyncio.run(pool.cancel_prompt("p2"))["status"] == "removed"
+    assert loaded_checkpoint(pool, GPU_A) == "a.safetensors"
+
+    assert queue(pool, "p3", "a.safetensors") == GPU_A
+    assert pool.affinity_stats["hits"] == 1
+
+
+def test_interrupted_after_start_keeps_the_new_model():
+    # 実行を開始したプロンプトはモデルを読み込み済みのため、中断されても常駐モデルを更新する
+    pool = make_pool({GPU_A: 0, GPU_B: 5})
+    queue(pool, "p1", "a.safetensors")
+    queue(pool, "p2", "b.safetensors")
+    event(pool, "execution_start", "p1")
+    event(pool, "execution_success", "p1")
+    event(pool, "execution_start", "p2")
+    event(pool, "execution_interrupted", "p2")
+    assert loaded_checkpoint(pool, GPU_A) == "b.safetensors"
+
+
+def test_start_event_before_queue_response():
+    # 送信の応答より先にexecution_startが届いても常駐モデルを反映する
+    pool = make_pool({GPU_A: 0, GPU_B: 5})
+    pool._on_event(pool.get_bridge(GPU_A), {"type": "execution_start", "data": {"prompt_id": "p1"}})
+    queue(pool, "p1", "a.safetensors")
+    assert loaded_checkpoint(pool, GPU_A) == "a.safetensors"
+    assert not pool._prompt_models
@@ -0,0 +1,190 @@
+"""
+生成履歴のテスト - 保存・ページ送り・全文検索と、履歴の参照でComfyUIに問い合わせないことを確認する
+"""
+
+import asyncio
+import importlib
+import sqlite3
+
+import pytest
+
+import history_store as history_store_module
+from history_store import HistoryStore
+
+SEED = 0xfedcba9876543210
+
+
+def record(prompt, **fields):
+    return {
+        "user": "key:abc",
+        "mode": "txt2img",
+        "model": "v1-5-pruned-emaonly.safetensors",
+        "prompt": prompt,
+        "negative_prompt": "blurry",
+        "seed": SEED,
+        "params": {"prompt": prompt, "steps": 20},
+        **fields
+    }
+
+
+def finish(store, prompt_id, images=("out.png",)):
+    """実行イベントを順に流して完了させる"""
+    store.handle_event("http://gpu-a", {"type": "execution_start", "data": {"prompt_id": prompt_id}})
+    store.handle_event("http://gpu-a", {
+        "type": "executed",
+        "data": {"prompt_id": prompt_id, "node": "save_image", "output": {"images": [
+            {"filename": filename, "subfolder": "", "type": "output"} for filename in images
+        ]}}
+    })
+    store.handle_event("http://gpu-a", {"type": "execution_success", "data": {"prompt_id": prompt_id}})
+
+
+def run(path, body):
+    """開いたストアでbody(store)を実行して閉じる"""
+    async def main():
+        store = HistoryStore(path=str(path), flush_interval=0.01)
+        await store.start()
+        try:
+            return await body(store)
+        finally:
+            await store.close()
+
+    return asyncio.run(main())
+
+
+def test_register_complete_flush_round_trip(tmp_path):
+    path = tmp_path / "history.db"
+
+    async def write(store):
+        store.register("p1", record("a red fox"))
+        assert (await store.get("p1"))["status"] == "pending"
+        finish(store, "p1")
+        # 書き込み前でも完了した記録を返す
+        unflushed = await store.get("p1")
+        assert unflushed["status"] == "completed"
+        await store.flush()
+        assert store.get_stats()["unflushed"] == 0
+
+    async def read(store):
+        return await store.get("p1")
+
+    run(path, write)
+    saved = run(path, read)
+    assert saved["status"] == "completed"
+    assert saved["seed"] == SEED
+    assert saved["params"] == {"prompt": "a red fox", "steps": 20}
+    assert saved["instance"] == "http://gpu-a"
+    assert saved["outputs"] == [{"filename": "out.png", "subfolder": "", "type": "output", "node_id": "save_image"}]
+    assert saved["run_seconds"] is not None
+
+
+def test_cursor_pages_have_no_duplicates_or_gaps(tmp_path):
+    # 完了時刻が同じ記録が続いてもページの境目で重複・欠落しない
+    async def body(store):
+        for index in range(25):
+            prompt_id = f"p{index:02d}"
+            store.register(prompt_id, record(f"prompt {index}"))
+            finish(store, prompt_id)
+            store._unflushed[prompt_id]["completed_at"] = 1000.0 + index // 10
+        expected = [item["prompt_id"] for item in (await store.list(limit=200))["items"]]
+        pages, cursor = [], None
+        while True:
+            page = await store.list(limit=7, cursor=cursor)
+            pages.append([item["prompt_id"] for item in page["items"]])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return expected, pages
+
+    expected, pages = run(tmp_path / "history.db", body)
+    assert expected == sorted(expected, key=lambda prompt_id: (1000 + int(prompt_id[1:]) // 10, prompt_id), reverse=True)
+    assert [prompt_id for page in pages for prompt_id in page] == expected
+    assert [len(page) for page in pages] == [7, 7, 7, 4]
+
+
+def test_invalid_cursor_is_rejected(tmp_path):
+    async def body(store):
+        with pytest.raises(ValueError):
+            await store.list(cursor="not-a-cursor")
+
+    run(tmp_path / "history.db", body)
+
+
+async def search_fixture(store):
+    for prompt_id, prompt in (("fox", "a red fox in snow"), ("cat", "猫が窓辺で眠る"), ("sky", "blue sky")):
+        store.register(prompt_id, record(prompt))
+        finish(store, prompt_id)
+
+    async def search(query):
+        return sorted(item["prompt_id"] for item in (await store.list(query=query))["items"])
+
+    return {
+        "tokenizer": store.tokenizer,
+        "fox": await search("fox"),
+        "red fox": await search("red fox"),
+        "phrase": await search("窓辺で"),
+        "short": await search("猫"),
+        "negative": await search("blurry"),
+        "missing": await search("dog")
+    }
+
+
+def test_trigram_search(tmp_path):
+    results = run(tmp_path / "history.db", search_fixture)
+    if results["tokenizer"] != "trigram":
+        pytest.skip("SQLite without the trigram tokenizer")
+    assert results["fox"] == ["fox"]
+    assert results["red fox"] == ["fox"]
+    # 空白で区切られない日本語も部分一致し、3文字未満の語はLIKEで絞り込む
+    assert results["phrase"] == ["cat"]
+    assert results["short"] == ["cat"]
+    assert results["negative"] == ["cat", "fox", "sky"]
+    assert results["missing"] == []
+
+
+class _NoTrigramConnection(sqlite3.Connection):
+    def execute(self, sql, *args):
+        if "tokenize='trigram'" in sql:
+            raise sqlite3.OperationalError("no such tokenizer: trigram")
+        return super().execute(sql, *args)
+
+
+def test_search_falls_back_to_unicode61(tmp_path, monkeypatch):
+    connect = sqlite3.connect
+    monkeypatch.setattr(
+        history_store_module.sqlite3, "connect",
+        lambda *args, **kwargs: connect(*args, factory=_NoTrigramConnection, **kwargs)
+    )
+    results = run(tmp_path / "history.db", search_fixture)
+    assert results["tokenizer"] == "unicode61"
+    assert results["fox"] == ["fox"]
+    assert results["red fox"] == ["fox"]
+    assert results["negative"] == ["cat", "fox", "sky"]
+    assert results["missing"] == []
+
+
+@pytest.fixture
+def main_module(tmp_path, monkeypatch):
+    for name in ("UPLOAD_DIR", "IMAGE_CACHE_DIR", "WORKFLOW_REGISTRY_DIR"):
+        monkeypatch.setenv(name, str(tmp_path / name.lower()))
+    monkeypatch.setenv("HISTORY_DB_PATH", str(tmp_path / "main-history.db"))
+    return importlib.import_module("main")
+
+
+def test_history_lookup_never_calls_comfyui(tmp_path, monkeypatch, main_module):
+    def unexpected(*args, **kwargs):
+        raise AssertionError("history lookup must not query ComfyUI")
+
+    for name in ("get_history", "get_prompt_status", "get_bridge_for_prompt", "resolve_output_bridge"):
+        monkeypatch.setattr(main_module.comfyui_pool, name, unexpected)
+
+    async def body(store):
+        monkeypatch.setattr(main_module, "history_store", store)
+        store.register("p1", record("a red fox"))
+        finish(store, "p1")
+        await store.flush()
+        return await main_module.get_generation_history("p1"), await main_module.get_generation_history("missing")
+
+    saved, missing = run(tmp_path / "history.db", body)
+    assert saved["status"] == "completed"
+    assert saved["outputs"][0]["filename"] == "out.png"
+    assert missing == {"prompt_id": "missing", "outputs": [], "status": "not_found"}
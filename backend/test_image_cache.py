@@ -0,0 +1,167 @@
+"""
+画像キャッシュのテスト - メモリ・ディスクの容量上限とLRUの追い出し順、出力完了時の先読み、配信統計を確認する
+"""
+
+import asyncio
+import importlib
+import os
+
+import pytest
+from starlette.requests import Request
+
+from image_cache import ImageCache
+
+INSTANCE = "http://gpu-a"
+
+
+def key(name):
+    return (INSTANCE, f"{name}.png", "", "output")
+
+
+def run(body, **options):
+    """イベントループ内で作ったキャッシュでbody(cache)を実行"""
+    async def main():
+        return await body(ImageCache(**options))
+    return asyncio.run(main())
+
+
+def test_memory_budget_evicts_least_recently_used():
+    async def body(cache):
+        for name in "abc":
+            await cache.put(key(name), name.encode() * 10)
+        # 参照したaは新しくなり、次の追加ではbが追い出される
+        assert await cache.get(key("a")) == b"a" * 10
+        await cache.put(key("d"), b"d" * 10)
+        # 予算を超える画像はメモリに置かない
+        await cache.put(key("huge"), b"x" * 31)
+        return list(cache._memory), cache.get_stats()
+
+    order, stats = run(body, memory_budget=30, disk_dir=None)
+    assert order == [key("c"), key("a"), key("d")]
+    assert stats["memory_bytes"] == 30
+    assert stats["disk_entries"] == 0
+
+
+def test_disk_budget_evicts_least_recently_used(tmp_path):
+    async def body(cache):
+        for name in "abc":
+            await cache.put(key(name), name.encode() * 10)
+        assert await cache.get(key("a")) == b"a" * 10
+        await cache.put(key("d"), b"d" * 10)
+        return cache, sorted(os.listdir(tmp_path))
+
+    # メモリに置かずディスクだけで確認する
+    cache, files = run(body, memory_budget=0, disk_dir=str(tmp_path), disk_budget=30)
+    stats = cache.get_stats()
+    assert (stats["disk_entries"], stats["disk_bytes"]) == (3, 30)
+    assert (stats["disk_hits"], stats["memory_entries"]) == (1, 0)
+    assert files == sorted(ImageCache._digest(key(name)) for name in "acd")
+    assert not cache.contains(key("b"))
+
+
+def test_disk_index_is_reloaded_oldest_first(tmp_path):
+    async def fill(cache):
+        for name in "abc":
+            await cache.put(key(name), name.encode() * 10)
+
+    run(fill, memory_budget=0, disk_dir=str(tmp_path), disk_budget=30)
+    for mtime, name in enumerate("bca"):
+        os.utime(tmp_path / ImageCache._digest(key(name)), (mtime, mtime))
+    (tmp_path / "partial.tmp").write_bytes(b"x")
+
+    # 予算を縮めて再起動すると最も古いbから追い出す
+    reloaded = ImageCache(memory_budget=0, disk_dir=str(tmp_path), disk_budget=20)
+    assert not reloaded.contains(key("b"))
+    assert reloaded.contains(key("c")) and reloaded.contains(key("a"))
+    assert sorted(os.listdir(tmp_path)) == sorted(ImageCache._digest(key(name)) for name in "ca")
+
+
+def test_oversized_entries_are_not_cached(tmp_path):
+    async def body(cache):
+        await cache.put(key("big"), b"x" * 11)
+        return cache.contains(key("big"))
+
+    assert run(body, disk_dir=str(tmp_path), max_entry_size=10) is False
+
+
+def test_hit_ratio_counts_memory_disk_and_misses(tmp_path):
+    async def body(cache):
+        await cache.put(key("a"), b"a" * 10)
+        await cache.get(key("a"))
+        cache._memory.clear()
+        cache._memory_bytes = 0
+        await cache.get(key("a"))
+        await cache.get(key("missing"))
+        await cache.get(key("missing"))
+        return cache.get_stats()
+
+    stats = run(body, disk_dir=str(tmp_path))
+    assert (stats["memory_hits"], stats["disk_hits"], stats["misses"]) == (1, 1, 2)
+    assert stats["hit_ratio"] == 0.5
+    assert stats["bytes_served"] == 0
+
+
+class FakeBridge:
+    comfyui_url = INSTANCE
+
+    def __init__(self):
+        self.fetched = []
+
+    async def get_image(self, filename, subfolder, folder_type):
+        self.fetched.append((filename, subfolder, folder_type))
+        await asyncio.sleep(0.01)
+        return filename.encode()
+
+
+@pytest.fixture
+def main_module(tmp_path, monkeypatch):
+    for name in ("UPLOAD_DIR", "IMAGE_CACHE_DIR", "WORKFLOW_REGISTRY_DIR"):
+        monkeypatch.setenv(name, str(tmp_path / name.lower()))
+    monkeypatch.setenv("HISTORY_DB_PATH", str(tmp_path / "history.db"))
+    return importlib.import_module("main")
+
+
+def test_executed_event_prefetches_outputs(tmp_path, monkeypatch, main_module):
+    bridge = FakeBridge()
+    monkeypatch.setattr(main_module.comfyui_pool, "get_bridge", lambda instance: bridge)
+    message = {"type": "executed", "data": {"prompt_id": "p1", "node": "save_image", "output": {"images": [
+        {"filename": "a.png", "subfolder": "", "type": "output"},
+        {"filename": "preview.png", "subfolder": "", "type": "temp"}
+    ]}}}
+
+    async def body(cache):
+        monkeypatch.setattr(main_module, "image_cache", cache)
+        main_module.prefetch_outputs(INSTANCE, message)
+        # 先読み中の同じ画像は重複して取得しない
+        main_module.prefetch_outputs(INSTANCE, message)
+        await asyncio.gather(*cache._prefetching.values())
+        return cache, await cache.get(key("a"))
+
+    cache, data = run(body, disk_dir=str(tmp_path / "cache"))
+    assert bridge.fetched == [("a.png", "", "output")]
+    assert data == b"a.png"
+    assert cache.get_stats()["prefetched"] == 1
+    assert not cache.contains((INSTANCE, "preview.png", "", "temp"))
+
+
+def test_preview_from_cache_counts_bytes_served(tmp_path, monkeypatch, main_module):
+    bridge = FakeBridge()
+    monkeypatch.setattr(main_module.comfyui_pool, "resolve_output_bridge", lambda filename, prompt_id=None: bridge)
+
+    def request(headers=()):
+        return Request({"type": "http", "method": "GET", "path": "/api/preview/a.png", "headers": list(headers)})
+
+    async def body(cache):
+        monkeypatch.setattr(main_module, "image_cache", cache)
+        await cache.put(key("a"), b"0123456789")
+        full = await main_module.get_preview_image(request(), "a.png")
+        partial = await main_module.get_preview_image(request([(b"range", b"bytes=2-5")]), "a.png")
+        return cache.get_stats(), full, partial
+
+    stats, full, partial = run(body, disk_dir=str(tmp_path / "cache"))
+    assert full.body == b"0123456789"
+    assert (partial.status_code, partial.body) == (206, b"2345")
+    # 範囲指定は実際に返したバイト数だけ数える
+    assert stats["bytes_served"] == 14
+    assert (stats["memory_hits"], stats["hit_ratio"]) == (2, 1.0)
+    assert bridge.fetched == []
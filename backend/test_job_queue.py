@@ -0,0 +1,70 @@
+"""
+待ち行列のテスト - ワークフローの処理量の見積もりと送り出し中のプロンプトの順番
+"""
+
+import asyncio
+
+import pytest
+
+from job_queue import JobQueue, estimate_cost
+from workflow_manager import WorkflowManager
+
+COMMON = {"prompt": "a cat", "seed": 1, "steps": 20}
+
+
+def init_image(width, height):
+    return {"filename": "in.png", "width": width, "height": height}
+
+
+def test_txt2img_cost_follows_latent_size():
+    workflow_manager = WorkflowManager()
+    base = estimate_cost(workflow_manager.create_txt2img_workflow(**COMMON))
+    large = estimate_cost(workflow_manager.create_txt2img_workflow(**COMMON, width=1024, height=1024, batch_size=2))
+    assert base == pytest.approx(1.0)
+    assert large == pytest.approx(8.0)
+
+
+@pytest.mark.parametrize("mode", ["img2img", "inpaint"])
+def test_image_modes_cost_follows_input_size(mode):
+    workflow_manager = WorkflowManager()
+    options = dict(COMMON, init_image="in.png", denoising_strength=1.0)
+    if mode == "img2img":
+        workflow = workflow_manager.create_img2img_workflow(**options)
+    else:
+        workflow = workflow_manager.create_inpaint_workflow(**options, mask_image="mask.png")
+    mask = {"filename": "mask.png", "width": 64, "height": 64}
+    # 入力画像の寸法が分からなければ基準サイズ（512x512）として扱う
+    assert estimate_cost(workflow) == pytest.approx(1.0)
+    assert estimate_cost(workflow, [init_image(1024, 1536), mask]) == pytest.approx(6.0)
+
+
+def test_image_mode_cost_scales_with_denoise():
+    workflow = WorkflowManager().create_img2img_workflow(**COMMON, init_image="in.png", denoising_strength=0.5)
+    assert estimate_cost(workflow, [init_image(1024, 1024)]) == pytest.approx(2.0)
+
+
+def test_dispatching_prompt_keeps_position():
+    # 待ち行列から取り出してComfyUIの応答を待つ間も順番を返す（見失ったことにしない）
+    async def main():
+        release = asyncio.Event()
+
+        async def dispatch(workflow, input_images, prompt_id):
+            await release.wait()
+            return {"success": True, "prompt_id": prompt_id, "instance": "local"}
+
+        queue = JobQueue(dispatch, lambda: 1)
+        queue.start()
+        try:
+            result = await queue.submit({})
+            assert queue.position(result["prompt_id"]) == 1
+            await asyncio.sleep(0.01)
+            assert queue.dispatching(result["prompt_id"]) is not None
+            assert queue.position(result["prompt_id"]) == 1
+            release.set()
+            await asyncio.sleep(0.01)
+            assert queue.dispatching(result["prompt_id"]) is None
+            assert queue.position(result["prompt_id"]) is None
+        finally:
+            await queue.close()
+
+    asyncio.run(main())
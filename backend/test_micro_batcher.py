@@ -0,0 +1,81 @@
+"""
+まとめ実行のテスト - まとめる相手の条件と、メンバーごとに返すシード・バッチ内の位置を確認する
+"""
+
+import asyncio
+
+from micro_batcher import MicroBatcher
+from workflow_manager import WorkflowManager
+
+
+def run_members(requests):
+    """requests: (seed, options) の一覧を同時に投入し、(各メンバーの結果, 送信されたワークフロー一覧) を返す"""
+    async def main():
+        submitted = []
+
+        async def submit(workflow, **options):
+            submitted.append((workflow, options))
+            return {"success": True, "prompt_id": f"real-{len(submitted)}", "instance": None}
+
+        batcher = MicroBatcher(submit=submit, window=0.01, max_batch_size=8)
+        workflow_manager = WorkflowManager()
+        results = await asyncio.gather(*(
+            batcher.submit(workflow_manager.create_txt2img_workflow(prompt="a cat", seed=seed), **options)
+            for seed, options in requests
+        ))
+        return results, submitted
+
+    return asyncio.run(main())
+
+
+def test_merged_members_report_the_seed_that_ran():
+    options = {"owner": "alice", "priority": "normal"}
+    results, submitted = run_members([(11, options), (22, options), (33, options)])
+    assert len(submitted) == 1
+    workflow, sent_options = submitted[0]
+    assert workflow["empty_latent"]["inputs"]["batch_size"] == 3
+    assert sent_options == options
+    # 2人目以降のシードは実行されない（最初のメンバーのシードのバッチの何枚目か）
+    assert [result["seed"] for result in results] == [11, 11, 11]
+    assert [result["batch_index"] for result in results] == [0, 1, 2]
+
+
+def test_different_owners_are_not_merged():
+    results, submitted = run_members([
+        (11, {"owner": "alice", "priority": "normal"}),
+        (22, {"owner": "bob", "priority": "normal"}),
+    ])
+    assert sorted(options["owner"] for _, options in submitted) == ["alice", "bob"]
+    assert all("batch_index" not in result for result in results)
+
+
+def test_different_priorities_are_not_merged():
+    results, submitted = run_members([
+        (11, {"owner": "alice", "priority": "high"}),
+        (22, {"owner": "alice", "priority": "low"}),
+        (33, {"owner": "alice", "priority": "low"}),
+    ])
+    assert sorted((options["priority"], workflow["empty_latent"]["inputs"]["batch_size"]) for workflow, options in submitted) == [
+        ("high", 1),
+        ("low", 2),
+    ]
+
+
+def test_different_groups_are_not_merged():
+    async def main():
+        submitted = []
+
+        async def submit(workflow, **options):
+            submitted.append(options)
+            return {"success": True, "prompt_id": f"real-{len(submitted)}", "instance": None}
+
+        batcher = MicroBatcher(submit=submit, window=0.01, max_batch_size=8)
+        workflow_manager = WorkflowManager()
+        await asyncio.gather(*(
+            batcher.submit(workflow_manager.create_txt2img_workflow(prompt="a cat", seed=seed), group=group, owner="alice")
+            for seed, group in ((1, "interactive"), (2, "batch"), (3, "batch"))
+        ))
+        return submitted
+
+    # groupは送信先には渡さない
+    assert asyncio.run(main()) == [{"owner": "alice"}, {"owner": "alice"}]
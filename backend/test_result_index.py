@@ -0,0 +1,160 @@
+"""
+結果の再利用のテスト - ワークフローのハッシュ、実行中プロンプトへの相乗り、完了結果の期限と失敗時の扱いを確認する
+"""
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import result_index as result_index_module
+from job_status import JobStatusTable
+from result_index import ResultIndex, workflow_hash
+from workflow_manager import WorkflowManager
+
+INSTANCE = "http://gpu-a"
+
+
+def complete(jobs, index, prompt_id, event_type="execution_success"):
+    """ComfyUIの終了イベントを状態テーブル→再利用インデックスの順に流す"""
+    messages = [{"type": event_type, "data": {"prompt_id": prompt_id}}]
+    if event_type == "execution_success":
+        messages.insert(0, {"type": "executed", "data": {"prompt_id": prompt_id, "node": "save_image", "output": {
+            "images": [{"filename": f"{prompt_id}.png", "subfolder": "", "type": "output"}]
+        }}})
+    for message in messages:
+        jobs.handle_event(INSTANCE, message)
+        index.handle_event(INSTANCE, message)
+
+
+def submitter(prompt_id, calls, delay=0.0, error=None):
+    """送信の代わり（callsに呼ばれた順で名前を残す）"""
+    async def submit():
+        calls.append(prompt_id)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return {"success": True, "prompt_id": prompt_id, "instance": INSTANCE}
+    return submit
+
+
+def test_hash_is_stable_across_key_order_and_number_format():
+    workflow = WorkflowManager().create_txt2img_workflow(prompt="a cat", seed=1, cfg_scale=7)
+    reordered = {
+        node_id: {"inputs": dict(reversed(list(node["inputs"].items()))), "class_type": node["class_type"]}
+        for node_id, node in reversed(list(workflow.items()))
+    }
+    assert list(reordered) != list(workflow)
+    assert workflow_hash(reordered) == workflow_hash(workflow)
+    # 7と7.0は同じ値として扱う
+    assert workflow_hash({"a": {"inputs": {"cfg": 7.0}}}) == workflow_hash({"a": {"inputs": {"cfg": 7}}})
+    assert workflow_hash({"a": {"inputs": {"cfg": 7.5}}}) != workflow_hash({"a": {"inputs": {"cfg": 7}}})
+
+
+def test_concurrent_duplicate_rides_the_inflight_prompt():
+    async def main():
+        index, calls = ResultIndex(JobStatusTable()), []
+        first, second = await asyncio.gather(
+            index.submit("k", submitter("p1", calls, delay=0.01)),
+            index.submit("k", submitter("p2", calls))
+        )
+        # 送信後に届いたリクエストも実行中のプロンプトに相乗りする
+        third = await index.submit("k", submitter("p3", calls))
+        return index, calls, first, second, third
+
+    index, calls, first, second, third = asyncio.run(main())
+    assert calls == ["p1"]
+    assert (first["prompt_id"], first["reused"]) == ("p1", None)
+    assert (second["prompt_id"], second["reused"]) == ("p1", "inflight")
+    assert (third["prompt_id"], third["reused"]) == ("p1", "inflight")
+    assert index.get_stats()["reused_inflight"] == 2
+
+
+def test_completed_result_is_reused_until_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_index_module.time, "time", lambda: now[0])
+
+    async def main():
+        jobs, calls = JobStatusTable(), []
+        index = ResultIndex(jobs, ttl=60.0)
+        await index.submit("k", submitter("p1", calls))
+        complete(jobs, index, "p1")
+        now[0] += 60.0
+        reused = await index.submit("k", submitter("p2", calls))
+        now[0] += 1.0
+        expired = await index.submit("k", submitter("p3", calls))
+        return calls, reused, expired
+
+    calls, reused, expired = asyncio.run(main())
+    assert reused["reused"] == "completed"
+    assert reused["outputs"][0]["filename"] == "p1.png"
+    assert (expired["prompt_id"], expired["reused"]) == ("p3", None)
+    assert calls == ["p1", "p3"]
+
+
+def test_failed_prompt_is_not_reused():
+    async def main():
+        jobs, calls = JobStatusTable(), []
+        index = ResultIndex(jobs)
+        await index.submit("k", submitter("p1", calls))
+        complete(jobs, index, "p1", "execution_error")
+        return calls, await index.submit("k", submitter("p2", calls))
+
+    calls, result = asyncio.run(main())
+    assert result["reused"] is None
+    assert calls == ["p1", "p2"]
+
+
+def test_forget_drops_inflight_and_completed_entries():
+    async def main():
+        jobs, calls = JobStatusTable(), []
+        index = ResultIndex(jobs)
+        await index.submit("running", submitter("p1", calls))
+        index.forget("p1")
+        after_cancel = await index.submit("running", submitter("p2", calls))
+
+        await index.submit("done", submitter("p3", calls))
+        complete(jobs, index, "p3")
+        index.forget("p3")
+        after_forget = await index.submit("done", submitter("p4", calls))
+        return index, after_cancel, after_forget
+
+    index, after_cancel, after_forget = asyncio.run(main())
+    assert (after_cancel["prompt_id"], after_cancel["reused"]) == ("p2", None)
+    assert (after_forget["prompt_id"], after_forget["reused"]) == ("p4", None)
+    assert index.get_stats()["completed"] == 0
+
+
+@pytest.mark.parametrize("status_code", [429, 500])
+def test_waiter_resubmits_when_the_first_request_fails(status_code):
+    # 最初の送信が拒否・失敗しても、待っていたリクエストは自分の送信で受け付けを判定する
+    async def main():
+        index, calls = ResultIndex(JobStatusTable()), []
+        return calls, await asyncio.gather(
+            index.submit("k", submitter("p1", calls, delay=0.01, error=HTTPException(status_code=status_code))),
+            index.submit("k", submitter("p2", calls, delay=0.01)),
+            index.submit("k", submitter("p3", calls)),
+            return_exceptions=True
+        )
+
+    calls, (first, second, third) = asyncio.run(main())
+    assert isinstance(first, HTTPException) and first.status_code == status_code
+    # 待っていた2件のうち1件だけが送り直し、もう1件はそれに相乗りする
+    assert calls == ["p1", "p2"]
+    assert (second["prompt_id"], second["reused"]) == ("p2", None)
+    assert (third["prompt_id"], third["reused"]) == ("p2", "inflight")
+
+
+def test_waiter_resubmits_when_the_first_request_is_cancelled():
+    async def main():
+        index, calls = ResultIndex(JobStatusTable()), []
+        first = asyncio.ensure_future(index.submit("k", submitter("p1", calls, delay=1.0)))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(index.submit("k", submitter("p2", calls)))
+        await asyncio.sleep(0)
+        first.cancel()
+        return calls, await second
+
+    calls, second = asyncio.run(main())
+    assert calls == ["p1", "p2"]
+    assert (second["prompt_id"], second["reused"]) == ("p2", None)
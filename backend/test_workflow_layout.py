@@ -0,0 +1,83 @@
+"""
+ワークフローのノードID配置のテスト - モードやLoRA・VAEの有無を切り替えても、
+変わらない部分グラフのノードIDと入力が一致することを確認する
+"""
+
+import itertools
+
+import pytest
+
+from workflow_manager import WorkflowManager
+
+COMMON = {"prompt": "a cat", "negative_prompt": "blurry", "seed": 1, "steps": 20}
+LORAS = [{"name": "detail.safetensors", "strength": 0.7}]
+VAE = "vae-ft-mse.safetensors"
+
+
+def build(mode, lora, vae):
+    workflow_manager = WorkflowManager()
+    options = dict(COMMON)
+    if lora:
+        options["loras"] = LORAS
+    if vae:
+        options["vae"] = VAE
+    if mode == "txt2img":
+        return workflow_manager.create_txt2img_workflow(**options)
+    if mode == "img2img":
+        return workflow_manager.create_img2img_workflow(**options, init_image="in.png")
+    return workflow_manager.create_inpaint_workflow(**options, init_image="in.png", mask_image="mask.png")
+
+
+VARIANTS = {
+    f"{mode}{'+lora' if lora else ''}{'+vae' if vae else ''}": (mode, lora, vae)
+    for mode in ("txt2img", "img2img", "inpaint")
+    for lora in (False, True)
+    for vae in (False, True)
+}
+
+
+def subgraph_signatures(workflow):
+    """各ノードの上流を含めた部分グラフの署名（リンクを上流ノードの署名に置き換えたもの）"""
+    signatures = {}
+
+    def signature(node_id):
+        if node_id not in signatures:
+            node = workflow[node_id]
+            inputs = tuple(sorted(
+                (name, ("link", signature(value[0]), value[1]) if isinstance(value, list) else value)
+                for name, value in node["inputs"].items()
+            ))
+            signatures[node_id] = (node["class_type"], inputs)
+        return signatures[node_id]
+
+    for node_id in workflow:
+        signature(node_id)
+    return signatures
+
+
+@pytest.mark.parametrize("first,second", list(itertools.combinations(VARIANTS, 2)))
+def test_unchanged_subgraphs_keep_node_ids(first, second):
+    first_ids = {sig: node_id for node_id, sig in subgraph_signatures(build(*VARIANTS[first])).items()}
+    second_ids = {sig: node_id for node_id, sig in subgraph_signatures(build(*VARIANTS[second])).items()}
+    moved = [
+        (first_ids[sig], second_ids[sig])
+        for sig in set(first_ids) & set(second_ids)
+        if first_ids[sig] != second_ids[sig]
+    ]
+    assert moved == []
+
+
+@pytest.mark.parametrize("name", list(VARIANTS))
+def test_checkpoint_node_is_shared(name):
+    # チェックポイントの読み込みはどの組み合わせでも同じIDと入力になる
+    workflow = build(*VARIANTS[name])
+    assert workflow["checkpoint"] == build("txt2img", False, False)["checkpoint"]
+
+
+@pytest.mark.parametrize("mode", ["txt2img", "img2img", "inpaint"])
+def test_prompts_unchanged_by_vae(mode):
+    # VAEの指定はプロンプトのエンコードに影響しない
+    without_vae = build(mode, False, False)
+    with_vae = build(mode, False, True)
+    for node_id in ("positive", "negative"):
+        assert with_vae[node_id] == without_vae[node_id]
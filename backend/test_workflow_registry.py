@@ -0,0 +1,138 @@
+"""
+登録ワークフローのテスト - 登録時の検証、テンプレートへのコンパイル、JSONでの保存と読み込みを確認する
+"""
+
+import asyncio
+import copy
+import json
+
+import pytest
+
+from workflow_manager import WorkflowTemplate
+from workflow_registry import WorkflowDefinition, WorkflowDefinitionError, WorkflowRegistry
+
+WORKFLOW = {
+    "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "v1-5-pruned-emaonly.safetensors"}},
+    "6": {"class_type": "CLIPTextEncode", "inputs": {"text": "a cat", "clip": ["4", 1]}},
+    "7": {"class_type": "CLIPTextEncode", "inputs": {"text": "blurry", "clip": ["4", 1]}},
+    "5": {"class_type": "EmptyLatentImage", "inputs": {"width": 512, "height": 512, "batch_size": 1}},
+    "3": {"class_type": "KSampler", "inputs": {
+        "model": ["4", 0],
+        "positive": ["6", 0],
+        "negative": ["7", 0],
+        "latent_image": ["5", 0],
+        "seed": 1,
+        "steps": 20,
+        "cfg": 7,
+        "sampler_name": "euler",
+        "scheduler": "normal",
+        "denoise": 1.0
+    }},
+    "8": {"class_type": "VAEDecode", "inputs": {"samples": ["3", 0], "vae": ["4", 2]}},
+    "9": {"class_type": "SaveImage", "inputs": {"filename_prefix": "custom", "images": ["8", 0]}}
+}
+
+PARAMETERS = {
+    "prompt": "6.text",
+    "negative_prompt": ["7.text"],
+    "width": "5.width",
+    "height": "5.height",
+    "seed": "3.seed",
+    "cfg_scale": "3.cfg",
+    "model": "4.ckpt_name"
+}
+
+
+def define(workflow=None, parameters=None, name="portrait"):
+    return WorkflowDefinition(name, copy.deepcopy(workflow or WORKFLOW), dict(PARAMETERS if parameters is None else parameters))
+
+
+def test_compiles_into_a_template():
+    definition = define()
+    assert isinstance(definition.template, WorkflowTemplate)
+    assert definition.defaults["prompt"] == "a cat"
+    assert definition.defaults["cfg_scale"] == 7
+    assert definition.field_names[("5", "width")] == "width"
+
+    workflow = definition.instantiate({"prompt": "a dog", "width": 768})
+    assert workflow["6"]["inputs"] == {"text": "a dog", "clip": ["4", 1]}
+    assert workflow["5"]["inputs"] == {"width": 768, "height": 512, "batch_size": 1}
+    # 未指定のパラメータは登録時の値、リンクや固定値はそのまま
+    assert workflow["3"]["inputs"] == WORKFLOW["3"]["inputs"]
+    # 差し込んだ値は次の生成へ持ち越さない
+    assert definition.instantiate({})["6"]["inputs"]["text"] == "a cat"
+
+
+@pytest.mark.parametrize("parameters,message", [
+    ({"prompt": "6"}, "node.input"),
+    ({"prompt": ".text"}, "node.input"),
+    ({"prompt": [6]}, "node.input"),
+    ({"prompt": []}, "no targets"),
+    ({"lora": "6.text"}, "Unknown parameter"),
+    ({"prompt": "99.text"}, "node 99 does not exist"),
+    ({"prompt": "6.missing"}, "has no input missing"),
+    ({"prompt": "6.clip"}, "is a link"),
+])
+def test_bad_parameter_bindings_are_rejected(parameters, message):
+    with pytest.raises(WorkflowDefinitionError, match=message):
+        define(parameters=parameters)
+
+
+@pytest.mark.parametrize("parameters", [
+    {"prompt": "3.steps"},
+    {"width": "6.text"},
+    {"seed": "3.denoise"},
+    {"cfg_scale": "3.sampler_name"},
+])
+def test_type_mismatches_are_rejected(parameters):
+    with pytest.raises(WorkflowDefinitionError, match="expected"):
+        define(parameters=parameters)
+
+
+def test_float_parameters_accept_integer_defaults():
+    assert define(parameters={"cfg_scale": "3.cfg", "denoising_strength": "3.denoise"}).defaults == {
+        "cfg_scale": 7,
+        "denoising_strength": 1.0
+    }
+
+
+@pytest.mark.parametrize("workflow,message", [
+    ({}, "non-empty"),
+    ({"1": {"inputs": {}}}, "class_type is required"),
+    ({"1": {"class_type": "SaveImage", "inputs": {"images": ["99", 0]}}}, "invalid link"),
+    ({"1": {"class_type": "SaveImage", "inputs": {"images": ["1", "0"]}}}, "invalid link"),
+    ({"1": {"class_type": "KSampler", "inputs": {"cfg": float("nan")}}}, "non-finite"),
+])
+def test_malformed_workflows_are_rejected(workflow, message):
+    with pytest.raises(WorkflowDefinitionError, match=message):
+        WorkflowDefinition("portrait", workflow, {})
+
+
+@pytest.mark.parametrize("name", ["txt2img", "bad name", "", "x" * 65])
+def test_reserved_and_invalid_names_are_rejected(name):
+    with pytest.raises(WorkflowDefinitionError):
+        define(name=name)
+
+
+def test_json_store_round_trip(tmp_path):
+    directory = tmp_path / "workflows"
+    registry = WorkflowRegistry(directory=str(directory))
+    registered = asyncio.run(registry.register("portrait", copy.deepcopy(WORKFLOW), PARAMETERS, "Portrait"))
+    assert [path.name for path in directory.iterdir()] == ["portrait.json"]
+    saved = json.loads((directory / "portrait.json").read_text(encoding="utf-8"))
+    assert saved["workflow"] == WORKFLOW
+    assert saved["parameters"]["prompt"] == ["6.text"]
+
+    # 壊れたファイルは読み飛ばす
+    (directory / "broken.json").write_text("{", encoding="utf-8")
+    reloaded = WorkflowRegistry(directory=str(directory))
+    assert [item["name"] for item in reloaded.list()] == ["portrait"]
+    definition = reloaded.get("portrait")
+    assert definition.to_dict() == registered.to_dict()
+    assert definition.description == "Portrait"
+    assert definition.instantiate({"prompt": "a dog"}) == registered.instantiate({"prompt": "a dog"})
+
+    assert asyncio.run(reloaded.delete("portrait"))
+    assert not asyncio.run(reloaded.delete("portrait"))
+    assert not (directory / "portrait.json").exists()
+    assert WorkflowRegistry(directory=str(directory)).get("portrait") is None
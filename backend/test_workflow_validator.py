@@ -0,0 +1,155 @@
+"""
+ワークフロー検証のテスト - ノード定義から組み立てた検証と、検証器の再構築の条件を確認する
+"""
+
+import asyncio
+import importlib
+
+import pytest
+from fastapi import HTTPException
+
+from workflow_manager import WorkflowManager
+from workflow_validator import ValidatorCache, WorkflowValidator, WorkflowValidationError
+
+OBJECT_INFO = {
+    "CheckpointLoaderSimple": {"input": {"required": {"ckpt_name": [["v1-5-pruned-emaonly.safetensors"]]}}},
+    "VAELoader": {"input": {"required": {"vae_name": [["vae-ft-mse.safetensors"]]}}},
+    "LoraLoader": {"input": {"required": {
+        "model": ["MODEL"],
+        "clip": ["CLIP"],
+        "lora_name": [["detail.safetensors"]],
+        "strength_model": ["FLOAT", {"default": 1.0, "min": -100.0, "max": 100.0, "step": 0.01}],
+        "strength_clip": ["FLOAT", {"default": 1.0, "min": -100.0, "max": 100.0, "step": 0.01}]
+    }}},
+    "CLIPTextEncode": {"input": {"required": {"text": ["STRING", {"multiline": True}], "clip": ["CLIP"]}}},
+    "EmptyLatentImage": {"input": {"required": {
+        "width": ["INT", {"default": 512, "min": 16, "max": 8192, "step": 8}],
+        "height": ["INT", {"default": 512, "min": 16, "max": 8192, "step": 8}],
+        "batch_size": ["INT", {"default": 1, "min": 1, "max": 4096}]
+    }}},
+    "KSampler": {"input": {"required": {
+        "model": ["MODEL"],
+        "seed": ["INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff}],
+        "steps": ["INT", {"default": 20, "min": 1, "max": 10000}],
+        "cfg": ["FLOAT", {"default": 8.0, "min": 0.0, "max": 100.0, "step": 0.1}],
+        "sampler_name": [["euler", "dpmpp_2m"]],
+        "scheduler": [["normal", "karras"]],
+        "positive": ["CONDITIONING"],
+        "negative": ["CONDITIONING"],
+        "latent_image": ["LATENT"],
+        "denoise": ["FLOAT", {"default": 1.0, "min": 0.0, "max": 1.0, "step": 0.01}]
+    }}},
+    "VAEDecode": {"input": {"required": {"samples": ["LATENT"], "vae": ["VAE"]}}},
+    "SaveImage": {"input": {"required": {"images": ["IMAGE"], "filename_prefix": ["STRING", {"default": "ComfyUI"}]}}}
+}
+
+
+def workflow(**options):
+    return WorkflowManager().create_txt2img_workflow(prompt="a cat", seed=1, **options)
+
+
+def errors_for(validator, **options):
+    return [(error["field"], error["code"]) for error in validator.validate(workflow(**options))]
+
+
+def test_valid_workflow_passes():
+    validator = WorkflowValidator(OBJECT_INFO)
+    assert validator.validate(workflow(loras=[{"name": "detail.safetensors", "strength": 0.7}], vae="vae-ft-mse.safetensors")) == []
+
+
+def test_enum_miss_reports_options():
+    errors = WorkflowValidator(OBJECT_INFO).validate(workflow(sampler_name="no_such_sampler"))
+    assert [(error["field"], error["code"]) for error in errors] == [("sampler_name", "not_in_options")]
+    assert errors[0]["options"] == ["euler", "dpmpp_2m"]
+    assert errors[0]["node"] == "sampler"
+
+
+def test_int_out_of_range():
+    errors = WorkflowValidator(OBJECT_INFO).validate(workflow(steps=0))
+    assert [(error["field"], error["code"]) for error in errors] == [("steps", "out_of_range")]
+    assert (errors[0]["min"], errors[0]["max"]) == (1, 10000)
+
+
+def test_step_mismatch():
+    assert errors_for(WorkflowValidator(OBJECT_INFO), width=516) == [("width", "invalid_step")]
+    assert errors_for(WorkflowValidator(OBJECT_INFO), width=520) == []
+
+
+def test_float_step_is_not_enforced():
+    # 浮動小数点のstepはUI上の刻みのため確認しない
+    assert errors_for(WorkflowValidator(OBJECT_INFO), cfg_scale=7.25) == []
+
+
+@pytest.mark.parametrize("options,expected", [
+    ({"model": "missing.safetensors"}, [("model", "not_in_options")]),
+    ({"loras": [{"name": "missing.safetensors", "strength": 0.7}]}, [("loras[0].name", "not_in_options")]),
+    ({"vae": "missing.safetensors"}, [("vae", "not_in_options")]),
+])
+def test_unknown_models_are_reported_by_field(options, expected):
+    assert errors_for(WorkflowValidator(OBJECT_INFO), **options) == expected
+
+
+def test_unknown_node_is_rejected_when_schema_is_known():
+    validator = WorkflowValidator(OBJECT_INFO)
+    broken = {**workflow(), "extra": {"class_type": "NoSuchNode", "inputs": {}}}
+    with pytest.raises(WorkflowValidationError) as error:
+        validator.check(broken)
+    assert [item["code"] for item in error.value.errors] == ["unknown_node"]
+
+
+def test_fallback_uses_samplers_config_lists():
+    # ノード定義が取れない場合もsamplers_configの一覧でサンプラー・スケジューラーを確認する
+    validator = WorkflowValidator(None)
+    assert errors_for(validator) == []
+    assert errors_for(validator, sampler_name="no_such_sampler", scheduler="no_such_scheduler") == [
+        ("sampler_name", "not_in_options"),
+        ("scheduler", "not_in_options"),
+    ]
+
+
+def test_validator_cache_rebuilds_only_for_a_new_catalog():
+    cache = ValidatorCache()
+    catalog = {"object_info": OBJECT_INFO}
+    first = cache.get(catalog)
+    assert cache.get(catalog) is first
+    assert cache.builds == 1
+    # カタログを取得できない間は前回の検証器を使う
+    assert cache.get(None) is first
+    # 再取得したカタログは内容が同じでも組み立て直す（同一性で判定）
+    refreshed = cache.get({"object_info": dict(OBJECT_INFO)})
+    assert refreshed is not first
+    assert cache.builds == 2
+
+
+@pytest.fixture
+def main_module(tmp_path, monkeypatch):
+    for name in ("UPLOAD_DIR", "IMAGE_CACHE_DIR", "WORKFLOW_REGISTRY_DIR"):
+        monkeypatch.setenv(name, str(tmp_path / name.lower()))
+    monkeypatch.setenv("HISTORY_DB_PATH", str(tmp_path / "history.db"))
+    return importlib.import_module("main")
+
+
+def test_invalid_request_is_a_structured_422(monkeypatch, main_module):
+    validator = WorkflowValidator(OBJECT_INFO)
+
+    async def get_validator():
+        return validator
+
+    async def unexpected(*args, **kwargs):
+        raise AssertionError("invalid workflows must not be queued")
+
+    monkeypatch.setattr(main_module, "get_workflow_validator", get_validator)
+    monkeypatch.setattr(main_module.job_queue, "submit", unexpected)
+    request = main_module.GenerateRequest(
+        prompt="a cat",
+        seed=1,
+        model="missing.safetensors",
+        loras=[{"name": "missing.safetensors", "strength": 0.7}]
+    )
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main_module.submit_generation(request))
+    assert error.value.status_code == 422
+    assert [(item["field"], item["code"]) for item in error.value.detail["errors"]] == [
+        ("model", "not_in_options"),
+        ("loras[0].name", "not_in_options"),
+    ]
@@ -0,0 +1,37 @@
+"""
+WebSocketハブのテスト - プロンプトの終了イベントを配信した後に購読が外れることを確認する
+"""
+
+import json
+
+import pytest
+
+from ws_hub import WebSocketHub
+
+
+def subscribed_hub():
+    hub = WebSocketHub()
+    client = hub.connect(websocket=None, client_id="client")
+    hub.subscribe("client", "prompt")
+    return hub, client
+
+
+@pytest.mark.parametrize("message", [
+    {"type": "executing", "data": {"node": None, "prompt_id": "prompt"}},
+    {"type": "execution_error", "data": {"prompt_id": "prompt", "exception_message": "boom"}},
+    {"type": "execution_interrupted", "data": {"prompt_id": "prompt"}},
+])
+def test_finished_prompt_is_unsubscribed(message):
+    hub, client = subscribed_hub()
+    hub.publish("local", message)
+    # 終了イベント自体は届けてから購読を外す
+    assert [json.loads(text)["type"] for _, text in client._queue] == [message["type"]]
+    assert hub.get_client_prompts("client") == set()
+    assert hub.get_stats()["subscribed_prompts"] == 0
+
+
+def test_progress_keeps_subscription():
+    hub, client = subscribed_hub()
+    hub.publish("local", {"type": "progress", "data": {"prompt_id": "prompt", "value": 1, "max": 20}})
+    hub.publish("local", {"type": "executing", "data": {"node": "sampler", "prompt_id": "prompt"}})
+    assert hub.get_client_prompts("client") == {"prompt"}
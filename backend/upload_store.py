@@ -0,0 +1,143 @@
+"""
+Upload Store - img2img/inpaint用の入力画像をコンテンツハッシュで管理
+"""
+
+import asyncio
+import base64
+import hashlib
+import io
+import os
+import tempfile
+from typing import Dict, Any, Optional, BinaryIO
+
+from PIL import Image
+
+CHUNK_SIZE = 1024 * 1024
+
+# PILのフォーマット名 → 拡張子
+IMAGE_EXTENSIONS = {
+    "PNG": ".png",
+    "JPEG": ".jpg",
+    "WEBP": ".webp",
+    "BMP": ".bmp",
+    "GIF": ".gif"
+}
+
+class UploadTooLargeError(Exception):
+    pass
+
+class InvalidImageError(Exception):
+    pass
+
+class UploadStore:
+    def __init__(self, upload_dir: str = "uploads", max_size: int = 50 * 1024 * 1024):
+        self.upload_dir = upload_dir
+        self.max_size = max_size
+        # 参照ID → 画像情報
+        self._records: Dict[str, Dict[str, Any]] = {}
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        """保存済みの画像を読み込む（寸法は必要になるまで読まない）"""
+        for name in os.listdir(self.upload_dir):
+            image_id, ext = os.path.splitext(name)
+            if ext in IMAGE_EXTENSIONS.values():
+                self._records[image_id] = {
+                    "id": image_id,
+                    "filename": name,
+                    "path": os.path.join(self.upload_dir, name),
+                    "size": os.path.getsize(os.path.join(self.upload_dir, name)),
+                    "width": None,
+                    "height": None
+                }
+
+    async def save_file(self, source: BinaryIO) -> Dict[str, Any]:
+        """ファイルをハッシュしながら保存（同じ内容は一度だけ保存）"""
+        return await asyncio.to_thread(self._store, source)
+
+    async def save_bytes(self, data: bytes) -> Dict[str, Any]:
+        """バイト列を保存"""
+        if len(data) > self.max_size:
+            raise UploadTooLargeError(f"Image exceeds {self.max_size} bytes")
+        return await asyncio.to_thread(self._store_bytes, data)
+
+    def _store_bytes(self, data: bytes) -> Dict[str, Any]:
+        return self._store(io.BytesIO(data))
+
+    def _store(self, source: BinaryIO) -> Dict[str, Any]:
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.upload_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                while True:
+                    chunk = source.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise UploadTooLargeError(f"Image exceeds {self.max_size} bytes")
+                    digest.update(chunk)
+                    tmp.write(chunk)
+
+            image_id = digest.hexdigest()[:24]
+            record = self._records.get(image_id)
+            if record is not None and os.path.exists(record["path"]):
+                # 既に同じ内容がある
+                self._fill_dimensions(record)
+                return record
+
+            try:
+                with Image.open(tmp_path) as image:
+                    image_format, width, height = image.format, image.width, image.height
+            except Exception as e:
+                raise InvalidImageError(f"Not a valid image: {e}")
+            if image_format not in IMAGE_EXTENSIONS:
+                raise InvalidImageError(f"Unsupported image format: {image_format}")
+
+            filename = f"{image_id}{IMAGE_EXTENSIONS[image_format]}"
+            path = os.path.join(self.upload_dir, filename)
+            os.replace(tmp_path, path)
+            record = {
+                "id": image_id,
+                "filename": filename,
+                "path": path,
+                "size": size,
+                "width": width,
+                "height": height
+            }
+            self._records[image_id] = record
+            return record
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _fill_dimensions(self, record: Dict[str, Any]):
+        """寸法が未取得なら画像ヘッダーから読む"""
+        if record["width"] is None:
+            with Image.open(record["path"]) as image:
+                record["width"], record["height"] = image.width, image.height
+
+    def get(self, image_id: str) -> Optional[Dict[str, Any]]:
+        """参照IDから画像情報を取得"""
+        record = self._records.get(image_id)
+        if record is not None:
+            self._fill_dimensions(record)
+        return record
+
+    async def resolve(self, value: Optional[str]) -> Optional[Dict[str, Any]]:
+        """参照IDまたはdata URL（旧形式）を画像情報に変換"""
+        if not value:
+            return None
+        if value.startswith("data:"):
+            _, _, encoded = value.partition(",")
+            try:
+                data = base64.b64decode(encoded)
+            except Exception as e:
+                raise InvalidImageError(f"Invalid data URL: {e}")
+            return await self.save_bytes(data)
+        record = self.get(os.path.splitext(value)[0])
+        if record is None:
+            raise InvalidImageError(f"Unknown image reference: {value}")
+        return record
@@ -2,24 +2,250 @@
 Workflow Manager - ComfyUIワークフローの作成と管理
 """
 
-import json
+import math
 import random
-from typing import Dict, Any, List, Optional
-import uuid
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, Any, List, Optional, Tuple
+
+# モードごとの保存ファイル名の接頭辞
+FILENAME_PREFIXES = {
+    "txt2img": "ComfyUI_A1111",
+    "img2img": "ComfyUI_A1111_img2img",
+    "inpaint": "ComfyUI_A1111_inpaint"
+}
+
+# この画素数以上ではタイル分割のVAEエンコード・デコードを使う（1536x1536）
+DEFAULT_TILED_VAE_MIN_PIXELS = 1536 * 1536
+
+# 動画モデル用の時間方向の分割（画像では使われないがノードの必須入力）
+VAE_TEMPORAL_TILING = {"temporal_size": 64, "temporal_overlap": 8}
+
+def tile_size_for(width: Optional[int], height: Optional[int]) -> int:
+    """解像度からタイルサイズを決める（長辺を1024px以下の均等なタイルに分ける）"""
+    if not width or not height:
+        return 512
+    long_side = max(width, height)
+    tiles = math.ceil(long_side / 1024)
+    return min(1024, max(512, math.ceil(long_side / tiles / 64) * 64))
+
+def tile_overlap_for(tile_size: int) -> int:
+    """タイル同士の重なり（タイルの1/8を32px単位で切り捨て）"""
+    return max(32, tile_size // 8 // 32 * 32)
+
+class WorkflowTemplate:
+    """コンパイル済みのグラフ（不変の骨格）。リクエストごとにノード単位の浅い複製へパラメータを差し込む"""
+
+    __slots__ = ("nodes",)
+
+    def __init__(self, nodes: Dict[str, Dict[str, Any]], slots: List[Tuple[str, str, str]]):
+        params: Dict[str, List[Tuple[str, str]]] = {}
+        for param, node_id, input_name in slots:
+            params.setdefault(node_id, []).append((input_name, param))
+        # ノードごとに (ID, class_type, 固定値, リンク, パラメータの差し込み先) を保持
+        self.nodes = tuple(
+            (
+                node_id,
+                node["class_type"],
+                MappingProxyType({
+                    name: value for name, value in node["inputs"].items()
+                    if not isinstance(value, list)
+                }),
+                tuple(
+                    (name, value[0], value[1]) for name, value in node["inputs"].items()
+                    if isinstance(value, list)
+                ),
+                tuple(params.get(node_id, ()))
+            )
+            for node_id, node in nodes.items()
+        )
+
+    def instantiate(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        """パラメータを差し込んだワークフローを作成（毎回新しい辞書を返し、骨格は変更しない）"""
+        workflow = {}
+        for node_id, class_type, static, links, params in self.nodes:
+            inputs = dict(static)
+            for name, source, index in links:
+                inputs[name] = [source, index]
+            for name, param in params:
+                inputs[name] = values[param]
+            workflow[node_id] = {"class_type": class_type, "inputs": inputs}
+        return workflow
+
+class _GraphBuilder:
+    """テンプレートのコンパイル時にだけ使うノードの組み立て役"""
 
-class WorkflowManager:
     def __init__(self):
-        self.node_counter = 0
-        
-    def _next_node_id(self) -> str:
-        """次のノードIDを生成"""
-        self.node_counter += 1
-        return str(self.node_counter)
-    
-    def _reset_counter(self):
-        """ノードカウンターをリセット"""
-        self.node_counter = 0
-    
+        self.nodes: Dict[str, Dict[str, Any]] = {}
+        self.slots: List[Tuple[str, str, str]] = []
+
+    def add(self, node_id: str, class_type: str, inputs: Dict[str, Any], params: Optional[Dict[str, str]] = None) -> str:
+        """役割名をIDとしてノードを追加（paramsは 入力名 → パラメータ名）"""
+        self.nodes[node_id] = {"class_type": class_type, "inputs": inputs}
+        for input_name, param in (params or {}).items():
+            self.slots.append((param, node_id, input_name))
+        return node_id
+
+@lru_cache(maxsize=128)
+def compile_template(
+    mode: str,
+    lora_count: int,
+    has_vae: bool,
+    repeat_latent: bool = False,
+    tiled_vae: bool = False
+) -> WorkflowTemplate:
+    """モード・LoRA数・VAE指定・Latent複製・タイルVAEの組み合わせごとにグラフを一度だけ組み立てる
+
+    ノードIDは挿入順ではなく役割で固定する。モードの切り替えやLoRA・VAEの有無で
+    他のノードのIDがずれないため、ComfyUIの実行キャッシュ（ID＋入力で一致判定）が効く
+    """
+    if mode not in FILENAME_PREFIXES:
+        raise ValueError(f"Unknown mode: {mode}")
+    graph = _GraphBuilder()
+
+    # チェックポイントローダー
+    checkpoint_loader_id = graph.add("checkpoint", "CheckpointLoaderSimple", {}, {"ckpt_name": "model"})
+    model_output = [checkpoint_loader_id, 0]
+    clip_output = [checkpoint_loader_id, 1]
+    vae_output = [checkpoint_loader_id, 2]
+
+    # VAEローダー（指定された場合）
+    if has_vae:
+        vae_loader_id = graph.add("vae_loader", "VAELoader", {}, {"vae_name": "vae"})
+        vae_output = [vae_loader_id, 0]
+
+    if mode == "img2img":
+        # 画像ローダーとVAEエンコード（画像をLatentに変換）
+        load_image_id = graph.add("load_image", "LoadImage", {"upload": "image"}, {"image": "init_image"})
+        if tiled_vae:
+            latent_id = graph.add(
+                "vae_encode",
+                "VAEEncodeTiled",
+                {"pixels": [load_image_id, 0], "vae": vae_output, **VAE_TEMPORAL_TILING},
+                {"tile_size": "vae_tile_size", "overlap": "vae_tile_overlap"}
+            )
+        else:
+            latent_id = graph.add("vae_encode", "VAEEncode", {"pixels": [load_image_id, 0], "vae": vae_output})
+    elif mode == "inpaint":
+        # 画像・マスクローダーとVAEエンコード（マスク付き、タイル版のノードはない）
+        load_image_id = graph.add("load_image", "LoadImage", {"upload": "image"}, {"image": "init_image"})
+        load_mask_id = graph.add(
+            "load_mask",
+            "LoadImageMask",
+            {"channel": "red", "upload": "image"},
+            {"image": "mask_image"}
+        )
+        latent_id = graph.add("vae_encode_inpaint", "VAEEncodeForInpaint", {
+            "pixels": [load_image_id, 0],
+            "vae": vae_output,
+            "mask": [load_mask_id, 0],
+            "grow_mask_by": 6
+        })
+    if repeat_latent and mode != "txt2img":
+        # エンコードは1回だけ行い、Latentを複製してバッチにする（マスクも複製される）
+        latent_id = graph.add("repeat_latent", "RepeatLatentBatch", {"samples": [latent_id, 0]}, {"amount": "batch_size"})
+
+    # LoRAの適用
+    for index in range(lora_count):
+        lora_loader_id = graph.add(
+            f"lora_{index}",
+            "LoraLoader",
+            {"model": model_output, "clip": clip_output},
+            {
+                "lora_name": f"lora_{index}_name",
+                "strength_model": f"lora_{index}_strength",
+                "strength_clip": f"lora_{index}_strength"
+            }
+        )
+        model_output = [lora_loader_id, 0]
+        clip_output = [lora_loader_id, 1]
+
+    # ポジティブ・ネガティブプロンプト
+    positive_prompt_id = graph.add("positive", "CLIPTextEncode", {"clip": clip_output}, {"text": "prompt"})
+    negative_prompt_id = graph.add("negative", "CLIPTextEncode", {"clip": clip_output}, {"text": "negative_prompt"})
+
+    # 空のLatent画像（txt2imgのみ）
+    if mode == "txt2img":
+        latent_id = graph.add("empty_latent", "EmptyLatentImage", {}, {
+            "width": "width",
+            "height": "height",
+            "batch_size": "batch_size"
+        })
+
+    # KSampler
+    ksampler_id = graph.add(
+        "sampler",
+        "KSampler",
+        {
+            "model": model_output,
+            "positive": [positive_prompt_id, 0],
+            "negative": [negative_prompt_id, 0],
+            "latent_image": [latent_id, 0]
+        },
+        {
+            "seed": "seed",
+            "steps": "steps",
+            "cfg": "cfg_scale",
+            "sampler_name": "sampler_name",
+            "scheduler": "scheduler",
+            "denoise": "denoise"
+        }
+    )
+
+    # VAEデコードと画像保存（大きな解像度ではタイル分割してVRAMの急増を避ける）
+    if tiled_vae:
+        vae_decode_id = graph.add(
+            "vae_decode",
+            "VAEDecodeTiled",
+            {"samples": [ksampler_id, 0], "vae": vae_output, **VAE_TEMPORAL_TILING},
+            {"tile_size": "vae_tile_size", "overlap": "vae_tile_overlap"}
+        )
+    else:
+        vae_decode_id = graph.add("vae_decode", "VAEDecode", {"samples": [ksampler_id, 0], "vae": vae_output})
+    graph.add("save_image", "SaveImage", {
+        "images": [vae_decode_id, 0],
+        "filename_prefix": FILENAME_PREFIXES[mode]
+    })
+
+    return WorkflowTemplate(graph.nodes, graph.slots)
+
+class WorkflowManager:
+    """ワークフローの作成（設定以外の状態を持たないため複数スレッドから同時に呼び出せる）"""
+
+    def __init__(self, tiled_vae_min_pixels: int = DEFAULT_TILED_VAE_MIN_PIXELS):
+        self.tiled_vae_min_pixels = tiled_vae_min_pixels
+
+    def build(self, mode: str, values: Dict[str, Any], loras: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """コンパイル済みテンプレートにパラメータを差し込んでワークフローを作成"""
+        return self._build(mode, dict(values), loras)
+
+    def _build(self, mode: str, values: Dict[str, Any], loras: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+        """valuesは呼び出し側で作った辞書（シードやLoRAを書き込む）"""
+        # シードの設定（-1の場合はランダム）
+        if values.get("seed", -1) == -1:
+            values["seed"] = random.randint(0, 0xffffffffffffffff)
+        if loras:
+            for index, lora in enumerate(loras):
+                values[f"lora_{index}_name"] = lora["name"]
+                values[f"lora_{index}_strength"] = lora.get("strength", 1.0)
+        # タイルVAE（未指定なら1枚あたりの画素数で自動判定）
+        width, height = values.get("width"), values.get("height")
+        tiled_vae = values.get("tiled_vae")
+        if tiled_vae is None:
+            tiled_vae = bool(width and height and width * height >= self.tiled_vae_min_pixels)
+        if tiled_vae:
+            tile_size = values.get("vae_tile_size") or tile_size_for(width, height)
+            values["vae_tile_size"] = tile_size
+            values["vae_tile_overlap"] = tile_overlap_for(tile_size)
+        template = compile_template(
+            mode,
+            len(loras) if loras else 0,
+            bool(values.get("vae")),
+            mode != "txt2img" and values.get("batch_size", 1) > 1,
+            tiled_vae
+        )
+        return template.instantiate(values)
+
     def create_txt2img_workflow(
         self,
         prompt: str,
@@ -34,133 +260,36 @@ class WorkflowManager:
         batch_size: int = 1,
         model: str = "v1-5-pruned-emaonly.safetensors",
         vae: Optional[str] = None,
-        loras: Optional[List[Dict[str, Any]]] = None
+        loras: Optional[List[Dict[str, Any]]] = None,
+        tiled_vae: Optional[bool] = None,
+        vae_tile_size: Optional[int] = None
     ) -> Dict[str, Any]:
         """Text2Image用のワークフローを作成"""
-        self._reset_counter()
-        workflow = {}
-        
-        # シードの設定（-1の場合はランダム）
-        if seed == -1:
-            seed = random.randint(0, 0xffffffffffffffff)
-        
-        # チェックポイントローダー
-        checkpoint_loader_id = self._next_node_id()
-        workflow[checkpoint_loader_id] = {
-            "class_type": "CheckpointLoaderSimple",
-            "inputs": {
-                "ckpt_name": model
-            }
-        }
-        
-        model_output = [checkpoint_loader_id, 0]
-        clip_output = [checkpoint_loader_id, 1]
-        vae_output = [checkpoint_loader_id, 2]
-        
-        # VAEローダー（指定された場合）
-        if vae:
-            vae_loader_id = self._next_node_id()
-            workflow[vae_loader_id] = {
-                "class_type": "VAELoader",
-                "inputs": {
-                    "vae_name": vae
-                }
-            }
-            vae_output = [vae_loader_id, 0]
-        
-        # LoRAの適用
-        if loras:
-            for lora in loras:
-                lora_loader_id = self._next_node_id()
-                workflow[lora_loader_id] = {
-                    "class_type": "LoraLoader",
-                    "inputs": {
-                        "lora_name": lora["name"],
-                        "strength_model": lora.get("strength", 1.0),
-                        "strength_clip": lora.get("strength", 1.0),
-                        "model": model_output,
-                        "clip": clip_output
-                    }
-                }
-                model_output = [lora_loader_id, 0]
-                clip_output = [lora_loader_id, 1]
-        
-        # ポジティブプロンプト
-        positive_prompt_id = self._next_node_id()
-        workflow[positive_prompt_id] = {
-            "class_type": "CLIPTextEncode",
-            "inputs": {
-                "text": prompt,
-                "clip": clip_output
-            }
-        }
-        
-        # ネガティブプロンプト
-        negative_prompt_id = self._next_node_id()
-        workflow[negative_prompt_id] = {
-            "class_type": "CLIPTextEncode",
-            "inputs": {
-                "text": negative_prompt,
-                "clip": clip_output
-            }
-        }
-        
-        # 空のLatent画像
-        empty_latent_id = self._next_node_id()
-        workflow[empty_latent_id] = {
-            "class_type": "EmptyLatentImage",
-            "inputs": {
-                "width": width,
-                "height": height,
-                "batch_size": batch_size
-            }
-        }
-        
-        # KSampler
-        ksampler_id = self._next_node_id()
-        workflow[ksampler_id] = {
-            "class_type": "KSampler",
-            "inputs": {
-                "seed": seed,
-                "steps": steps,
-                "cfg": cfg_scale,
-                "sampler_name": sampler_name,
-                "scheduler": scheduler,
-                "denoise": 1.0,
-                "model": model_output,
-                "positive": [positive_prompt_id, 0],
-                "negative": [negative_prompt_id, 0],
-                "latent_image": [empty_latent_id, 0]
-            }
-        }
-        
-        # VAEデコード
-        vae_decode_id = self._next_node_id()
-        workflow[vae_decode_id] = {
-            "class_type": "VAEDecode",
-            "inputs": {
-                "samples": [ksampler_id, 0],
-                "vae": vae_output
-            }
-        }
-        
-        # 画像保存
-        save_image_id = self._next_node_id()
-        workflow[save_image_id] = {
-            "class_type": "SaveImage",
-            "inputs": {
-                "images": [vae_decode_id, 0],
-                "filename_prefix": "ComfyUI_A1111"
-            }
-        }
-        
-        return workflow
-    
+        return self._build("txt2img", {
+            "prompt": prompt,
+            "negative_prompt": negative_prompt,
+            "width": width,
+            "height": height,
+            "steps": steps,
+            "cfg_scale": cfg_scale,
+            "sampler_name": sampler_name,
+            "scheduler": scheduler,
+            "seed": seed,
+            "batch_size": batch_size,
+            "model": model,
+            "vae": vae,
+            "denoise": 1.0,
+            "tiled_vae": tiled_vae,
+            "vae_tile_size": vae_tile_size
+        }, loras)
+
     def create_img2img_workflow(
         self,
         prompt: str,
         negative_prompt: str = "",
         init_image: str = "",
+        width: Optional[int] = None,
+        height: Optional[int] = None,
         denoising_strength: float = 0.75,
         steps: int = 20,
         cfg_scale: float = 7.0,
@@ -170,132 +299,38 @@ class WorkflowManager:
         batch_size: int = 1,
         model: str = "v1-5-pruned-emaonly.safetensors",
         vae: Optional[str] = None,
-        loras: Optional[List[Dict[str, Any]]] = None
+        loras: Optional[List[Dict[str, Any]]] = None,
+        tiled_vae: Optional[bool] = None,
+        vae_tile_size: Optional[int] = None
     ) -> Dict[str, Any]:
-        """Img2Img用のワークフローを作成"""
-        self._reset_counter()
-        workflow = {}
-        
-        # シードの設定
-        if seed == -1:
-            seed = random.randint(0, 0xffffffffffffffff)
-        
-        # チェックポイントローダー
-        checkpoint_loader_id = self._next_node_id()
-        workflow[checkpoint_loader_id] = {
-            "class_type": "CheckpointLoaderSimple",
-            "inputs": {
-                "ckpt_name": model
-            }
-        }
-        
-        model_output = [checkpoint_loader_id, 0]
-        clip_output = [checkpoint_loader_id, 1]
-        vae_output = [checkpoint_loader_id, 2]
-        
-        # 画像ローダー
-        load_image_id = self._next_node_id()
-        workflow[load_image_id] = {
-            "class_type": "LoadImage",
-            "inputs": {
-                "image": init_image,
-                "upload": "image"
-            }
-        }
-        
-        # VAEエンコード（画像をLatentに変換）
-        vae_encode_id = self._next_node_id()
-        workflow[vae_encode_id] = {
-            "class_type": "VAEEncode",
-            "inputs": {
-                "pixels": [load_image_id, 0],
-                "vae": vae_output
-            }
-        }
-        
-        # LoRAの適用
-        if loras:
-            for lora in loras:
-                lora_loader_id = self._next_node_id()
-                workflow[lora_loader_id] = {
-                    "class_type": "LoraLoader",
-                    "inputs": {
-                        "lora_name": lora["name"],
-                        "strength_model": lora.get("strength", 1.0),
-                        "strength_clip": lora.get("strength", 1.0),
-                        "model": model_output,
-                        "clip": clip_output
-                    }
-                }
-                model_output = [lora_loader_id, 0]
-                clip_output = [lora_loader_id, 1]
-        
-        # ポジティブプロンプト
-        positive_prompt_id = self._next_node_id()
-        workflow[positive_prompt_id] = {
-            "class_type": "CLIPTextEncode",
-            "inputs": {
-                "text": prompt,
-                "clip": clip_output
-            }
-        }
-        
-        # ネガティブプロンプト
-        negative_prompt_id = self._next_node_id()
-        workflow[negative_prompt_id] = {
-            "class_type": "CLIPTextEncode",
-            "inputs": {
-                "text": negative_prompt,
-                "clip": clip_output
-            }
-        }
-        
-        # KSampler
-        ksampler_id = self._next_node_id()
-        workflow[ksampler_id] = {
-            "class_type": "KSampler",
-            "inputs": {
-                "seed": seed,
-                "steps": steps,
-                "cfg": cfg_scale,
-                "sampler_name": sampler_name,
-                "scheduler": scheduler,
-                "denoise": denoising_strength,
-                "model": model_output,
-                "positive": [positive_prompt_id, 0],
-                "negative": [negative_prompt_id, 0],
-                "latent_image": [vae_encode_id, 0]
-            }
-        }
-        
-        # VAEデコード
-        vae_decode_id = self._next_node_id()
-        workflow[vae_decode_id] = {
-            "class_type": "VAEDecode",
-            "inputs": {
-                "samples": [ksampler_id, 0],
-                "vae": vae_output
-            }
-        }
-        
-        # 画像保存
-        save_image_id = self._next_node_id()
-        workflow[save_image_id] = {
-            "class_type": "SaveImage",
-            "inputs": {
-                "images": [vae_decode_id, 0],
-                "filename_prefix": "ComfyUI_A1111_img2img"
-            }
-        }
-        
-        return workflow
-    
+        """Img2Img用のワークフローを作成（width/heightは入力画像のサイズ、タイルVAEの判定に使う）"""
+        return self._build("img2img", {
+            "prompt": prompt,
+            "negative_prompt": negative_prompt,
+            "init_image": init_image,
+            "steps": steps,
+            "cfg_scale": cfg_scale,
+            "sampler_name": sampler_name,
+            "scheduler": scheduler,
+            "seed": seed,
+            "batch_size": batch_size,
+            "model": model,
+            "vae": vae,
+            "denoise": denoising_strength,
+            "width": width,
+            "height": height,
+            "tiled_vae": tiled_vae,
+            "vae_tile_size": vae_tile_size
+        }, loras)
+
     def create_inpaint_workflow(
         self,
         prompt: str,
         negative_prompt: str = "",
         init_image: str = "",
         mask_image: str = "",
+        width: Optional[int] = None,
+        height: Optional[int] = None,
         denoising_strength: float = 1.0,
         steps: int = 20,
         cfg_scale: float = 7.0,
@@ -305,135 +340,27 @@ class WorkflowManager:
         batch_size: int = 1,
         model: str = "v1-5-pruned-emaonly.safetensors",
         vae: Optional[str] = None,
-        loras: Optional[List[Dict[str, Any]]] = None
+        loras: Optional[List[Dict[str, Any]]] = None,
+        tiled_vae: Optional[bool] = None,
+        vae_tile_size: Optional[int] = None
     ) -> Dict[str, Any]:
-        """Inpainting用のワークフローを作成"""
-        self._reset_counter()
-        workflow = {}
-        
-        # シードの設定
-        if seed == -1:
-            seed = random.randint(0, 0xffffffffffffffff)
-        
-        # チェックポイントローダー
-        checkpoint_loader_id = self._next_node_id()
-        workflow[checkpoint_loader_id] = {
-            "class_type": "CheckpointLoaderSimple",
-            "inputs": {
-                "ckpt_name": model
-            }
-        }
-        
-        model_output = [checkpoint_loader_id, 0]
-        clip_output = [checkpoint_loader_id, 1]
-        vae_output = [checkpoint_loader_id, 2]
-        
-        # 画像ローダー
-        load_image_id = self._next_node_id()
-        workflow[load_image_id] = {
-            "class_type": "LoadImage",
-            "inputs": {
-                "image": init_image,
-                "upload": "image"
-            }
-        }
-        
-        # マスクローダー
-        load_mask_id = self._next_node_id()
-        workflow[load_mask_id] = {
-            "class_type": "LoadImageMask",
-            "inputs": {
-                "image": mask_image,
-                "channel": "red",
-                "upload": "image"
-            }
-        }
-        
-        # VAEエンコード（マスク付き）
-        vae_encode_inpaint_id = self._next_node_id()
-        workflow[vae_encode_inpaint_id] = {
-            "class_type": "VAEEncodeForInpaint",
-            "inputs": {
-                "pixels": [load_image_id, 0],
-                "vae": vae_output,
-                "mask": [load_mask_id, 0],
-                "grow_mask_by": 6
-            }
-        }
-        
-        # LoRAの適用
-        if loras:
-            for lora in loras:
-                lora_loader_id = self._next_node_id()
-                workflow[lora_loader_id] = {
-                    "class_type": "LoraLoader",
-                    "inputs": {
-                        "lora_name": lora["name"],
-                        "strength_model": lora.get("strength", 1.0),
-                        "strength_clip": lora.get("strength", 1.0),
-                        "model": model_output,
-                        "clip": clip_output
-                    }
-                }
-                model_output = [lora_loader_id, 0]
-                clip_output = [lora_loader_id, 1]
-        
-        # ポジティブプロンプト
-        positive_prompt_id = self._next_node_id()
-        workflow[positive_prompt_id] = {
-            "class_type": "CLIPTextEncode",
-            "inputs": {
-                "text": prompt,
-                "clip": clip_output
-            }
-        }
-        
-        # ネガティブプロンプト
-        negative_prompt_id = self._next_node_id()
-        workflow[negative_prompt_id] = {
-            "class_type": "CLIPTextEncode",
-            "inputs": {
-                "text": negative_prompt,
-                "clip": clip_output
-            }
-        }
-        
-        # KSampler
-        ksampler_id = self._next_node_id()
-        workflow[ksampler_id] = {
-            "class_type": "KSampler",
-            "inputs": {
-                "seed": seed,
-                "steps": steps,
-                "cfg": cfg_scale,
-                "sampler_name": sampler_name,
-                "scheduler": scheduler,
-                "denoise": denoising_strength,
-                "model": model_output,
-                "positive": [positive_prompt_id, 0],
-                "negative": [negative_prompt_id, 0],
-                "latent_image": [vae_encode_inpaint_id, 0]
-            }
-        }
-        
-        # VAEデコード
-        vae_decode_id = self._next_node_id()
-        workflow[vae_decode_id] = {
-            "class_type": "VAEDecode",
-            "inputs": {
-                "samples": [ksampler_id, 0],
-                "vae": vae_output
-            }
-        }
-        
-        # 画像保存
-        save_image_id = self._next_node_id()
-        workflow[save_image_id] = {
-            "class_type": "SaveImage",
-            "inputs": {
-                "images": [vae_decode_id, 0],
-                "filename_prefix": "ComfyUI_A1111_inpaint"
-            }
-        }
-        
-        return workflow
\ No newline at end of file
+        """Inpainting用のワークフローを作成（width/heightは入力画像のサイズ、タイルVAEの判定に使う）"""
+        return self._build("inpaint", {
+            "prompt": prompt,
+            "negative_prompt": negative_prompt,
+            "init_image": init_image,
+            "mask_image": mask_image,
+            "steps": steps,
+            "cfg_scale": cfg_scale,
+            "sampler_name": sampler_name,
+            "scheduler": scheduler,
+            "seed": seed,
+            "batch_size": batch_size,
+            "model": model,
+            "vae": vae,
+            "denoise": denoising_strength,
+            "width": width,
+            "height": height,
+            "tiled_vae": tiled_vae,
+            "vae_tile_size": vae_tile_size
+        }, loras)
@@ -0,0 +1,237 @@
+"""
+Workflow Registry - ユーザーが登録したAPI形式のワークフローとパラメータの割り当て
+"""
+
+import asyncio
+import json
+import math
+import os
+import re
+import tempfile
+from typing import Dict, Any, List, Optional, Tuple
+
+from workflow_manager import FILENAME_PREFIXES, WorkflowTemplate
+
+# ワークフロー名（/api/generateのmodeとして使う）
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# 割り当てできるパラメータ（GenerateRequestのフィールド名）と、割り当て先の入力に求める型
+BINDABLE_PARAMETERS: Dict[str, Tuple[type, ...]] = {
+    "prompt": (str,),
+    "negative_prompt": (str,),
+    "width": (int,),
+    "height": (int,),
+    "steps": (int,),
+    "cfg_scale": (int, float),
+    "sampler_name": (str,),
+    "scheduler": (str,),
+    "seed": (int,),
+    "batch_size": (int,),
+    "model": (str,),
+    "vae": (str,),
+    "denoising_strength": (int, float),
+    "init_image": (str,),
+    "mask_image": (str,)
+}
+
+class WorkflowDefinitionError(Exception):
+    pass
+
+def _parse_target(target: Any) -> Tuple[str, str]:
+    """"ノードID.入力名" を分解（ノードIDに"."を含む場合も入力名は最後の要素）"""
+    if not isinstance(target, str):
+        raise WorkflowDefinitionError(f"Parameter target must be \"node.input\": {target!r}")
+    node_id, _, input_name = target.rpartition(".")
+    if not node_id or not input_name:
+        raise WorkflowDefinitionError(f"Parameter target must be \"node.input\": {target!r}")
+    return node_id, input_name
+
+def _is_link(value: Any) -> bool:
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int)
+
+def _check_literal(value: Any, path: str):
+    """テンプレートに埋め込める値（JSONの値、非有限の浮動小数点を除く）か確認"""
+    if isinstance(value, float) and not math.isfinite(value):
+        raise WorkflowDefinitionError(f"{path}: non-finite number")
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if not isinstance(key, str):
+                raise WorkflowDefinitionError(f"{path}: keys must be strings")
+            _check_literal(item, f"{path}.{key}")
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            _check_literal(item, f"{path}[{index}]")
+    elif value is not None and not isinstance(value, (str, int, float, bool)):
+        raise WorkflowDefinitionError(f"{path}: unsupported value {value!r}")
+
+class WorkflowDefinition:
+    """登録済みワークフロー（登録時に一度だけコンパイルし、生成時は割り当て値を差し込むだけ）"""
+
+    def __init__(
+        self,
+        name: str,
+        workflow: Dict[str, Any],
+        parameters: Dict[str, Any],
+        description: str = ""
+    ):
+        if not NAME_PATTERN.match(name or ""):
+            raise WorkflowDefinitionError("Name must be 1-64 characters of letters, digits, '_' or '-'")
+        if name in FILENAME_PREFIXES:
+            raise WorkflowDefinitionError(f"{name} is a built-in mode")
+        if not isinstance(workflow, dict) or not workflow:
+            raise WorkflowDefinitionError("Workflow must be a non-empty API-format object")
+
+        nodes: Dict[str, Dict[str, Any]] = {}
+        for node_id, node in workflow.items():
+            if not isinstance(node, dict) or not isinstance(node.get("class_type"), str):
+                raise WorkflowDefinitionError(f"Node {node_id}: class_type is required (export with \"Save (API Format)\")")
+            inputs = node.get("inputs") or {}
+            if not isinstance(inputs, dict):
+                raise WorkflowDefinitionError(f"Node {node_id}: inputs must be an object")
+            for input_name, value in inputs.items():
+                if isinstance(value, list):
+                    # API形式ではリストはノード間のリンクのみ
+                    if not _is_link(value) or value[0] not in workflow:
+                        raise WorkflowDefinitionError(f"Node {node_id}: invalid link in {input_name}")
+                else:
+                    _check_literal(value, f"{node_id}.{input_name}")
+            nodes[node_id] = {"class_type": node["class_type"], "inputs": dict(inputs)}
+
+        # パラメータ名 → [(ノードID, 入力名)]、既定値はワークフロー内の値
+        self.parameters: Dict[str, List[Tuple[str, str]]] = {}
+        self.defaults: Dict[str, Any] = {}
+        slots = []
+        for param, targets in (parameters or {}).items():
+            if param not in BINDABLE_PARAMETERS:
+                raise WorkflowDefinitionError(f"Unknown parameter: {param}")
+            targets = [targets] if isinstance(targets, str) else targets
+            if not isinstance(targets, list) or not targets:
+                raise WorkflowDefinitionError(f"Parameter {param} has no targets")
+            for target in targets:
+                node_id, input_name = _parse_target(target)
+                inputs = nodes.get(node_id, {}).get("inputs")
+                if inputs is None:
+                    raise WorkflowDefinitionError(f"Parameter {param}: node {node_id} does not exist")
+                if input_name not in inputs:
+                    raise WorkflowDefinitionError(f"Parameter {param}: node {node_id} has no input {input_name}")
+                if isinstance(inputs[input_name], list):
+                    raise WorkflowDefinitionError(f"Parameter {param}: {node_id}.{input_name} is a link")
+                value = inputs[input_name]
+                if isinstance(value, bool) or not isinstance(value, BINDABLE_PARAMETERS[param]):
+                    raise WorkflowDefinitionError(
+                        f"Parameter {param}: {node_id}.{input_name} holds {type(value).__name__}, "
+                        f"expected {' or '.join(kind.__name__ for kind in BINDABLE_PARAMETERS[param])}"
+                    )
+                self.defaults.setdefault(param, inputs.pop(input_name))
+                self.parameters.setdefault(param, []).append((node_id, input_name))
+                slots.append((param, node_id, input_name))
+
+        self.name = name
+        self.description = description or ""
+        self.workflow = workflow
+        self.template = WorkflowTemplate(nodes, slots)
+        # (ノードID, 入力名) → パラメータ名（検証エラーの対応付け用）
+        self.field_names = {
+            target: param for param, targets in self.parameters.items() for target in targets
+        }
+
+    def instantiate(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        """指定された値（未指定は既定値）を差し込んだワークフローを作成"""
+        return self.template.instantiate({**self.defaults, **values})
+
+    def summary(self) -> Dict[str, Any]:
+        """一覧表示用の情報"""
+        return {
+            "name": self.name,
+            "description": self.description,
+            "parameters": {
+                param: {
+                    "targets": [f"{node_id}.{input_name}" for node_id, input_name in targets],
+                    "default": self.defaults[param]
+                }
+                for param, targets in self.parameters.items()
+            },
+            "nodes": len(self.workflow)
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """保存・取得用の形式（登録時と同じ形）"""
+        return {
+            "name": self.name,
+            "description": self.description,
+            "workflow": self.workflow,
+            "parameters": {
+                param: [f"{node_id}.{input_name}" for node_id, input_name in targets]
+                for param, targets in self.parameters.items()
+            }
+        }
+
+class WorkflowRegistry:
+    def __init__(self, directory: str = "workflows"):
+        self.directory = directory
+        self._definitions: Dict[str, WorkflowDefinition] = {}
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """保存済みのワークフローを読み込んでコンパイル"""
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, filename)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+                definition = WorkflowDefinition(
+                    data["name"], data["workflow"], data.get("parameters"), data.get("description", "")
+                )
+            except (OSError, ValueError, KeyError, TypeError, WorkflowDefinitionError) as e:
+                print(f"[WARNING] Skipping registered workflow {filename}: {e}")
+                continue
+            self._definitions[definition.name] = definition
+        if self._definitions:
+            print(f"[INFO] Loaded {len(self._definitions)} registered workflow(s)")
+
+    def get(self, name: str) -> Optional[WorkflowDefinition]:
+        return self._definitions.get(name)
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [definition.summary() for definition in self._definitions.values()]
+
+    async def register(
+        self,
+        name: str,
+        workflow: Dict[str, Any],
+        parameters: Dict[str, Any],
+        description: str = ""
+    ) -> WorkflowDefinition:
+        """ワークフローを検証・コンパイルして保存（同名は置き換え）"""
+        definition = WorkflowDefinition(name, workflow, parameters, description)
+        await asyncio.to_thread(self._write, definition)
+        self._definitions[name] = definition
+        return definition
+
+    async def delete(self, name: str) -> bool:
+        if self._definitions.pop(name, None) is None:
+            return False
+        await asyncio.to_thread(self._remove, name)
+        return True
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.json")
+
+    def _write(self, definition: WorkflowDefinition):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(definition.to_dict(), f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self._path(definition.name))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _remove(self, name: str):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
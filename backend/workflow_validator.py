@@ -0,0 +1,208 @@
+"""
+Workflow Validator - ComfyUIのノード定義（/object_info）に基づく送信前のワークフロー検証
+"""
+
+import re
+from typing import Dict, Any, List, Optional, Tuple, Callable
+
+from samplers_config import get_sampler_list, get_scheduler_list
+
+# 検証関数: 値を受け取り、問題があれば (コード, メッセージ, 追加情報) を返す
+Check = Callable[[Any], Optional[Tuple[str, str, Dict[str, Any]]]]
+
+# エラーに含める選択肢の最大数
+MAX_REPORTED_OPTIONS = 50
+
+# (ノードID, 入力名) → リクエストのフィールド名（ノードIDはWorkflowManagerの役割名）
+FIELD_NAMES = {
+    ("checkpoint", "ckpt_name"): "model",
+    ("vae_loader", "vae_name"): "vae",
+    ("positive", "text"): "prompt",
+    ("negative", "text"): "negative_prompt",
+    ("empty_latent", "width"): "width",
+    ("empty_latent", "height"): "height",
+    ("empty_latent", "batch_size"): "batch_size",
+    ("repeat_latent", "amount"): "batch_size",
+    ("load_image", "image"): "init_image",
+    ("load_mask", "image"): "mask_image",
+    ("sampler", "seed"): "seed",
+    ("sampler", "steps"): "steps",
+    ("sampler", "cfg"): "cfg_scale",
+    ("sampler", "sampler_name"): "sampler_name",
+    ("sampler", "scheduler"): "scheduler",
+    ("sampler", "denoise"): "denoising_strength",
+    ("vae_encode", "tile_size"): "vae_tile_size",
+    ("vae_decode", "tile_size"): "vae_tile_size"
+}
+
+LORA_NODE = re.compile(r"^lora_(\d+)$")
+LORA_FIELDS = {"lora_name": "name", "strength_model": "strength", "strength_clip": "strength"}
+
+class WorkflowValidationError(Exception):
+    def __init__(self, errors: List[Dict[str, Any]]):
+        super().__init__(f"Workflow validation failed: {len(errors)} error(s)")
+        self.errors = errors
+
+def field_name(node_id: str, input_name: str) -> Optional[str]:
+    """入力に対応するリクエストのフィールド名"""
+    field = FIELD_NAMES.get((node_id, input_name))
+    if field is not None:
+        return field
+    match = LORA_NODE.match(node_id)
+    if match and input_name in LORA_FIELDS:
+        return f"loras[{match.group(1)}].{LORA_FIELDS[input_name]}"
+    return None
+
+def _is_link(value: Any) -> bool:
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int)
+
+def _enum_check(options: List[Any]) -> Check:
+    allowed = frozenset(options)
+    reported = list(options[:MAX_REPORTED_OPTIONS])
+
+    def check(value):
+        if value not in allowed:
+            return "not_in_options", f"{value!r} is not an available option", {"options": reported}
+        return None
+    return check
+
+def _number_check(kind: str, spec: Dict[str, Any]) -> Check:
+    number_types = (int,) if kind == "INT" else (int, float)
+    minimum, maximum = spec.get("min"), spec.get("max")
+    # 整数のstepのみ厳密に確認する（浮動小数点のstepはUI上の刻みで、ComfyUI側でも丸めない）
+    step = spec.get("step") if kind == "INT" and (spec.get("step") or 1) > 1 else None
+    base = minimum if minimum is not None else 0
+
+    def check(value):
+        if isinstance(value, bool) or not isinstance(value, number_types):
+            return "invalid_type", f"Expected {kind}", {}
+        if minimum is not None and value < minimum:
+            return "out_of_range", f"Must be at least {minimum}", {"min": minimum, "max": maximum}
+        if maximum is not None and value > maximum:
+            return "out_of_range", f"Must be at most {maximum}", {"min": minimum, "max": maximum}
+        if step is not None and (value - base) % step:
+            return "invalid_step", f"Must be a multiple of {step}", {"step": step}
+        return None
+    return check
+
+def _type_check(kind: str, python_type: type) -> Check:
+    def check(value):
+        if not isinstance(value, python_type):
+            return "invalid_type", f"Expected {kind}", {}
+        return None
+    return check
+
+def _compile_input(spec: Any) -> Optional[Check]:
+    """入力定義1件を検証関数に変換（リンク型や未知の型はNone）"""
+    if not isinstance(spec, (list, tuple)) or not spec:
+        return None
+    kind = spec[0]
+    options = spec[1] if len(spec) > 1 and isinstance(spec[1], dict) else {}
+    if isinstance(kind, list) or kind == "COMBO":
+        # アップロード先の入力画像一覧はカタログ取得後に増えるため選択肢を確認しない
+        if options.get("image_upload") or options.get("upload"):
+            return _type_check("STRING", str)
+        return _enum_check(kind if isinstance(kind, list) else options.get("options", []))
+    if kind in ("INT", "FLOAT"):
+        return _number_check(kind, options)
+    if kind == "STRING":
+        return _type_check(kind, str)
+    if kind == "BOOLEAN":
+        return _type_check(kind, bool)
+    return None
+
+class WorkflowValidator:
+    """ノード定義から一度だけ組み立て、リクエストごとに再利用する検証器"""
+
+    def __init__(self, object_info: Optional[Dict[str, Any]] = None):
+        object_info = dict(object_info or {})
+        # サンプラー・スケジューラーはComfyUIの定義（実際に使える一覧）で確認し、
+        # 定義が取れない場合のみsamplers_configの一覧で確認する
+        if "KSampler" not in object_info:
+            object_info["KSampler"] = {"input": {"required": {
+                "sampler_name": [get_sampler_list()],
+                "scheduler": [get_scheduler_list()]
+            }}}
+        # ノード定義がない場合は未知のノードを許容する
+        self.strict = len(object_info) > 1
+        # class_type → [(入力名, 必須か, 検証関数)]
+        self._nodes: Dict[str, List[Tuple[str, bool, Optional[Check]]]] = {}
+        for class_type, info in object_info.items():
+            inputs = (info or {}).get("input") or {}
+            compiled = []
+            for required, group in ((True, inputs.get("required") or {}), (False, inputs.get("optional") or {})):
+                for input_name, spec in group.items():
+                    compiled.append((input_name, required, _compile_input(spec)))
+            self._nodes[class_type] = compiled
+
+    def validate(self, workflow: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """ワークフローの問題点を返す（問題がなければ空リスト）"""
+        errors = []
+        for node_id, node in workflow.items():
+            class_type = node.get("class_type")
+            checks = self._nodes.get(class_type)
+            if checks is None:
+                if self.strict:
+                    errors.append(self._error(node_id, class_type, None, None, "unknown_node", f"Node type {class_type} is not available", {}))
+                continue
+            inputs = node.get("inputs") or {}
+            for input_name, required, check in checks:
+                if input_name not in inputs:
+                    if required and self.strict:
+                        errors.append(self._error(node_id, class_type, input_name, None, "missing_input", "Required input is missing", {}))
+                    continue
+                value = inputs[input_name]
+                if _is_link(value):
+                    if value[0] not in workflow:
+                        errors.append(self._error(node_id, class_type, input_name, value, "invalid_link", f"Linked node {value[0]} does not exist", {}))
+                    continue
+                if check is not None:
+                    problem = check(value)
+                    if problem is not None:
+                        errors.append(self._error(node_id, class_type, input_name, value, *problem))
+        return errors
+
+    def check(self, workflow: Dict[str, Any]):
+        """問題があればWorkflowValidationErrorを送出"""
+        errors = self.validate(workflow)
+        if errors:
+            raise WorkflowValidationError(errors)
+
+    @staticmethod
+    def _error(
+        node_id: str,
+        class_type: Optional[str],
+        input_name: Optional[str],
+        value: Any,
+        code: str,
+        message: str,
+        extra: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        return {
+            "node": node_id,
+            "class_type": class_type,
+            "input": input_name,
+            "field": field_name(node_id, input_name) if input_name else None,
+            "value": value,
+            "code": code,
+            "message": message,
+            **extra
+        }
+
+class ValidatorCache:
+    """カタログが更新されたときだけ検証器を組み立て直す"""
+
+    def __init__(self):
+        self._catalog: Optional[Dict[str, Any]] = None
+        self._validator = WorkflowValidator()
+        self.builds = 0
+
+    def get(self, catalog: Optional[Dict[str, Any]]) -> WorkflowValidator:
+        """カタログに対応する検証器を取得"""
+        if catalog is None:
+            return self._validator
+        if catalog is not self._catalog:
+            self._validator = WorkflowValidator(catalog.get("object_info"))
+            self._catalog = catalog
+            self.builds += 1
+        return self._validator
@@ -0,0 +1,166 @@
+"""
+WebSocket Hub - ComfyUIのイベントをブラウザのWebSocketへ配信
+"""
+
+import asyncio
+import json
+import uuid
+from collections import deque
+from typing import Dict, Any, Optional, Set, Tuple
+
+# 同じプロンプトの最新値だけ届けば十分なイベント
+COALESCIBLE_EVENTS = {"progress", "executing", "status"}
+
+class HubClient:
+    def __init__(self, websocket, client_id: str, max_queue: int):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.max_queue = max_queue
+        # 送信待ちメッセージ: [合体キー, JSON文字列]
+        self._queue: deque = deque()
+        self._coalescible: Dict[Tuple[str, Optional[str]], list] = {}
+        self._wakeup = asyncio.Event()
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def enqueue(self, event_type: str, prompt_id: Optional[str], text: str, coalesce: bool = False):
+        """送信キューに追加（進捗系は合体し、溢れたら古い進捗から捨てる）"""
+        key = (event_type, prompt_id) if coalesce else None
+        if key is not None:
+            item = self._coalescible.get(key)
+            if item is not None:
+                item[1] = text
+                self.coalesced += 1
+                return
+        if len(self._queue) >= self.max_queue:
+            self._drop_one()
+        item = [key, text]
+        self._queue.append(item)
+        if key is not None:
+            self._coalescible[key] = item
+        self._wakeup.set()
+
+    def _drop_one(self):
+        """最も古い進捗系メッセージを捨てる（なければ最も古いメッセージ）"""
+        for item in self._queue:
+            if item[0] is not None:
+                self._queue.remove(item)
+                del self._coalescible[item[0]]
+                break
+        else:
+            self._queue.popleft()
+        self.dropped += 1
+
+    async def run_sender(self):
+        """送信キューのメッセージを順にブラウザへ送る"""
+        while True:
+            while not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            key, text = self._queue.popleft()
+            if key is not None:
+                self._coalescible.pop(key, None)
+            await self.websocket.send_text(text)
+            self.sent += 1
+
+class WebSocketHub:
+    def __init__(self, max_queue: int = 256, max_subscriptions: int = 10000):
+        self.max_queue = max_queue
+        self.max_subscriptions = max_subscriptions
+        self.clients: Dict[str, Set[HubClient]] = {}
+        # prompt_id → client_id（再接続しても購読は維持される）
+        self._subscribers: Dict[str, Set[str]] = {}
+        self._client_prompts: Dict[str, Set[str]] = {}
+        self.published = 0
+
+    def connect(self, websocket, client_id: Optional[str] = None) -> HubClient:
+        """ブラウザのWebSocketを登録"""
+        client = HubClient(websocket, client_id or str(uuid.uuid4()), self.max_queue)
+        self.clients.setdefault(client.client_id, set()).add(client)
+        return client
+
+    def disconnect(self, client: HubClient):
+        """ブラウザのWebSocketを登録解除"""
+        clients = self.clients.get(client.client_id)
+        if clients is None:
+            return
+        clients.discard(client)
+        if not clients:
+            del self.clients[client.client_id]
+
+    def is_connected(self, client_id: str) -> bool:
+        """クライアントが接続中か"""
+        return client_id in self.clients
+
+    def subscribe(self, client_id: str, prompt_id: str):
+        """クライアントにプロンプトのイベントを配信するよう登録"""
+        self._subscribers.setdefault(prompt_id, set()).add(client_id)
+        self._client_prompts.setdefault(client_id, set()).add(prompt_id)
+        # 終了イベントを取りこぼした購読が溜まらないよう古いものから削除
+        while len(self._subscribers) > self.max_subscriptions:
+            oldest = next(iter(self._subscribers))
+            for subscriber in list(self._subscribers[oldest]):
+                self.unsubscribe(subscriber, oldest)
+
+    def unsubscribe(self, client_id: str, prompt_id: str):
+        """プロンプトの配信登録を解除"""
+        subscribers = self._subscribers.get(prompt_id)
+        if subscribers is not None:
+            subscribers.discard(client_id)
+            if not subscribers:
+                del self._subscribers[prompt_id]
+        prompt_ids = self._client_prompts.get(client_id)
+        if prompt_ids is not None:
+            prompt_ids.discard(prompt_id)
+            if not prompt_ids:
+                del self._client_prompts[client_id]
+
+    def get_client_prompts(self, client_id: str) -> Set[str]:
+        """クライアントが購読中のprompt_id"""
+        return set(self._client_prompts.get(client_id, ()))
+
+    def publish(self, instance: str, message: Dict[str, Any]):
+        """ComfyUIのイベントを購読中のクライアントへ配信"""
+        event_type = message.get("type")
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if prompt_id is None:
+            if event_type != "status":
+                return
+            # キュー状況は全員に配信（内部のクライアントIDは除く）
+            text = json.dumps({"type": event_type, "data": {"status": data.get("status")}})
+            targets = list(self.clients.keys())
+        else:
+            subscribers = self._subscribers.get(prompt_id)
+            if not subscribers:
+                return
+            text = json.dumps(message)
+            targets = list(subscribers)
+        # ComfyUIはプロンプト終了時にnode=Noneのexecutingを送る（順序を保つため合体しない）
+        # 失敗・中断（取り消しで合成したものを含む）もそこで終わりとして購読を外す
+        finished = prompt_id is not None and (
+            event_type in ("execution_error", "execution_interrupted")
+            or (event_type == "executing" and data.get("node") is None)
+        )
+        coalesce = event_type in COALESCIBLE_EVENTS and not finished
+        self.published += 1
+        for client_id in targets:
+            for client in self.clients.get(client_id, ()):
+                client.enqueue(event_type, prompt_id, text, coalesce)
+
+        if finished:
+            for client_id in targets:
+                self.unsubscribe(client_id, prompt_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """配信状況の統計"""
+        clients = [client for group in self.clients.values() for client in group]
+        return {
+            "clients": len(clients),
+            "subscribed_prompts": len(self._subscribers),
+            "published": self.published,
+            "sent": sum(client.sent for client in clients),
+            "coalesced": sum(client.coalesced for client in clients),
+            "dropped": sum(client.dropped for client in clients)
+        }
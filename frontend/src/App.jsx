@@ -7,7 +7,7 @@ import Txt2ImgTab from './components/Txt2ImgTab'
 import Img2ImgTab from './components/Img2ImgTab'
 import InpaintTab from './components/InpaintTab'
 import Header from './components/Header'
-import { getModels, getSamplers, getSchedulers } from './api/comfyui.js'
+import { getCatalog } from './api/comfyui.js'
 import { API_CONFIG } from './api/config.js'
 
 function App() {
@@ -20,32 +20,16 @@ function App() {
     // 初期データの読み込み
     const loadInitialData = async () => {
       try {
-        const [modelsData, samplersData, schedulersData] = await Promise.all([
-          getModels(),
-          getSamplers(),
-          getSchedulers()
-        ])
+        const catalog = await getCatalog()
         
         // モデルデータの処理
-        if (modelsData && modelsData.models) {
-          setModels(modelsData.models)
-        } else {
-          setModels(API_CONFIG.DEFAULT_MODELS)
-        }
+        setModels(catalog.models?.length ? catalog.models : API_CONFIG.DEFAULT_MODELS)
         
         // サンプラーデータの処理
-        if (samplersData && samplersData.samplers) {
-          setSamplers(samplersData.samplers)
-        } else {
-          setSamplers(API_CONFIG.DEFAULT_SAMPLERS)
-        }
+        setSamplers(catalog.samplers?.length ? catalog.samplers : API_CONFIG.DEFAULT_SAMPLERS)
         
         // スケジューラーデータの処理
-        if (schedulersData && schedulersData.schedulers) {
-          setSchedulers(schedulersData.schedulers)
-        } else {
-          setSchedulers(API_CONFIG.DEFAULT_SCHEDULERS)
-        }
+        setSchedulers(catalog.schedulers?.length ? catalog.schedulers : API_CONFIG.DEFAULT_SCHEDULERS)
         setIsLoading(false)
       } catch (error) {
         console.error('Failed to load initial data:', error)
@@ -22,6 +22,14 @@ apiClient.interceptors.response.use(
   }
 )
 
+// エラー詳細を表示用の文字列に変換（検証エラーはフィールドごとのメッセージを並べる）
+const formatErrorDetail = (detail) => {
+  if (detail?.errors) {
+    return detail.errors.map(error => `${error.field || error.input || error.node}: ${error.message}`).join(', ')
+  }
+  return detail
+}
+
 // 画像生成
 export const generateImage = async (params) => {
   try {
@@ -38,8 +46,11 @@ export const generateImage = async (params) => {
     console.error('Error status:', error.response?.status)
     
     // より詳細なエラーメッセージ
-    if (error.response) {
-      throw new Error(`サーバーエラー: ${error.response.status} - ${error.response.data?.detail || error.message}`)
+    if (error.response?.status === 429) {
+      const retryAfter = error.response.headers?.['retry-after']
+      throw new Error(`サーバーが混雑しています。${retryAfter ? `約${retryAfter}秒後に` : 'しばらくしてから'}再試行してください。`)
+    } else if (error.response) {
+      throw new Error(`サーバーエラー: ${error.response.status} - ${formatErrorDetail(error.response.data?.detail) || error.message}`)
     } else if (error.request) {
       throw new Error('サーバーに接続できません。バックエンドが起動していることを確認してください。')
     } else {
@@ -60,6 +71,13 @@ export const getGenerationHistory = async (promptId) => {
   return response.data
 }
 
+// カタログ（モデル・LoRA・サンプラー・スケジューラー）の一括取得
+// サーバーがETagを返すため、ブラウザのキャッシュ検証で未変更時は304になる
+export const getCatalog = async () => {
+  const response = await apiClient.get('/catalog')
+  return response.data
+}
+
 // モデル一覧の取得
 export const getModels = async () => {
   try {
@@ -118,8 +136,12 @@ export const uploadImage = async (file) => {
 }
 
 // プレビュー画像のURL取得
-export const getPreviewImageUrl = (filename) => {
-  return `${API_BASE_URL}/preview/${filename}`
+export const getPreviewImageUrl = (filename, { subfolder = '', type = 'output', promptId } = {}) => {
+  const params = new URLSearchParams({ subfolder, type })
+  if (promptId) {
+    params.append('prompt_id', promptId)
+  }
+  return `${API_BASE_URL}/preview/${encodeURIComponent(filename)}?${params}`
 }
 
 // WebSocket接続の作成
@@ -150,8 +172,8 @@ export const createWebSocketConnection = (onMessage) => {
   return ws
 }
 
-// 生成状態のポーリング
-export const pollGenerationStatus = async (promptId, onUpdate, interval = 1000) => {
+// 生成状態のポーリング（SSEが使えない環境用）
+const pollStatus = async (promptId, onUpdate, interval) => {
   const poll = async () => {
     try {
       const status = await getGenerationStatus(promptId)
@@ -170,4 +192,51 @@ export const pollGenerationStatus = async (promptId, onUpdate, interval = 1000)
   }
   
   return poll()
-}
\ No newline at end of file
+}
+
+// 生成状態の監視（/api/events/{promptId}のSSEで受け取り、接続できなければポーリングに切り替える）
+// 切断時はEventSourceがLast-Event-IDを付けて自動で再接続するため、途中のイベントを取りこぼさない
+export const pollGenerationStatus = (promptId, onUpdate, interval = 1000) => {
+  if (typeof EventSource === 'undefined') {
+    return pollStatus(promptId, onUpdate, interval)
+  }
+  
+  return new Promise((resolve, reject) => {
+    const source = new EventSource(`${API_BASE_URL}/events/${promptId}`)
+    let progress = null
+    let received = false
+    
+    const finish = (status) => {
+      source.close()
+      onUpdate(status)
+      resolve(status)
+    }
+    const listen = (event, handler) => {
+      source.addEventListener(event, (message) => {
+        received = true
+        handler(JSON.parse(message.data))
+      })
+    }
+    
+    listen('queued', (data) => onUpdate({ status: 'pending', queue_position: data.queue_position, progress: null }))
+    listen('started', () => onUpdate({ status: 'running', queue_position: 0, progress }))
+    listen('executing', (data) => onUpdate({ status: 'running', queue_position: 0, progress, current_node: data.node }))
+    listen('progress', (data) => {
+      progress = data.progress
+      onUpdate({ status: 'running', queue_position: 0, progress, step: data.value, max_steps: data.max })
+    })
+    listen('completed', (data) => finish({ status: 'completed', queue_position: 0, progress: null, outputs: data.outputs }))
+    listen('failed', (data) => finish({ status: 'error', error: data.error }))
+    
+    source.onerror = () => {
+      // 再接続できない（404など）場合はポーリングで続ける
+      if (source.readyState === EventSource.CLOSED) {
+        source.close()
+        if (!received) {
+          console.warn('Event stream unavailable, falling back to polling')
+        }
+        pollStatus(promptId, onUpdate, interval).then(resolve, reject)
+      }
+    }
+  })
+}
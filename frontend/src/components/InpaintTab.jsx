@@ -46,10 +46,11 @@ const InpaintTab = ({ models, samplers, schedulers }) => {
       try {
         const result = await uploadImage(file)
         if (result.success) {
-          setUploadedImage(result.image)
+          // 表示はローカルのファイルから行い、生成には参照IDだけを送る
+          setUploadedImage(URL.createObjectURL(file))
           setSettings(prev => ({
             ...prev,
-            init_image: result.image,
+            init_image: result.image_id,
             width: result.width,
             height: result.height
           }))
@@ -165,7 +166,11 @@ const InpaintTab = ({ models, samplers, schedulers }) => {
         if (finalStatus.status === 'completed') {
           const history = await getGenerationHistory(result.prompt_id)
           const images = history.outputs.map(output => ({
-            url: getPreviewImageUrl(output.filename),
+            url: getPreviewImageUrl(output.filename, {
+              subfolder: output.subfolder,
+              type: output.type,
+              promptId: result.prompt_id
+            }),
             filename: output.filename,
             ...output
           }))
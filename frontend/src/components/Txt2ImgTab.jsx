@@ -71,7 +71,11 @@ const Txt2ImgTab = ({ models, samplers, schedulers }) => {
           const history = await getGenerationHistory(result.prompt_id)
           console.log('Generation history:', history)
           const images = history.outputs.map(output => ({
-            url: getPreviewImageUrl(output.filename),
+            url: getPreviewImageUrl(output.filename, {
+              subfolder: output.subfolder,
+              type: output.type,
+              promptId: result.prompt_id
+            }),
             filename: output.filename,
             ...output
           }))
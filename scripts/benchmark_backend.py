@@ -0,0 +1,641 @@
+#!/usr/bin/env python3
+"""
+バックエンドのベンチマークスクリプト
+ローカルに起動した疑似ComfyUIサーバーに対して各種シナリオを計測する
+
+使い方:
+    python scripts/benchmark_backend.py session --requests 2000 --concurrency 50
+    python scripts/benchmark_backend.py hub --clients 1000 --requests 100
+    python scripts/benchmark_backend.py workflow --requests 20000 --concurrency 8
+    python scripts/benchmark_backend.py microbatch --requests 64 --window-ms 20 --max-batch 8
+    python scripts/benchmark_backend.py fairness --requests 40 --base-time 0.05
+    python scripts/benchmark_backend.py abandon --requests 40 --base-time 0.05 --grace 0.1
+    python scripts/benchmark_backend.py admission --requests 100 --base-time 0.05 --per-image-time 0 --budget 0.5
+"""
+
+import argparse
+import asyncio
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+# backendモジュールを読み込めるようにする
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from abandon_monitor import AbandonMonitor  # noqa: E402
+from admission_control import AdmissionController, AdmissionRejected  # noqa: E402
+from bridge_pool import ComfyUIBridgePool  # noqa: E402
+from comfyui_bridge import ComfyUIBridge  # noqa: E402
+from job_queue import JobQueue  # noqa: E402
+from micro_batcher import MicroBatcher  # noqa: E402
+from workflow_manager import WorkflowManager, compile_template  # noqa: E402
+from ws_hub import WebSocketHub  # noqa: E402
+
+
+def _link(kind):
+    return [kind]
+
+
+def _int(default, minimum, maximum, step=1):
+    return ["INT", {"default": default, "min": minimum, "max": maximum, "step": step}]
+
+
+def _float(default, minimum, maximum, step=0.01):
+    return ["FLOAT", {"default": default, "min": minimum, "max": maximum, "step": step}]
+
+
+# 実際のComfyUIの/object_infoから、WorkflowManagerが使うノードだけを抜き出した定義
+FAKE_OBJECT_INFO = {
+    "CheckpointLoaderSimple": {"input": {"required": {"ckpt_name": [["v1-5-pruned-emaonly.safetensors"]]}}},
+    "VAELoader": {"input": {"required": {"vae_name": [["vae-ft-mse.safetensors"]]}}},
+    "LoraLoader": {"input": {"required": {
+        "model": _link("MODEL"),
+        "clip": _link("CLIP"),
+        "lora_name": [["detail.safetensors"]],
+        "strength_model": _float(1.0, -100.0, 100.0),
+        "strength_clip": _float(1.0, -100.0, 100.0),
+    }}},
+    "CLIPTextEncode": {"input": {"required": {"text": ["STRING", {"multiline": True}], "clip": _link("CLIP")}}},
+    "EmptyLatentImage": {"input": {"required": {
+        "width": _int(512, 16, 16384, 8),
+        "height": _int(512, 16, 16384, 8),
+        "batch_size": _int(1, 1, 4096),
+    }}},
+    "LoadImage": {"input": {"required": {"image": [[], {"image_upload": True}]}}},
+    "LoadImageMask": {"input": {"required": {
+        "image": [[], {"image_upload": True}],
+        "channel": [["alpha", "red", "green", "blue"]],
+    }}},
+    "VAEEncode": {"input": {"required": {"pixels": _link("IMAGE"), "vae": _link("VAE")}}},
+    "VAEEncodeForInpaint": {"input": {"required": {
+        "pixels": _link("IMAGE"),
+        "vae": _link("VAE"),
+        "mask": _link("MASK"),
+        "grow_mask_by": _int(6, 0, 64),
+    }}},
+    "VAEEncodeTiled": {"input": {"required": {
+        "pixels": _link("IMAGE"),
+        "vae": _link("VAE"),
+        "tile_size": _int(512, 64, 4096, 64),
+        "overlap": _int(64, 0, 4096, 32),
+        "temporal_size": _int(64, 8, 4096, 4),
+        "temporal_overlap": _int(8, 4, 4096, 4),
+    }}},
+    "RepeatLatentBatch": {"input": {"required": {"samples": _link("LATENT"), "amount": _int(1, 1, 64)}}},
+    "KSampler": {"input": {"required": {
+        "model": _link("MODEL"),
+        "seed": _int(0, 0, 0xffffffffffffffff),
+        "steps": _int(20, 1, 10000),
+        "cfg": _float(8.0, 0.0, 100.0, 0.1),
+        "sampler_name": [["euler", "euler_ancestral", "dpmpp_2m"]],
+        "scheduler": [["normal", "karras"]],
+        "positive": _link("CONDITIONING"),
+        "negative": _link("CONDITIONING"),
+        "latent_image": _link("LATENT"),
+        "denoise": _float(1.0, 0.0, 1.0),
+    }}},
+    "VAEDecode": {"input": {"required": {"samples": _link("LATENT"), "vae": _link("VAE")}}},
+    "VAEDecodeTiled": {"input": {"required": {
+        "samples": _link("LATENT"),
+        "vae": _link("VAE"),
+        "tile_size": _int(512, 64, 4096, 32),
+        "overlap": _int(64, 0, 4096, 32),
+        "temporal_size": _int(64, 8, 4096, 4),
+        "temporal_overlap": _int(8, 4, 4096, 4),
+    }}},
+    "SaveImage": {"input": {"required": {"images": _link("IMAGE"), "filename_prefix": ["STRING", {"default": "ComfyUI"}]}}},
+}
+
+
+class FakeComfyUI:
+    """ComfyUIのHTTP/WebSocket APIを模した軽量サーバー（プロンプトを1件ずつ擬似実行する）"""
+
+    def __init__(self, base_time: float = 0.0, per_image_time: float = 0.0, steps: int = 4):
+        self.base_time = base_time
+        self.per_image_time = per_image_time
+        self.steps = steps
+        self.history = {}
+        self.pending = asyncio.Queue()
+        self.number = 0
+        self.executed_prompts = 0
+        # /queueで見える待機中・実行中のprompt_idと、削除・中断の要求
+        self.queued = []
+        self.running = None
+        self.deleted = set()
+        self.interrupt_requested = None
+        self.interrupted_prompts = 0
+        self.object_info_requests = 0
+        self.inputs = {}
+        self.upload_requests = 0
+        self.sockets = {}
+        self.runner = None
+        self.worker = None
+        self.url = None
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/system_stats", self.system_stats)
+        app.router.add_get("/queue", self.queue)
+        app.router.add_post("/queue", self.edit_queue)
+        app.router.add_post("/interrupt", self.interrupt)
+        app.router.add_get("/prompt", self.prompt_info)
+        app.router.add_post("/prompt", self.prompt)
+        app.router.add_get("/history/{prompt_id}", self.get_history)
+        app.router.add_get("/object_info", self.object_info)
+        app.router.add_get("/embeddings", self.embeddings)
+        app.router.add_get("/view", self.view)
+        app.router.add_post("/upload/image", self.upload_image)
+        app.router.add_get("/ws", self.websocket)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self.runner = web.AppRunner(self.build_app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        self.worker = asyncio.create_task(self.execute_loop())
+        return self.url
+
+    async def stop(self):
+        if self.worker is not None:
+            self.worker.cancel()
+        for ws in list(self.sockets.values()):
+            await ws.close()
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def send(self, client_id, event_type, data):
+        ws = self.sockets.get(client_id)
+        if ws is not None and not ws.closed:
+            await ws.send_json({"type": event_type, "data": data})
+
+    async def execute_loop(self):
+        while True:
+            prompt_id, client_id, workflow = await self.pending.get()
+            if prompt_id in self.deleted:
+                self.deleted.discard(prompt_id)
+                continue
+            self.queued.remove(prompt_id)
+            self.running = prompt_id
+            batch_size = 1
+            for node in workflow.values():
+                if node.get("class_type") in ("EmptyLatentImage", "RepeatLatentBatch"):
+                    batch_size = node["inputs"].get("batch_size", node["inputs"].get("amount", 1))
+            await self.send(client_id, "execution_start", {"prompt_id": prompt_id})
+            await self.send(client_id, "executing", {"prompt_id": prompt_id, "node": "3"})
+            duration = self.base_time + self.per_image_time * batch_size
+            for step in range(1, self.steps + 1):
+                await asyncio.sleep(duration / self.steps)
+                if self.interrupt_requested == prompt_id:
+                    break
+                await self.send(client_id, "progress", {"prompt_id": prompt_id, "value": step, "max": self.steps})
+            self.running = None
+            if self.interrupt_requested == prompt_id:
+                self.interrupt_requested = None
+                self.interrupted_prompts += 1
+                await self.send(client_id, "execution_interrupted", {"prompt_id": prompt_id})
+                continue
+            images = [
+                {"filename": f"{prompt_id}_{i:05}_.png", "subfolder": "", "type": "output"}
+                for i in range(batch_size)
+            ]
+            self.history[prompt_id] = {
+                "outputs": {"9": {"images": images}},
+                "status": {"status_str": "success", "completed": True},
+            }
+            self.executed_prompts += 1
+            await self.send(client_id, "executed", {"prompt_id": prompt_id, "node": "9", "output": {"images": images}})
+            await self.send(client_id, "execution_success", {"prompt_id": prompt_id})
+            await self.send(client_id, "executing", {"prompt_id": prompt_id, "node": None})
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        client_id = request.query.get("clientId")
+        self.sockets[client_id] = ws
+        async for _ in ws:
+            pass
+        self.sockets.pop(client_id, None)
+        return ws
+
+    async def system_stats(self, request):
+        return web.json_response({"system": {"os": "fake"}, "devices": []})
+
+    async def queue(self, request):
+        return web.json_response({
+            "queue_running": [[0, self.running]] if self.running else [],
+            "queue_pending": [[i + 1, prompt_id] for i, prompt_id in enumerate(self.queued)],
+        })
+
+    async def edit_queue(self, request):
+        data = await request.json()
+        for prompt_id in data.get("delete", []):
+            if prompt_id in self.queued:
+                self.queued.remove(prompt_id)
+                self.deleted.add(prompt_id)
+        return web.Response()
+
+    async def interrupt(self, request):
+        data = await request.json() if request.can_read_body else {}
+        # prompt_idを指定した場合は、それが実行中のときだけ中断する
+        if self.running is not None and data.get("prompt_id", self.running) == self.running:
+            self.interrupt_requested = self.running
+        return web.Response()
+
+    async def prompt_info(self, request):
+        return web.json_response({"exec_info": {"queue_remaining": len(self.queued)}})
+
+    async def prompt(self, request):
+        data = await request.json()
+        prompt_id = data.get("prompt_id") or str(uuid.uuid4())
+        self.number += 1
+        self.queued.append(prompt_id)
+        await self.pending.put((prompt_id, data.get("client_id"), data["prompt"]))
+        return web.json_response({"prompt_id": prompt_id, "number": self.number})
+
+    async def object_info(self, request):
+        self.object_info_requests += 1
+        return web.json_response(FAKE_OBJECT_INFO)
+
+    async def embeddings(self, request):
+        return web.json_response(["easynegative"])
+
+    async def upload_image(self, request):
+        form = await request.post()
+        image = form["image"]
+        self.inputs[image.filename] = image.file.read()
+        self.upload_requests += 1
+        return web.json_response({"name": image.filename, "subfolder": "", "type": "input"})
+
+    async def view(self, request):
+        filename = request.query.get("filename", "")
+        if request.query.get("type") == "input":
+            if filename not in self.inputs:
+                return web.Response(status=404)
+            return web.Response(body=self.inputs[filename], content_type="image/png")
+        if not filename.endswith(".png"):
+            return web.Response(status=404)
+        # ファイル名から決まる擬似画像データ（1MB）
+        body = (filename.encode() * (1024 * 1024 // max(1, len(filename)) + 1))[:1024 * 1024]
+        return web.Response(body=body, content_type="image/png")
+
+    async def get_history(self, request):
+        prompt_id = request.match_info["prompt_id"]
+        if prompt_id in self.history:
+            return web.json_response({prompt_id: self.history[prompt_id]})
+        return web.json_response({})
+
+
+async def run_concurrent(func, total: int, concurrency: int) -> float:
+    """funcをtotal回、最大concurrency並列で実行し、requests/secを返す"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await func()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return total / (time.perf_counter() - start)
+
+
+async def bench_session(args):
+    """呼び出しごとのセッション生成と共有セッションの比較"""
+    fake = FakeComfyUI()
+    url = await fake.start()
+    try:
+        async def per_call_session():
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{url}/history/unknown") as response:
+                    await response.json()
+
+        bridge = ComfyUIBridge(url, connection_limit=args.concurrency)
+        await bridge.start()
+
+        async def pooled_session():
+            await bridge.get_history("unknown")
+
+        per_call = await run_concurrent(per_call_session, args.requests, args.concurrency)
+        pooled = await run_concurrent(pooled_session, args.requests, args.concurrency)
+        await bridge.close()
+
+        print(f"per-call session : {per_call:9.1f} req/s")
+        print(f"pooled session   : {pooled:9.1f} req/s")
+        print(f"speedup          : {pooled / per_call:9.2f}x")
+    finally:
+        await fake.stop()
+
+
+class FakeBrowserSocket:
+    """ブラウザ側WebSocketの代わり（遅い受信側を模擬できる）"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.received = 0
+
+    async def send_text(self, text: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.received += 1
+
+
+async def bench_hub(args):
+    """多数のブラウザ接続に対するWebSocketハブの配信"""
+    fake = FakeComfyUI(base_time=0.02, steps=20)
+    url = await fake.start()
+    pool = ComfyUIBridgePool([url])
+    hub = WebSocketHub(max_queue=args.queue_size)
+    pool.add_event_listener(hub.publish)
+    await pool.start()
+    await asyncio.sleep(0.2)
+    try:
+        sockets = []
+        senders = []
+        for i in range(args.clients):
+            # 10%のクライアントは受信が遅い
+            socket = FakeBrowserSocket(delay=0.05 if i % 10 == 0 else 0.0)
+            client = hub.connect(socket, f"client-{i}")
+            sockets.append(socket)
+            senders.append(asyncio.create_task(client.run_sender()))
+
+        workflow_manager = WorkflowManager()
+        start = time.perf_counter()
+        prompt_ids = []
+        for i in range(args.requests):
+            result = await pool.queue_prompt(workflow_manager.create_txt2img_workflow(prompt=f"bench {i}"))
+            hub.subscribe(f"client-{i % args.clients}", result["prompt_id"])
+            prompt_ids.append(result["prompt_id"])
+        while any(pool.jobs.get(prompt_id)["status"] != "completed" for prompt_id in prompt_ids):
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        await asyncio.sleep(0.5)
+
+        stats = hub.get_stats()
+        events_per_prompt = 5 + fake.steps
+        print(f"clients                 : {args.clients}")
+        print(f"prompts                 : {args.requests} in {elapsed:.2f}s")
+        print(f"upstream sockets        : {len(fake.sockets)} (per-browser relay: {args.clients})")
+        print(f"events published        : {stats['published']}")
+        print(f"messages sent           : {stats['sent']}")
+        print(f"coalesced / dropped     : {stats['coalesced']} / {stats['dropped']}")
+        print(f"per-browser relay would : {args.requests * events_per_prompt * args.clients} messages")
+        for task in senders:
+            task.cancel()
+    finally:
+        await pool.close()
+        await fake.stop()
+
+
+async def bench_workflow(args):
+    """ワークフロー作成1件あたりのコストと、複数スレッドからの同時作成"""
+    workflow_manager = WorkflowManager()
+    loras = [{"name": "a.safetensors", "strength": 0.8}, {"name": "b.safetensors"}]
+    cases = {
+        "txt2img": lambda i: workflow_manager.create_txt2img_workflow(prompt=f"bench {i}", seed=i),
+        "txt2img+2lora+vae": lambda i: workflow_manager.create_txt2img_workflow(
+            prompt=f"bench {i}", seed=i, loras=loras, vae="vae.safetensors"
+        ),
+        "img2img": lambda i: workflow_manager.create_img2img_workflow(prompt=f"bench {i}", seed=i, init_image="in.png"),
+        "inpaint": lambda i: workflow_manager.create_inpaint_workflow(
+            prompt=f"bench {i}", seed=i, init_image="in.png", mask_image="mask.png"
+        ),
+    }
+    for name, build in cases.items():
+        build(0)
+        start = time.perf_counter()
+        for i in range(args.requests):
+            build(i)
+        elapsed = time.perf_counter() - start
+        print(f"{name:20}: {elapsed / args.requests * 1e6:7.2f} us/build")
+    print(f"compiled templates  : {compile_template.cache_info().currsize}")
+
+    # 各スレッドが自分のプロンプトとシードだけを含むワークフローを受け取れるか確認
+    errors = []
+
+    def worker(thread_index: int):
+        for i in range(args.requests // args.concurrency):
+            seed = thread_index * args.requests + i
+            workflow = workflow_manager.create_txt2img_workflow(prompt=f"thread {thread_index}", seed=seed, loras=loras[:i % 3])
+            texts = {node["inputs"].get("text") for node in workflow.values() if node["class_type"] == "CLIPTextEncode"}
+            seeds = {node["inputs"].get("seed") for node in workflow.values() if node["class_type"] == "KSampler"}
+            if f"thread {thread_index}" not in texts or seeds != {seed}:
+                errors.append((thread_index, i))
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"threaded builds     : {args.concurrency} threads, {len(errors)} mismatches")
+
+
+async def bench_microbatch(args):
+    """単発txt2imgを個別に送る場合とまとめ実行の比較（GPU時間 = 固定コスト + 1枚あたりのコスト）"""
+    workflow_manager = WorkflowManager()
+
+    async def run(window: float) -> None:
+        fake = FakeComfyUI(base_time=args.base_time, per_image_time=args.per_image_time)
+        url = await fake.start()
+        pool = ComfyUIBridgePool([url])
+        await pool.start()
+        await asyncio.sleep(0.2)
+        batcher = MicroBatcher(pool.queue_prompt, window=window, max_batch_size=args.max_batch)
+        try:
+            async def one(i: int):
+                # ユーザーごとに少しずつずれて届く単発リクエスト
+                await asyncio.sleep(i * 0.002)
+                result = await batcher.submit(workflow_manager.create_txt2img_workflow(prompt="bench"))
+                return batcher.resolve(result["prompt_id"])[0]
+
+            start = time.perf_counter()
+            prompt_ids = set(await asyncio.gather(*(one(i) for i in range(args.requests))))
+            while any(pool.jobs.get(prompt_id)["status"] != "completed" for prompt_id in prompt_ids):
+                await asyncio.sleep(0.01)
+            elapsed = time.perf_counter() - start
+            images = sum(len(pool.jobs.get(prompt_id)["outputs"]) for prompt_id in prompt_ids)
+            label = f"window {window * 1000:.0f}ms" if window else "no batching"
+            print(f"{label:16}: {fake.executed_prompts:4} prompts, {images} images in {elapsed:6.2f}s ({images / elapsed:6.1f} images/s)")
+        finally:
+            await pool.close()
+            await fake.stop()
+
+    await run(0.0)
+    await run(args.window_ms / 1000)
+
+
+async def bench_fairness(args):
+    """1人が大量に投入した直後に別の利用者が1件投入した場合の待ち時間（ComfyUIへ直接 vs バックエンドの待ち行列）"""
+    workflow_manager = WorkflowManager()
+
+    async def run(use_queue: bool) -> None:
+        fake = FakeComfyUI(base_time=args.base_time, per_image_time=args.per_image_time)
+        url = await fake.start()
+        pool = ComfyUIBridgePool([url])
+        await pool.start()
+        await asyncio.sleep(0.2)
+        queue = JobQueue(pool.queue_prompt, lambda: 1)
+        pool.add_event_listener(queue.handle_event)
+        queue.start()
+        submit = queue.submit if use_queue else (lambda workflow, owner: pool.queue_prompt(workflow))
+        try:
+            for i in range(args.requests):
+                await submit(workflow_manager.create_txt2img_workflow(prompt=f"grid {i}", seed=i), owner="heavy")
+            start = time.perf_counter()
+            result = await submit(workflow_manager.create_txt2img_workflow(prompt="single", seed=0), owner="light")
+            while (pool.jobs.get(result["prompt_id"]) or {}).get("status") != "completed":
+                await asyncio.sleep(0.005)
+            label = "fair queue" if use_queue else "direct (FIFO)"
+            print(f"{label:14}: light user's prompt finished after {time.perf_counter() - start:6.2f}s behind {args.requests} queued prompts")
+        finally:
+            await queue.close()
+            await pool.close()
+            await fake.stop()
+
+    await run(False)
+    await run(True)
+
+
+async def bench_abandon(args):
+    """半数のクライアントが送信直後に切断して戻らない場合のComfyUIでの実行数と所要時間（取り消しなし vs 猶予後に取り消し）"""
+    workflow_manager = WorkflowManager()
+
+    async def run(cancel_abandoned: bool) -> None:
+        fake = FakeComfyUI(base_time=args.base_time, per_image_time=args.per_image_time)
+        url = await fake.start()
+        pool = ComfyUIBridgePool([url])
+        await pool.start()
+        await asyncio.sleep(0.2)
+        queue = JobQueue(pool.queue_prompt, lambda: 1)
+        pool.add_event_listener(queue.handle_event)
+        queue.start()
+
+        async def cancel(prompt_id):
+            if queue.cancel(prompt_id):
+                pool.publish_event(None, {"type": "execution_interrupted", "data": {"prompt_id": prompt_id}})
+                return "dequeued"
+            sending = queue.dispatching(prompt_id)
+            if sending is not None:
+                await asyncio.shield(sending)
+            return (await pool.cancel_prompt(prompt_id))["status"]
+
+        monitor = AbandonMonitor(cancel, grace=args.grace)
+        pool.add_event_listener(monitor.handle_event)
+        try:
+            start = time.perf_counter()
+            prompt_ids = []
+            for i in range(args.requests):
+                client_id = f"client-{i}"
+                monitor.connected(client_id)
+                result = await queue.submit(workflow_manager.create_txt2img_workflow(prompt=f"job {i}", seed=i), owner=client_id)
+                prompt_ids.append(result["prompt_id"])
+                if cancel_abandoned:
+                    monitor.watch(result["prompt_id"], client_id)
+                if i % 2:
+                    monitor.disconnected(client_id)
+            while any((pool.jobs.get(prompt_id) or {}).get("status") not in ("completed", "error") for prompt_id in prompt_ids):
+                await asyncio.sleep(0.01)
+            elapsed = time.perf_counter() - start
+            label = f"cancel after {args.grace:.2f}s" if cancel_abandoned else "no cancellation"
+            print(f"{label:20}: {fake.executed_prompts:4} executed, {fake.interrupted_prompts:3} interrupted, "
+                  f"{monitor.stats['abandoned']:4} abandoned, all settled in {elapsed:6.2f}s")
+        finally:
+            monitor.close()
+            await queue.close()
+            await pool.close()
+            await fake.stop()
+
+    await run(False)
+    await run(True)
+
+
+async def bench_admission(args):
+    """処理能力の2倍の速度でリクエストが届いた場合の待ち時間（受け付け制御なし vs 予算超過で429）"""
+    workflow_manager = WorkflowManager()
+
+    async def run(budget: float) -> None:
+        fake = FakeComfyUI(base_time=args.base_time, per_image_time=args.per_image_time)
+        url = await fake.start()
+        pool = ComfyUIBridgePool([url])
+        await pool.start()
+        await asyncio.sleep(0.2)
+        queue = JobQueue(pool.queue_prompt, lambda: 1)
+        pool.add_event_listener(queue.handle_event)
+        queue.start()
+        admission = AdmissionController(
+            lambda: [url], {"interactive": budget}, seconds_per_unit=args.base_time, instance_of=pool.get_instance
+        )
+        pool.add_event_listener(admission.handle_event)
+        finished = {}
+        pool.add_event_listener(
+            lambda instance, message: finished.setdefault(message["data"]["prompt_id"], time.perf_counter())
+            if message.get("type") == "execution_success" else None
+        )
+        try:
+            interval = (args.base_time + args.per_image_time) / 2
+            arrivals = {}
+            rejected = 0
+            for i in range(args.requests):
+                workflow = workflow_manager.create_txt2img_workflow(prompt=f"spike {i}", seed=i)
+                try:
+                    admission.check("interactive", 1.0)
+                except AdmissionRejected:
+                    rejected += 1
+                else:
+                    ticket = admission.admit("interactive", 1.0)
+                    result = await queue.submit(workflow, owner=f"user-{i}")
+                    admission.assign(ticket, result["prompt_id"])
+                    arrivals[result["prompt_id"]] = time.perf_counter()
+                await asyncio.sleep(interval)
+            while len(finished.keys() & arrivals.keys()) < len(arrivals):
+                await asyncio.sleep(0.01)
+            latencies = sorted(finished[prompt_id] - arrived for prompt_id, arrived in arrivals.items())
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            label = f"budget {budget:.2f}s" if budget > 0 else "no admission"
+            print(f"{label:14}: {len(arrivals):4} admitted, {rejected:4} rejected (429), p50 {p50:6.2f}s, p95 {p95:6.2f}s")
+        finally:
+            await queue.close()
+            await pool.close()
+            await fake.stop()
+
+    await run(0.0)
+    await run(args.budget)
+
+
+SCENARIOS = {
+    "session": bench_session,
+    "hub": bench_hub,
+    "workflow": bench_workflow,
+    "microbatch": bench_microbatch,
+    "fairness": bench_fairness,
+    "abandon": bench_abandon,
+    "admission": bench_admission,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="バックエンドのベンチマーク")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--queue-size", type=int, default=256)
+    parser.add_argument("--window-ms", type=float, default=20)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--base-time", type=float, default=0.1)
+    parser.add_argument("--per-image-time", type=float, default=0.02)
+    parser.add_argument("--grace", type=float, default=0.1)
+    parser.add_argument("--budget", type=float, default=0.5)
+    args = parser.parse_args()
+    asyncio.run(SCENARIOS[args.scenario](args))
+
+
+if __name__ == "__main__":
+    main()